@@ -0,0 +1,74 @@
+"""Measures the cost of committing a single watch in every database backend
+
+Usage: PYTHONPATH=. python benchmarks/commit_benchmark.py [shows] [episodes per show] [commits]
+"""
+
+from datetime import datetime
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from showtime.database import (Database, get_cashed_write_db, get_compact_db, get_journaled_db,
+                               transaction)
+from showtime.sqlite_database import get_sqlite_db
+from showtime.types import TVMazeShow
+
+BACKENDS: Dict[str, Callable[[str], Database]] = {
+    'json': get_cashed_write_db,
+    'journal': get_journaled_db,
+    'compact': get_compact_db,
+    'sqlite': get_sqlite_db,  # type: ignore
+}
+
+
+def populate(database: Database, shows: int, episodes: int) -> None:
+    """Adds shows with episodes"""
+    with transaction(database) as transacted_db:
+        for show_id in range(1, shows + 1):
+            transacted_db.add_show(TVMazeShow(id=show_id, name=f'show {show_id}', premiered='2020-01-01',
+                                              status='Running', url='', externals={}))
+            transacted_db.insert_episodes([{
+                'id': show_id * 10000 + number,
+                'show_id': show_id,
+                'season': 1,
+                'number': number,
+                'name': f'episode {number}',
+                'airdate': '2020-01-01',
+                'runtime': 30,
+                'watched': '',
+            } for number in range(1, episodes + 1)])
+
+
+def measure(database: Database, shows: int, commits: int) -> List[float]:
+    """Returns seconds taken by every commit of a single watched episode"""
+    timings = []
+    for commit in range(commits):
+        episode_id = (commit % shows + 1) * 10000 + 1
+        start = time.perf_counter()
+        with transaction(database) as transacted_db:
+            transacted_db.update_watched(episode_id, commit % 2 == 0, datetime.now())
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    """Runs the benchmark for all backends"""
+    args = [int(arg) for arg in sys.argv[1:4]]
+    shows, episodes, commits = args + [200, 100, 50][len(args):]
+    print(f'{shows} shows, {episodes} episodes each, {commits} commits')
+    for name, factory in BACKENDS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, f'showtime.{name}')
+            database = factory(file_name)
+            populate(database, shows, episodes)
+            timings = sorted(measure(database, shows, commits))
+            database.close()
+            size = sum(os.path.getsize(os.path.join(directory, entry)) for entry in os.listdir(directory))
+            print(f'{name:>8}: median {timings[len(timings) // 2] * 1000:8.2f} ms, '
+                  f'max {timings[-1] * 1000:8.2f} ms, files {size / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -36,7 +36,6 @@ setup(
     ],
     install_requires=[
         'cmd2==3.5.1',
-        'ratelimit==2.2.1',
         'tinydb==4.9.0',
         'terminaltables==3.1.10',
         'python-dateutil==2.9.0.post0',
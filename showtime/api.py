@@ -1,15 +1,34 @@
 """API client module"""
 
-from dataclasses import dataclass
+import codecs
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import chain
+import http.client
 import json
+import queue
+import threading
+import time
 from urllib.parse import urlencode, urlparse, urlunparse
-import urllib.request
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
+import zlib
 
+from showtime.cache import CacheEntry, ResponseCache, get_header
+from showtime.metrics import Metrics
+from showtime.retry import RETRYABLE_STATUSES, RetryPolicy, parse_retry_after
+from showtime.throttle import TokenBucket
 from showtime.types import ShowId, TVMazeEpisode, TVMazeShow
 
 API_BASE_URL = "https://api.tvmaze.com"
 
+DEFAULT_NUM_POOLS = 10
+DEFAULT_MAXSIZE = 4
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# show fields which have to be decoded before its episodes can be streamed
+STREAMED_SHOW_FIELDS = ('id', 'name', 'premiered', 'status', 'url', 'externals', 'updated')
+
 
 def episode_to_model(episode: Dict) -> TVMazeEpisode:
     return TVMazeEpisode(
@@ -29,7 +48,8 @@ def show_to_model(show: Dict) -> TVMazeShow:
         premiered=show['premiered'],
         status=show['status'],
         url=show['url'],
-        externals=show['externals']
+        externals=show['externals'],
+        updated=show.get('updated') or 0,
     )
 
 
@@ -39,25 +59,555 @@ def search_to_model(show_wrapped) -> TVMazeShow:
 
 @dataclass
 class HTTPResponse:
-    data: str
+    data: bytes
+    status: int = 200
+    headers: Dict[str, str] = field(default_factory=dict)
+    cached: bool = False
+
+
+class HTTPError(Exception):
+    """Raised when the server responds with an error status"""
+
+    def __init__(self, url: str, status: int, headers: Dict[str, str]) -> None:
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+        self.headers = headers
+
+
+class StreamError(Exception):
+    """Raised when reading a response body fails after the response was handed over"""
+
+
+class CacheMissError(Exception):
+    """Raised in offline mode when the response is not cached"""
+
+    def __init__(self, url: str) -> None:
+        super().__init__(f"{url} is not cached")
+        self.url = url
+
+
+def _decode_content(data: bytes, encoding: Optional[str]) -> bytes:
+    """Decompresses gzip/deflate encoded response body"""
+    if not encoding or not data:
+        return data
+    encoding = encoding.strip().lower()
+    if encoding == 'gzip':
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # some servers send raw deflate stream without the zlib header
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+
+class _ContentDecoder():
+    """Incremental gzip/deflate decoder for streamed response bodies"""
+
+    def __init__(self, encoding: Optional[str]) -> None:
+        encoding = (encoding or '').strip().lower()
+        self._raw_fallback = encoding == 'deflate'
+        if encoding == 'gzip':
+            self._decoder: Optional[Any] = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = None
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decodes next chunk"""
+        if self._decoder is None:
+            return data
+        try:
+            decoded = self._decoder.decompress(data)
+        except zlib.error:
+            if not self._raw_fallback:
+                raise
+            # some servers send raw deflate stream without the zlib header
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._decoder.decompress(data)
+        self._raw_fallback = False
+        return decoded
+
+    def flush(self) -> bytes:
+        """Returns remaining decoded data"""
+        return self._decoder.flush() if self._decoder is not None else b''
+
+
+def _chunked(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Splits data in chunks"""
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+_NUMBER_CHARACTERS = frozenset('0123456789.eE+-')
+
+
+class _JSONStreamReader:
+    """Pull reader decoding JSON values from byte chunks
+
+    Only the unparsed tail of the stream is kept in memory.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self._position = 0
+        self._finished = False
+
+    def _fill(self) -> bool:
+        """Appends the next chunk to the buffer, returns False at the end of the stream"""
+        if self._finished:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._finished = True
+            text = self._text_decoder.decode(b'', final=True)
+        else:
+            text = self._text_decoder.decode(chunk)
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return True
+
+    def _may_continue(self, item: Any, end: int) -> bool:
+        """Checks if a value decoded up to end may continue in the next chunk"""
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            # a number split after '.' or 'e' decodes as a shorter number followed by garbage
+            while end < len(self._buffer) and self._buffer[end] in _NUMBER_CHARACTERS:
+                end += 1
+        return end == len(self._buffer)
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character, empty string at the end of the stream"""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position].isspace():
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ''
+
+    def expect(self, character: str) -> None:
+        """Consumes the next non-whitespace character, raises ValueError if it is a different one"""
+        found = self.peek()
+        if not found:
+            raise ValueError('Unexpected end of JSON stream')
+        if found != character:
+            raise ValueError(f"Expected '{character}' in JSON stream, found '{found}'")
+        self._position += 1
+
+    def value(self) -> Any:
+        """Decodes the next complete value"""
+        self.peek()
+        while True:
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._finished:
+                    raise
+                end = -1
+            if end != -1 and (self._finished or not self._may_continue(item, end)):
+                self._position = end
+                return item
+            self._fill()
+
+    def iter_array(self) -> Iterator[Any]:
+        """Decodes the items of the array at the current position one at a time"""
+        self.expect('[')
+        if self.peek() == ']':
+            self._position += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self._position += 1
+                return
+            self.expect(',')
+
+    def iter_object(self) -> Iterator[str]:
+        """Yields the keys of the object at the current position
+
+        The value of each key has to be consumed before asking for the next key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self._position += 1
+                return
+            self.expect(',')
+
+    def drain(self) -> None:
+        """Consumes the rest of the stream so the connection can be reused"""
+        for _ in self._chunks:
+            pass
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Incrementally decodes items of a JSON array from byte chunks
+
+    Only the current item and the unparsed tail of the stream are kept in memory.
+    """
+    reader = _JSONStreamReader(chunks)
+    yield from reader.iter_array()
+    reader.drain()
+
+
+def _iter_show_parts(reader: _JSONStreamReader) -> Iterator[Tuple[Optional[str], Any]]:
+    """Yields fields of a show as (key, value) and its embedded episodes as (None, episode)"""
+    for key in reader.iter_object():
+        if key != '_embedded':
+            yield key, reader.value()
+            continue
+        for embedded_key in reader.iter_object():
+            if embedded_key == 'episodes':
+                yield from ((None, episode) for episode in reader.iter_array())
+            else:
+                reader.value()
+    reader.drain()
+
+
+def _wrap_stream_errors(episodes: Iterator[TVMazeEpisode]) -> Iterator[TVMazeEpisode]:
+    """Raises StreamError for connection and decoding errors while episodes are read"""
+    try:
+        yield from episodes
+    except (http.client.HTTPException, OSError, ValueError) as error:
+        raise StreamError(f"Reading episodes failed: {error}") from error
+
+
+def decode_show_with_episodes(chunks: Iterable[bytes]) -> Tuple[Dict, Iterator[TVMazeEpisode]]:
+    """Incrementally decodes a show with embedded episodes from byte chunks
+
+    The show is decoded right away, its episodes are decoded one at a time while the returned
+    iterator is read. Episodes preceding any of the STREAMED_SHOW_FIELDS are kept until the show
+    is complete.
+    """
+    parts = _iter_show_parts(_JSONStreamReader(chunks))
+    raw_show: Dict[str, Any] = {}
+    pending: List[Dict] = []
+    for key, value in parts:
+        if key is not None:
+            raw_show[key] = value
+        elif all(field in raw_show for field in STREAMED_SHOW_FIELDS):
+            later = (episode for key, episode in parts if key is None)
+            return raw_show, _wrap_stream_errors(map(episode_to_model, chain([value], later)))
+        else:
+            pending.append(value)
+    return raw_show, map(episode_to_model, pending)
+
+
+PoolKey = Tuple[str, str, Optional[int]]
+
+
+class ConnectionPool():
+    """Keep-alive connections to a single host"""
+
+    def __init__(self, scheme: str, host: str, port: Optional[int],
+                 maxsize: int = DEFAULT_MAXSIZE, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize)
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        """Opens new connection to the host"""
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """Returns connection and flag if it was reused, blocks when the per-host limit is reached"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def put(self, connection: http.client.HTTPConnection) -> None:
+        """Returns connection to the pool so it can be reused"""
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        self._slots.release()
+
+    def discard(self, connection: http.client.HTTPConnection) -> None:
+        """Closes broken connection and frees its slot"""
+        connection.close()
+        self._slots.release()
+
+    def close(self) -> None:
+        """Closes all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
 
 
 class HTTPClient():
-    """HTTP Client"""
+    """HTTP Client with keep-alive connection pooling and optional response cache
+
+    In offline mode responses are served only from the cache, regardless of their freshness.
+    Every request that goes to the network takes a token from the rate limiter, cache hits are free.
+    Connection errors and transient error statuses are retried when a retry policy is set.
+    Latency, transferred bytes, statuses, cache hits and rate limiter waits are recorded in metrics.
+    """
+
+    def __init__(self, num_pools: int = DEFAULT_NUM_POOLS, maxsize: int = DEFAULT_MAXSIZE,
+                 timeout: float = DEFAULT_TIMEOUT, cache: Optional[ResponseCache] = None,
+                 offline: bool = False, rate_limiter: Optional[TokenBucket] = None,
+                 retry: Optional[RetryPolicy] = None, metrics: Optional[Metrics] = None) -> None:
+        self.num_pools = num_pools
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.metrics = metrics
+        self._local = threading.local()
+        self._pools: OrderedDict[PoolKey, ConnectionPool] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_pool(self, scheme: str, host: str, port: Optional[int]) -> ConnectionPool:
+        """Returns the pool for a host, least recently used pools are closed over num_pools"""
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool:
+                self._pools.move_to_end(key)
+                return pool
+            pool = ConnectionPool(scheme, host, port, maxsize=self.maxsize, timeout=self.timeout)
+            self._pools[key] = pool
+            while len(self._pools) > self.num_pools:
+                _, evicted = self._pools.popitem(last=False)
+                evicted.close()
+            return pool
+
+    def _open(self, pool: ConnectionPool, method: str, path: str,
+              headers: Dict[str, str]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Sends request over pooled connection, retries once if a reused connection went stale"""
+        while True:
+            connection, reused = pool.get()
+            try:
+                connection.request(method, path, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                pool.discard(connection)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                pool.discard(connection)
+                raise
+
+    def _release(self, pool: ConnectionPool, connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse) -> None:
+        """Returns fully read connection to the pool unless the server is closing it"""
+        if response.will_close:
+            pool.discard(connection)
+        else:
+            pool.put(connection)
+
+    def _read(self, pool: ConnectionPool, connection: http.client.HTTPConnection,
+              response: http.client.HTTPResponse) -> Tuple[int, Dict[str, str], bytes]:
+        """Reads the whole response body and releases the connection"""
+        try:
+            data = response.read()
+        except BaseException:
+            pool.discard(connection)
+            raise
+        self._release(pool, connection, response)
+        self._local.transferred = getattr(self._local, 'transferred', 0) + len(data)
+        return response.status, dict(response.getheaders()), data
 
-    def request(self, _method: str, url: str, fields: dict[str, str]={}) -> Any:
+    def _open_with_retry(self, method: str, final_url: str, headers: Dict[str, str]
+                         ) -> Tuple[ConnectionPool, http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Opens response, retrying connection errors and retryable statuses according to the retry policy"""
+        parsed = urlparse(final_url)
+        pool = self._get_pool(parsed.scheme, parsed.hostname or '', parsed.port)
+        path = urlunparse(('', '', parsed.path or '/', parsed.params, parsed.query, ''))
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.retry:
+                self.retry.breaker.before_request(pool.host)
+            if self.rate_limiter:
+                self._local.waited = getattr(self._local, 'waited', 0.0) + self.rate_limiter.acquire()
+            try:
+                connection, response = self._open(pool, method, path, headers)
+            except (http.client.HTTPException, OSError):
+                if not self.retry:
+                    raise
+                self.retry.breaker.record_failure(pool.host)
+                if not self.retry.should_retry(attempt):
+                    raise
+                self.retry.sleep(self.retry.get_delay(attempt))
+                continue
+            if not self.retry:
+                return pool, connection, response
+            if response.status not in RETRYABLE_STATUSES:
+                self.retry.breaker.record_success(pool.host)
+                return pool, connection, response
+            status, response_headers, _ = self._read(pool, connection, response)
+            if status != 429:
+                # rate limiting is handled by Retry-After, it doesn't mean the host is failing
+                self.retry.breaker.record_failure(pool.host)
+            if not self.retry.should_retry(attempt):
+                raise HTTPError(final_url, status, response_headers)
+            retry_after = parse_retry_after(get_header(response_headers, 'Retry-After'))
+            self.retry.sleep(self.retry.get_delay(attempt, retry_after))
+
+    def _prepare(self, method: str, url: str,
+                 fields: Dict[str, str]) -> Tuple[str, Dict[str, str], Optional[CacheEntry]]:
+        """Returns the final url, request headers and the cached entry if any"""
         headers = {
             "User-Agent": "showtime-cli",
-            "Accept": "application/json"
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
         }
 
         url_parts = list(urlparse(url))
         url_parts[4] = urlencode(fields)
         final_url = urlunparse(url_parts)
-        print(final_url)
-        request = urllib.request.Request(final_url, headers=headers)
-        with urllib.request.urlopen(request) as response:
-            return HTTPResponse(data=response.read())
+
+        entry = self.cache.get(final_url) if self.cache and method == 'GET' else None
+        if entry and not (self.offline or entry.is_fresh(time.time())):
+            headers.update(entry.conditional_headers())
+        elif not entry and self.offline:
+            raise CacheMissError(final_url)
+        return final_url, headers, entry
+
+    def _is_usable(self, entry: Optional[CacheEntry]) -> bool:
+        """Returns true if cached entry can be returned without a request"""
+        return entry is not None and (self.offline or entry.is_fresh(time.time()))
+
+    def _start_measurement(self) -> float:
+        """Resets per-request counters of the current thread and returns the start time"""
+        self._local.waited = 0.0
+        self._local.transferred = 0
+        return time.monotonic()
+
+    def _record(self, url: str, started: float, status: Optional[int] = None, cached: bool = False,
+                error: Optional[BaseException] = None) -> None:
+        """Records metrics of a finished request, the time spent waiting for the rate limiter is excluded"""
+        if not self.metrics:
+            return
+        waited = getattr(self._local, 'waited', 0.0)
+        if waited:
+            self.metrics.record_rate_limit_wait(url, waited)
+        if error is not None and status is None:
+            self.metrics.record_error(url, error)
+            return
+        latency = max(0.0, time.monotonic() - started - waited)
+        self.metrics.record_request(url, status, latency, getattr(self._local, 'transferred', 0), cached)
+
+    def request(self, method: str, url: str, fields: dict[str, str]={}) -> HTTPResponse:
+        """Performs HTTP request and returns the decoded response"""
+        started = self._start_measurement()
+        try:
+            response = self._request(method, url, fields)
+        except HTTPError as error:
+            self._record(url, started, status=error.status)
+            raise
+        except Exception as error:
+            self._record(url, started, error=error)
+            raise
+        self._record(url, started, status=response.status, cached=response.cached)
+        return response
+
+    def _request(self, method: str, url: str, fields: Dict[str, str]) -> HTTPResponse:
+        """Returns response from the cache or from the network"""
+        final_url, headers, entry = self._prepare(method, url, fields)
+        if entry and self._is_usable(entry):
+            return HTTPResponse(data=entry.data, headers=entry.headers, cached=True)
+
+        pool, connection, response = self._open_with_retry(method, final_url, headers)
+        status, response_headers, data = self._read(pool, connection, response)
+        if status == 304 and entry and self.cache:
+            entry = self.cache.refresh(entry, response_headers)
+            return HTTPResponse(data=entry.data, status=status, headers=entry.headers, cached=True)
+        if status >= 400:
+            raise HTTPError(final_url, status, response_headers)
+        data = _decode_content(data, get_header(response_headers, 'Content-Encoding'))
+        if self.cache and method == 'GET':
+            self.cache.put(final_url, data, response_headers)
+        return HTTPResponse(data=data, status=status, headers=response_headers)
+
+    def stream(self, method: str, url: str, fields: dict[str, str]={},
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """Performs HTTP request and yields the decoded response body in chunks"""
+        started = self._start_measurement()
+        try:
+            status, cached = yield from self._stream(method, url, fields, chunk_size)
+        except HTTPError as error:
+            self._record(url, started, status=error.status)
+            raise
+        except Exception as error:
+            self._record(url, started, error=error)
+            raise
+        self._record(url, started, status=status, cached=cached)
+
+    def _stream(self, method: str, url: str, fields: Dict[str, str],
+                chunk_size: int) -> Generator[bytes, None, Tuple[int, bool]]:
+        """Yields body chunks from the cache or from the network, returns the status and if it was cached"""
+        final_url, headers, entry = self._prepare(method, url, fields)
+        if entry and self._is_usable(entry):
+            yield from _chunked(entry.data, chunk_size)
+            return 200, True
+
+        pool, connection, response = self._open_with_retry(method, final_url, headers)
+        response_headers = dict(response.getheaders())
+        if response.status == 304 or response.status >= 400:
+            response.read()
+            self._release(pool, connection, response)
+            if response.status == 304 and entry and self.cache:
+                yield from _chunked(self.cache.refresh(entry, response_headers).data, chunk_size)
+                return 304, True
+            raise HTTPError(final_url, response.status, response_headers)
+
+        decoder = _ContentDecoder(get_header(response_headers, 'Content-Encoding'))
+        writer = self.cache.open_writer(final_url, response_headers) if self.cache and method == 'GET' else None
+        try:
+            while True:
+                chunk = response.read(chunk_size)
+                self._local.transferred += len(chunk)
+                data = decoder.decompress(chunk) if chunk else decoder.flush()
+                if writer and data:
+                    writer.write(data)
+                if data:
+                    yield data
+                if not chunk:
+                    break
+        except BaseException:
+            pool.discard(connection)
+            if writer:
+                writer.abort()
+            raise
+        self._release(pool, connection, response)
+        if writer:
+            writer.commit()
+        return response.status, False
+
+    def close(self) -> None:
+        """Closes all pooled connections"""
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
 
 
 class Api():
@@ -66,26 +616,60 @@ class Api():
     def __init__(self, http: HTTPClient) -> None:
         self.http = http
 
+    def metrics(self) -> Optional[Metrics]:
+        """returns request metrics collected by the http client"""
+        return self.http.metrics
+
+    def retry(self) -> Optional[RetryPolicy]:
+        """returns retry policy of the http client"""
+        return self.http.retry
+
     def episodes_list(self, show_id: ShowId) -> List[TVMazeEpisode]:
         """returns list of episodes for a show"""
         response = self.http.request('GET', f"{API_BASE_URL}/shows/{show_id}/episodes")
         raw_episodes = json.loads(response.data.decode('utf-8'))
         return list(map(episode_to_model, raw_episodes))
 
+    def episodes_stream(self, show_id: ShowId) -> Iterator[TVMazeEpisode]:
+        """returns episodes for a show, decoded incrementally from the response stream"""
+        chunks = self.http.stream('GET', f"{API_BASE_URL}/shows/{show_id}/episodes")
+        return map(episode_to_model, iter_json_array(chunks))
+
     def show_get(self, show_id: ShowId) -> Optional[TVMazeShow]:
         """returns show information"""
         response = self.http.request('GET', f"{API_BASE_URL}/shows/{show_id}")
         raw_show = json.loads(response.data.decode('utf-8'))
         return show_to_model(raw_show)
 
+    def show_get_with_episodes(self, show_id: ShowId) -> Tuple[Optional[TVMazeShow], Iterator[TVMazeEpisode]]:
+        """returns show information and its episodes using a single request
+
+        The episodes are read from the response stream while the returned iterator is consumed.
+        """
+        chunks = self.http.stream('GET', f"{API_BASE_URL}/shows/{show_id}", fields={'embed': 'episodes'})
+        raw_show, episodes = decode_show_with_episodes(chunks)
+        return show_to_model(raw_show), episodes
+
     def show_search(self, query: str) -> List[TVMazeShow]:
         """returns list of shows matching search string"""
         response = self.http.request('GET', f"{API_BASE_URL}/search/shows", fields={'q': query})
         raw_shows = json.loads(response.data.decode('utf-8'))
         return list(map(search_to_model, raw_shows))
 
-
-def get_default_pool_manager():
-    return HTTPClient()
+    def show_updates(self, since: Optional[str] = None) -> Dict[ShowId, int]:
+        """returns map of show id to the timestamp of its last upstream update"""
+        fields = {'since': since} if since else {}
+        response = self.http.request('GET', f"{API_BASE_URL}/updates/shows", fields=fields)
+        raw_updates = json.loads(response.data.decode('utf-8'))
+        return {ShowId(show_id): int(updated) for show_id, updated in raw_updates.items()}
 
 
+def get_default_pool_manager(num_pools: int = DEFAULT_NUM_POOLS, maxsize: int = DEFAULT_MAXSIZE,
+                             cache: Optional[ResponseCache] = None, offline: bool = False,
+                             rate_limiter: Optional[TokenBucket] = None,
+                             retry: Optional[RetryPolicy] = None,
+                             metrics: Optional[Metrics] = None) -> HTTPClient:
+    """Returns pooled HTTP client sharing a single rate limiter and retry policy for all requests"""
+    return HTTPClient(num_pools=num_pools, maxsize=maxsize, cache=cache, offline=offline,
+                      rate_limiter=rate_limiter or TokenBucket(), retry=retry or RetryPolicy(),
+                      metrics=metrics)
@@ -0,0 +1,198 @@
+"""HTTP response cache module"""
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Cache-Control']
+
+
+def get_header(headers: Dict[str, str], name: str) -> Optional[str]:
+    """Returns header value using case-insensitive name lookup"""
+    name = name.lower()
+    return next((value for key, value in headers.items() if key.lower() == name), None)
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parses Cache-Control header into directives"""
+    directives: Dict[str, Optional[str]] = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def get_max_age(headers: Dict[str, str]) -> int:
+    """Returns for how many seconds a response can be used without revalidation"""
+    directives = parse_cache_control(get_header(headers, 'Cache-Control'))
+    if 'no-cache' in directives:
+        return 0
+    try:
+        return max(0, int(directives.get('max-age') or 0))
+    except ValueError:
+        return 0
+
+
+def is_storable(headers: Dict[str, str]) -> bool:
+    """Returns true if response is allowed to be stored"""
+    return 'no-store' not in parse_cache_control(get_header(headers, 'Cache-Control'))
+
+
+@dataclass
+class CacheEntry:
+    """Cached response"""
+    url: str
+    data: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+    stored: float = 0.0
+    max_age: int = 0
+
+    def is_fresh(self, now: float) -> bool:
+        """Returns true if entry can be used without revalidation"""
+        return now < self.stored + self.max_age
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Returns headers used to revalidate the entry"""
+        headers = {}
+        etag = get_header(self.headers, 'ETag')
+        if etag:
+            headers['If-None-Match'] = etag
+        last_modified = get_header(self.headers, 'Last-Modified')
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+
+class CacheWriter():
+    """Writes a cache entry incrementally, the entry becomes visible on commit"""
+
+    def __init__(self, cache: 'ResponseCache', entry: CacheEntry) -> None:
+        self.cache = cache
+        self.entry = entry
+        handle, self._temp_path = tempfile.mkstemp(dir=cache.path, prefix='.tmp')
+        self._file: BinaryIO = os.fdopen(handle, 'wb')
+        meta = {'url': entry.url, 'headers': entry.headers, 'stored': entry.stored, 'max_age': entry.max_age}
+        self._file.write(json.dumps(meta).encode('utf-8') + b'\n')
+
+    def write(self, data: bytes) -> None:
+        """Appends body data"""
+        self._file.write(data)
+
+    def commit(self) -> None:
+        """Atomically replaces the cached entry with the written one"""
+        self._file.close()
+        os.replace(self._temp_path, self.cache._entry_path(self.entry.url))
+        self.cache.evict()
+
+    def abort(self) -> None:
+        """Discards the written data"""
+        self._file.close()
+        try:
+            os.unlink(self._temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ResponseCache():
+    """On-disk response cache keyed by URL with LRU eviction
+
+    Every entry is a single file: a line of JSON metadata followed by the raw body.
+    The file modification time is used as last access time for the LRU eviction.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _entry_path(self, url: str) -> str:
+        """Returns file name for url"""
+        return os.path.join(self.path, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Returns cached entry for url and marks it as recently used"""
+        entry_path = self._entry_path(url)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                meta = json.loads(entry_file.readline())
+                data = entry_file.read()
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return CacheEntry(url=url, data=data, headers=meta['headers'], stored=meta['stored'], max_age=meta['max_age'])
+
+    def put(self, url: str, data: bytes, headers: Dict[str, str], now: Optional[float] = None) -> CacheEntry:
+        """Stores response for url"""
+        kept_headers = {name: value for name in CACHED_HEADERS if (value := get_header(headers, name)) is not None}
+        entry = CacheEntry(url=url, data=data, headers=kept_headers,
+                           stored=time.time() if now is None else now, max_age=get_max_age(headers))
+        if is_storable(headers):
+            self._write(entry)
+        return entry
+
+    def open_writer(self, url: str, headers: Dict[str, str], now: Optional[float] = None) -> Optional[CacheWriter]:
+        """Returns writer used to store a streamed response, None if the response must not be stored"""
+        if not is_storable(headers):
+            return None
+        kept_headers = {name: value for name in CACHED_HEADERS if (value := get_header(headers, name)) is not None}
+        return CacheWriter(self, CacheEntry(url=url, data=b'', headers=kept_headers,
+                                            stored=time.time() if now is None else now,
+                                            max_age=get_max_age(headers)))
+
+    def refresh(self, entry: CacheEntry, headers: Dict[str, str], now: Optional[float] = None) -> CacheEntry:
+        """Updates entry after successful revalidation (304 Not Modified)"""
+        entry.headers.update({name: value for name in CACHED_HEADERS
+                              if (value := get_header(headers, name)) is not None})
+        entry.stored = time.time() if now is None else now
+        entry.max_age = get_max_age(entry.headers)
+        self._write(entry)
+        return entry
+
+    def _write(self, entry: CacheEntry) -> None:
+        """Atomically writes entry to disk"""
+        writer = CacheWriter(self, entry)
+        try:
+            writer.write(entry.data)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """Returns list of (access time, size, path) for all entries"""
+        entries = []
+        with os.scandir(self.path) as iterator:
+            for dir_entry in iterator:
+                if dir_entry.name.startswith('.') or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        return entries
+
+    def evict(self) -> int:
+        """Removes least recently used entries until the cache fits max_size, returns removed count"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, entry_path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.unlink(entry_path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            return removed
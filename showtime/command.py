@@ -2,24 +2,32 @@
 
 import os
 import sys
+import time
 from datetime import date, datetime, timedelta
 from functools import reduce
-from typing import Any, Dict, List, Optional, Tuple, cast
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
 
 import cmd2
 import dateutil.parser
 from cmd2 import Cmd, Statement
 
 from showtime.api import Api, get_default_pool_manager
+from showtime.cache import ResponseCache
 from showtime.config import Config
-from showtime.database import get_cashed_write_db, get_memory_db
+from showtime.compact import COMPACT_BACKEND, compact_to_json, json_to_compact
+from showtime.database import Database, get_compact_db, get_journaled_db, get_memory_db
+from showtime.metrics import Metrics
 from showtime.output import Output
+from showtime.retry import RetryBudget, RetryPolicy
 from showtime.showtime import ShowtimeApp
-from showtime.types import Episode, EpisodeId, Show, ShowId
+from showtime.sqlite_database import SQLITE_BACKEND, get_sqlite_db, migrate_json_to_sqlite
+from showtime.throttle import TokenBucket
+from showtime.types import EpisodeId, Show, ShowId, WatchEvent
 
 from . import __version__
 
 SHOW_CATEGORY = 'Show management'
+DEFAULT_SYNC_REPORT = 'showtime_sync_report.json'
 EPISODE_CATEGORY = 'Episode management'
 
 
@@ -40,6 +48,11 @@ class Showtime(Cmd):
         self.output = Output(self.poutput, self.perror, self.pfeedback, self.ppaged)
         self.prompt = self._get_prompt('')
 
+    def precmd(self, statement: Union[Statement, str]) -> Statement:
+        """Reloads the database if another process changed it since the last command"""
+        self.app.database_refresh()
+        return super().precmd(statement)
+
     def _get_current_datetime(self) -> datetime:
         return datetime.utcnow()
 
@@ -95,11 +108,27 @@ class Showtime(Cmd):
         """Follow show(s) by id [follow <show_id>[,<show_id>...]]"""
         show_ids = self._get_list(statement)
 
-        for show_id in show_ids:
-            self.app.show_follow(show_id,
+        if len(show_ids) == 1:
+            self.app.show_follow(show_ids[0],
                                  on_episode_insert=self.output.status_on_episode_insert,
                                  on_episode_update=self.output.status_on_episode_update,
                                  on_show_added=self.output.status_on_show_added)
+            return
+        self.do_follow_bulk(statement)
+
+    @cmd2.with_category(SHOW_CATEGORY)
+    def do_follow_bulk(self, statement: Statement) -> None:
+        """Follow many shows at once [follow_bulk <show_id>[,<show_id>...] | follow_bulk @<file_name>]"""
+        ids: str = statement
+        if statement.startswith('@'):
+            with open(statement[1:], encoding='UTF-8') as id_file:
+                ids = ','.join(line.strip() for line in id_file if line.strip())
+        show_ids = self._get_list(ids)
+        failures = self.app.shows_follow(show_ids,
+                                         on_show_added=self.output.status_on_show_added,
+                                         on_progress=self.output.status_on_follow_progress,
+                                         concurrency=self.app.config_get().getint('Sync', 'Concurrency'))
+        self.output.status_on_follow_failures(failures)
 
     @cmd2.with_category(SHOW_CATEGORY)
     def do_shows(self, query: Statement) -> None:
@@ -140,30 +169,68 @@ class Showtime(Cmd):
         self.prompt = self._get_prompt()
 
     @cmd2.with_category(SHOW_CATEGORY)
-    def do_completed(self, _: Statement) -> None:
-        """Show list of completed shows"""
-        shows = self.app.show_get_completed()
+    def do_completed(self, statement: Statement) -> None:
+        """Show list of completed shows, or only the most recent ones [completed [<count>]]"""
+        try:
+            limit = int(statement) if statement else None
+        except ValueError:
+            self.output.perror('Invalid count')
+            return
+        shows = self.app.show_get_completed(limit)
         completed_shows_table = self.output.completed_shows_table(shows)
         self.output.ppaged(completed_shows_table)
 
     @cmd2.with_category(EPISODE_CATEGORY)
-    def do_sync(self, _: Statement) -> None:
-        """Synchronize episodes with TVMaze [sync]"""
-        self.output.pfeedback('Syncing shows...')
-        self.app.sync(on_show_sync=self.output.status_on_show_sync,
-                      on_episode_insert=self.output.status_on_episode_insert,
-                      on_episode_update=self.output.status_on_episode_update,
-                      all=False)
-        self.output.pfeedback('Done')
+    def do_sync(self, statement: Statement) -> None:
+        """Synchronize episodes with TVMaze [sync [--incremental] [--report [<file_name>]]]"""
+        self._sync(statement, all=False)
 
     @cmd2.with_category(EPISODE_CATEGORY)
-    def do_sync_all(self, _: Statement) -> None:
-        """Synchronize episodes with TVMaze [sync]"""
+    def do_sync_all(self, statement: Statement) -> None:
+        """Synchronize episodes with TVMaze [sync_all [--incremental] [--report [<file_name>]]]"""
+        self._sync(statement, all=True)
+
+    def _get_option(self, args: List[str], name: str, default: str) -> Optional[str]:
+        """Returns value of option, default if the option has no value and None if it is missing"""
+        if name not in args:
+            return None
+        index = args.index(name) + 1
+        if index < len(args) and not args[index].startswith('--'):
+            return args[index]
+        return default
+
+    def _sync(self, statement: Statement, all: bool) -> None:
+        """Runs the synchronization
+
+        Only changed shows are synced with --incremental, --report [file] writes request metrics as JSON.
+        """
+        args = statement.split()
+        incremental = '--incremental' in args
+        report_file = self._get_option(args, '--report', DEFAULT_SYNC_REPORT)
+        metrics = self.app.metrics_get() if report_file else None
+        if metrics:
+            metrics.reset()
+        failed: List[Show] = []
+
+        def on_show_failed(show: Show, error: Exception) -> None:
+            failed.append(show)
+            self.output.status_on_show_sync_failed(show, error)
+
+        started = time.monotonic()
         self.output.pfeedback('Syncing shows...')
         self.app.sync(on_show_sync=self.output.status_on_show_sync,
                       on_episode_insert=self.output.status_on_episode_insert,
                       on_episode_update=self.output.status_on_episode_update,
-                      all=True)
+                      all=all,
+                      incremental=incremental,
+                      concurrency=self.app.config_get().getint('Sync', 'Concurrency'),
+                      on_show_failed=on_show_failed)
+        if report_file and metrics:
+            metrics.write_report(report_file, {
+                'duration': round(time.monotonic() - started, 6),
+                'failed_shows': [show['id'] for show in failed],
+            })
+            self.output.pfeedback(f'Report written to {report_file}')
         self.output.pfeedback('Done')
 
     @cmd2.with_category(EPISODE_CATEGORY)
@@ -271,6 +338,35 @@ class Showtime(Cmd):
         path = config.get('Database', 'Path')
         self.output.poutput(f'Database path: {path}')
 
+    def do_migrate_sqlite(self, statement: Statement) -> None:
+        """Copy the JSON database to a new SQLite database [migrate_sqlite <sqlite_file_name>]"""
+        if not statement:
+            self.output.perror('Please provide the SQLite file name')
+            return
+        json_file_name = self.app.config_get().get('Database', 'Path')
+        shows, episodes = migrate_json_to_sqlite(json_file_name, statement)
+        self.output.poutput(f'Migrated {shows} shows and {episodes} episodes to {statement}')
+        self.output.poutput(f'Set Backend = {SQLITE_BACKEND} and Path = {statement} in the [Database] config section')
+
+    def do_migrate_compact(self, statement: Statement) -> None:
+        """Copy the JSON database to a new compact database [migrate_compact <compact_file_name>]"""
+        if not statement:
+            self.output.perror('Please provide the compact file name')
+            return
+        json_file_name = self.app.config_get().get('Database', 'Path')
+        documents = json_to_compact(json_file_name, statement)
+        self.output.poutput(f'Migrated {documents} records to {statement}')
+        self.output.poutput(f'Set Backend = {COMPACT_BACKEND} and Path = {statement} in the [Database] config section')
+
+    def do_export_json(self, statement: Statement) -> None:
+        """Export the compact database as readable JSON [export_json <json_file_name>]"""
+        if not statement:
+            self.output.perror('Please provide the JSON file name')
+            return
+        compact_file_name = self.app.config_get().get('Database', 'Path')
+        documents = compact_to_json(compact_file_name, statement)
+        self.output.poutput(f'Exported {documents} records to {statement}')
+
     def do_export(self, statement: Statement) -> None:
         """Export seen episodes between dates[export <from_date> <to_date>]"""
         try:
@@ -282,8 +378,9 @@ class Showtime(Cmd):
             self.output.perror("Invalid date")
             return
 
+        # episodes come ordered by the time they were watched
         episodes = self.app.episodes_watched_between(from_date, to_date)
-        self.output.json(sorted(episodes, key=lambda k: k['watched']))
+        self.output.json(episodes)
 
     @cmd2.with_category(EPISODE_CATEGORY)
     def do_watched_between(self, statement: Statement) -> None:
@@ -303,11 +400,10 @@ class Showtime(Cmd):
             return
 
         episodes = self.app.episodes_watched_between(from_date, to_date)
-        sorted_episodes = sorted(episodes, key=lambda k: k['watched'])
         if output_format == 'json':
-            episodes_output = self.output.episodes_json(sorted_episodes)
+            episodes_output = self.output.episodes_json(episodes)
         else:
-            episodes_output = self.output.format_unwatched(sorted_episodes)
+            episodes_output = self.output.format_unwatched(episodes)
         self.output.ppaged(episodes_output)
 
     @cmd2.with_category(EPISODE_CATEGORY)
@@ -330,31 +426,41 @@ class Showtime(Cmd):
         self.output.poutput(__version__)
 
     def do_patch_watchtime(self, file_name: Statement) -> None:
-        """Update watch times from csv file"""
-        self.app.episodes_patch_watchtime(file_name)
+        """Update watch times from csv file [patch_watchtime <file_name>]"""
+        result = self.app.episodes_patch_watchtime(file_name)
+        self.output.poutput(f'Imported {result.imported} watch times')
+        if result.rejected:
+            self.output.perror(f'Rejected {len(result.rejected)} rows')
+            for line, reason in result.rejected:
+                self.output.perror(f'\tLine {line}: {reason}')
 
     def do_watching_stats(self, _: Statement) -> None:
         """Statistics about watchtime"""
-        watched = self.app.episodes_get_watched()
-        minutes = reduce(
-            (lambda acc, ep: acc + ep['runtime'] if ep['runtime'] else 0), watched, 0)
-
-        def month_grouper(acc: Dict[str, Dict[str, int]], episode: Episode) -> Dict[str, Dict[str, int]]:
-            """Groups watched episodes by month"""
-            month = episode['watched'][0:7]
-            runtime = episode['runtime'] if episode['runtime'] else 0
+        events = self.app.watch_events_get()
+        minutes = reduce((lambda acc, event: acc + (event['runtime'] or 0)), events, 0)
+
+        def month_grouper(acc: Dict[str, Dict[str, int]], event: WatchEvent) -> Dict[str, Dict[str, int]]:
+            """Groups watches by month"""
+            month = event['timestamp'][0:7]
+            runtime = event['runtime'] if event['runtime'] else 0
             if not month in acc:
                 acc[month] = {'episodes': 0, 'minutes': 0}
             acc[month]['episodes'] = acc[month]['episodes'] + 1
             acc[month]['minutes'] = acc[month]['minutes'] + runtime
             return acc
 
-        month_totals: Dict[str, Dict[str, int]] = reduce(month_grouper, watched, {})
-        self.output.poutput(f"Total watched episodes: {len(watched)}")
+        month_totals: Dict[str, Dict[str, int]] = reduce(month_grouper, events, {})
+        self.output.poutput(f"Total watched episodes: {len(events)}")
         self.output.poutput(f"Total watchtime in minutes: {minutes}")
         summary_table = self.output.summary_table(month_totals)
         self.output.ppaged(summary_table)
 
+    @cmd2.with_category(SHOW_CATEGORY)
+    def do_rebuild_stats(self, _: Statement) -> None:
+        """Recompute episode counts of all shows [rebuild_stats]"""
+        count = self.app.show_stats_rebuild()
+        self.output.poutput(f'Rebuilt statistics of {count} shows')
+
     @cmd2.with_category(SHOW_CATEGORY)
     def do_unfinished(self, _: Statement) -> None:
         """Show list of unfinished shows"""
@@ -364,12 +470,31 @@ class Showtime(Cmd):
 
 
 def main() -> None:
-    api = Api(get_default_pool_manager())
     config = Config()
     config.load()
     dry_run = os.getenv('SHOWTIME_DRY_RUN') is not None
+    cache_path = config.get('Cache', 'Path')
+    cache = ResponseCache(cache_path, max_size=config.getint('Cache', 'MaxSize')) if cache_path else None
+    rate_limiter = TokenBucket(calls=config.getint('Http', 'RateLimitCalls'),
+                               period=config.getfloat('Http', 'RateLimitPeriod'))
+    retry = RetryPolicy(max_attempts=config.getint('Http', 'MaxAttempts'),
+                        budget=RetryBudget(config.getint('Http', 'RetryBudget')))
+    api = Api(get_default_pool_manager(num_pools=config.getint('Http', 'Pools'),
+                                       maxsize=config.getint('Http', 'PerHostConnections'),
+                                       cache=cache, offline=dry_run and cache is not None,
+                                       rate_limiter=rate_limiter, retry=retry, metrics=Metrics()))
     database_filename = config.get('Database', 'Path')
-    database = get_memory_db() if dry_run else get_cashed_write_db(database_filename)
+    if dry_run:
+        database = get_memory_db()
+    elif config.get('Database', 'Backend') == SQLITE_BACKEND:
+        # SQLiteDatabase implements the same method surface as Database
+        database = cast(Database, get_sqlite_db(database_filename))
+    elif config.get('Database', 'Backend') == COMPACT_BACKEND:
+        database = get_compact_db(database_filename, compress=config.getboolean('Database', 'Compress'))
+    else:
+        database = get_journaled_db(database_filename, compact_size=config.getint('Database', 'JournalSize'))
+    if isinstance(database, Database) and not dry_run:
+        database.migrate_on_first_use()
     app = ShowtimeApp(api, database, config)
     sys.exit(Showtime(app, dry_run=dry_run).cmdloop())
 
@@ -0,0 +1,154 @@
+"""Compact binary database storage module"""
+
+import json
+import struct
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import zlib
+
+from tinydb.storages import Storage
+
+from showtime.journal import JournalStorage
+from showtime.storage import atomic_write
+
+COMPACT_BACKEND = 'compact'
+
+MAGIC = b'STDB'
+VERSION = 1
+FLAG_COMPRESSED = 0x01
+
+_HEADER = struct.Struct('>4sBB')
+_NAME_LENGTH = struct.Struct('>H')
+_BLOCK_LENGTH = struct.Struct('>I')
+
+# preferred column order, fields not listed here follow in alphabetical order,
+# episode tables of single shows are named 'episode:<show id>'
+FIELD_ORDER: Dict[str, Tuple[str, ...]] = {
+    'show': ('id', 'name', 'premiered', 'status', 'externals'),
+    'episode': ('id', 'show_id', 'season', 'number', 'name', 'airdate', 'runtime', 'watched'),
+}
+
+
+class CompactFormatError(Exception):
+    """Raised when a file is not a supported compact database"""
+
+
+def _get_columns(table_name: str, documents: List[Dict[str, Any]]) -> List[str]:
+    """Returns fields present in every document of the table in column order"""
+    if not documents:
+        return []
+    common = set(documents[0]).intersection(*documents[1:])
+    preferred = [field for field in FIELD_ORDER.get(table_name.partition(':')[0], ()) if field in common]
+    return preferred + sorted(common.difference(preferred))
+
+
+def encode_table(table_name: str, table: Dict[str, Dict[str, Any]]) -> bytes:
+    """Encodes table as compact JSON with the field names stored once
+
+    Every row is `[doc_id, *column values]`, followed by a dict of the fields only some documents have.
+    """
+    columns = _get_columns(table_name, list(table.values()))
+    rows = []
+    for doc_id, document in table.items():
+        row = [int(doc_id)] + [document[column] for column in columns]
+        extra = {field: value for field, value in document.items() if field not in columns}
+        if extra:
+            row.append(extra)
+        rows.append(row)
+    return json.dumps({'columns': columns, 'rows': rows}, separators=(',', ':')).encode('UTF-8')
+
+
+def decode_table(block: bytes) -> Dict[str, Dict[str, Any]]:
+    """Decodes table encoded by encode_table"""
+    content = json.loads(block)
+    columns = content['columns']
+    table = {}
+    for row in content['rows']:
+        document = dict(zip(columns, row[1:len(columns) + 1]))
+        if len(row) > len(columns) + 1:
+            document.update(row[-1])
+        table[str(row[0])] = document
+    return table
+
+
+def write_compact(file: BinaryIO, data: Dict[str, Dict[str, Dict[str, Any]]], compress: bool = True) -> None:
+    """Writes database data in the compact format
+
+    The file starts with the magic bytes, format version and flags followed by one block per table:
+    the length-prefixed table name and the length-prefixed (optionally zlib compressed) table rows.
+    """
+    file.write(_HEADER.pack(MAGIC, VERSION, FLAG_COMPRESSED if compress else 0))
+    for table_name, table in data.items():
+        block = encode_table(table_name, table)
+        if compress:
+            block = zlib.compress(block)
+        name = table_name.encode('UTF-8')
+        file.write(_NAME_LENGTH.pack(len(name)) + name + _BLOCK_LENGTH.pack(len(block)))
+        file.write(block)
+
+
+def _read_exactly(file: BinaryIO, size: int) -> bytes:
+    """Reads size bytes, raises CompactFormatError if the file ends early"""
+    data = file.read(size)
+    if len(data) != size:
+        raise CompactFormatError('Unexpected end of file')
+    return data
+
+
+def read_compact(file: BinaryIO) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Reads database data written by write_compact"""
+    header = file.read(_HEADER.size)
+    if not header:
+        return {}
+    if len(header) != _HEADER.size:
+        raise CompactFormatError('Unexpected end of file')
+    magic, version, flags = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise CompactFormatError('Not a compact showtime database')
+    if version != VERSION:
+        raise CompactFormatError(f'Unsupported compact database version {version}')
+    data = {}
+    while name_length := file.read(_NAME_LENGTH.size):
+        if len(name_length) != _NAME_LENGTH.size:
+            raise CompactFormatError('Unexpected end of file')
+        table_name = _read_exactly(file, _NAME_LENGTH.unpack(name_length)[0]).decode('UTF-8')
+        block = _read_exactly(file, _BLOCK_LENGTH.unpack(_read_exactly(file, _BLOCK_LENGTH.size))[0])
+        if flags & FLAG_COMPRESSED:
+            block = zlib.decompress(block)
+        data[table_name] = decode_table(block)
+    return data
+
+
+class CompactStorage(Storage):
+    """TinyDB storage using the compact format, meant to be wrapped in FlushingMiddleware"""
+
+    def __init__(self, path: str, compress: bool = True) -> None:
+        super().__init__()
+        self.path = path
+        self.compress = compress
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Reads all data from the file"""
+        try:
+            with open(self.path, 'rb') as compact_file:
+                return read_compact(compact_file) or None
+        except FileNotFoundError:
+            return None
+
+    def write(self, data: Dict[str, Dict[str, Any]]) -> None:
+        """Atomically replaces the file with data"""
+        atomic_write(self.path, lambda compact_file: write_compact(compact_file, data, self.compress))
+
+
+def json_to_compact(json_file_name: str, compact_file_name: str, compress: bool = True) -> int:
+    """Converts JSON database (including its journal) to the compact format, returns number of documents"""
+    data = JournalStorage(json_file_name).read() or {}
+    CompactStorage(compact_file_name, compress).write(data)
+    return sum(len(table) for table in data.values())
+
+
+def compact_to_json(compact_file_name: str, json_file_name: str) -> int:
+    """Exports compact database as readable JSON, returns number of documents"""
+    data = CompactStorage(compact_file_name).read() or {}
+    with open(json_file_name, 'w', encoding='UTF-8') as json_file:
+        json.dump(data, json_file, sort_keys=True, indent=4)
+    return sum(len(table) for table in data.values())
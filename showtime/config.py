@@ -15,10 +15,28 @@ class Config(ConfigParser):
         """Loads configuration file"""
         self.add_section('Database')
         self.set('Database', 'Path', str(os.path.join(os.getcwd(), 'showtime.json')))
+        self.set('Database', 'Backend', 'json')
+        self.set('Database', 'JournalSize', str(1024 * 1024))
+        self.set('Database', 'Compress', 'yes')
 
         self.add_section('History')
         self.set('History', 'Path', str(os.path.expanduser('~/.showtime_history')))
 
+        self.add_section('Http')
+        self.set('Http', 'Pools', '10')
+        self.set('Http', 'PerHostConnections', '4')
+        self.set('Http', 'RateLimitCalls', '20')
+        self.set('Http', 'RateLimitPeriod', '10')
+        self.set('Http', 'MaxAttempts', '5')
+        self.set('Http', 'RetryBudget', '100')
+
+        self.add_section('Sync')
+        self.set('Sync', 'Concurrency', '4')
+
+        self.add_section('Cache')
+        self.set('Cache', 'Path', str(os.path.expanduser('~/.showtime_cache')))
+        self.set('Cache', 'MaxSize', str(100 * 1024 * 1024))
+
         if file_name == '':
             for location in self.common_locations:
                 if os.path.exists(location):
@@ -1,40 +1,343 @@
 """Showtime Database Module"""
 
 from contextlib import contextmanager
-from datetime import date, datetime
-from typing import (Iterator, Tuple, Dict, Generator, List,  Optional, cast)
+from datetime import date, datetime, timedelta
+import heapq
+from itertools import chain
+from typing import (Any, Callable, Iterable, Iterator, Tuple, Dict, Generator, List, Mapping, Optional, Set, Type, cast)
 
 import dateutil.parser
 from tinydb import TinyDB, where
-from tinydb.middlewares import CachingMiddleware
-from tinydb.queries import QueryLike
-from tinydb.storages import JSONStorage, MemoryStorage
+from tinydb.storages import MemoryStorage
+from tinydb.table import Document, Table
 
-from showtime.types import (Episode, EpisodeId, Show, ShowId, ShowStatus,
-                            TVMazeEpisode, TVMazeShow, ShowWithCount)
+from showtime.compact import CompactStorage
+from showtime.index import IndexedTable
+from showtime.journal import DEFAULT_COMPACT_SIZE, JournalStorage
+from showtime.query_cache import QueryCache, cached
+from showtime.storage import AtomicJSONStorage, FlushingMiddleware
+from showtime.types import (CompletedShow, Date, Episode, EpisodeId, Show, ShowId, ShowStats, ShowStatus,
+                            TVMazeEpisode, TVMazeShow, ShowWithCount, WatchEvent)
 
 SHOW = 'show'
 EPISODE = 'episode'
+EPISODE_CATALOG = 'episode_catalog'
+SHOW_STATS = 'show_stats'
+WATCH_EVENT = 'watch_event'
+META = 'meta'
+
+# episodes of every show are kept in a table of their own named by the show id, e.g. 'episode:1'
+SHARD_PREFIX = EPISODE + ':'
+
+SCHEMA_VERSION = 4
 
 NOT_WATCHED_VALUE = ''
+NO_DATE_ORDINAL = 0
+
+# date fields and the fields their ordinals are stored in
+DATE_ORDINAL_FIELDS = {'airdate': 'airdate_ordinal', 'watched': 'watched_ordinal'}
+ORDINAL_FIELDS = frozenset(DATE_ORDINAL_FIELDS.values())
+
+TABLE_INDEXES: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    SHOW: {'hash_fields': ('id',)},
+    SHOW_STATS: {'hash_fields': ('show_id',)},
+    EPISODE_CATALOG: {'hash_fields': ('id', 'show_id')},
+    EPISODE: {'hash_fields': ('id',), 'sorted_fields': ('airdate_ordinal', 'watched_ordinal', 'watched')},
+    WATCH_EVENT: {'hash_fields': ('episode_id',), 'sorted_fields': ('timestamp',)},
+}
+
+
+def get_shard_name(show_id: ShowId) -> str:
+    """Returns name of the table with episodes of a show"""
+    return f'{SHARD_PREFIX}{show_id}'
+
+
+def is_episode_table(table_name: str) -> bool:
+    """Returns true for tables holding episodes"""
+    return table_name == EPISODE or table_name.startswith(SHARD_PREFIX)
+
+
+def date_ordinal(value: Optional[str]) -> int:
+    """Returns ordinal of the date in an ISO date or datetime string, 0 for empty value"""
+    if not value:
+        return NO_DATE_ORDINAL
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except ValueError:
+        pass
+    try:
+        return dateutil.parser.parse(value).date().toordinal()
+    except (ValueError, OverflowError):
+        return NO_DATE_ORDINAL
+
+
+def _get_show_stats(show_id: ShowId, episodes: List[Episode]) -> ShowStats:
+    """Returns episode aggregates of a show"""
+    watched = [episode['watched'] for episode in episodes if episode['watched'] != NOT_WATCHED_VALUE]
+    return ShowStats(show_id=show_id, total=len(episodes), seen=len(watched), last_watched=max(watched, default=''))
+
+
+def _watched_fields(last_watched: Optional[Date]) -> Dict[str, Any]:
+    """Returns episode fields of the last watch time, None for an episode not watched"""
+    if last_watched is None:
+        return {'watched': NOT_WATCHED_VALUE, 'watched_ordinal': NO_DATE_ORDINAL}
+    return {'watched': last_watched, 'watched_ordinal': date_ordinal(last_watched)}
+
 
+def _completed_order(stats: ShowStats) -> Tuple[Date, ShowId]:
+    """Returns sort key of completed shows, ties are ordered by show id"""
+    return stats['last_watched'], stats['show_id']
 
-def _test_between(in_date: str, from_date: date, to_date: date) -> bool:
-    """Returns true if date is between from_date and to_date"""
-    return from_date <= dateutil.parser.parse(in_date).date() <= to_date if in_date else False
+
+def _with_date_ordinals(fields: Dict) -> Dict:
+    """Returns copy of fields with the ordinals of the date fields it contains"""
+    ordinals = {ordinal_field: date_ordinal(fields[field])
+                for field, ordinal_field in DATE_ORDINAL_FIELDS.items() if field in fields}
+    return {**fields, **ordinals}
+
+
+def _without_ordinals(episode: Mapping[str, Any]) -> Episode:
+    """Returns episode without the date ordinals stored for the indexes"""
+    return cast(Episode, {field: value for field, value in episode.items() if field not in ORDINAL_FIELDS})
 
 
 class Database(TinyDB):
-    """Class for locally storing the showtime data"""
+    """Class for locally storing the showtime data
+
+    Episodes are sharded in one table per show, so per-show operations only read and write the
+    episodes of that show. The episode catalog maps episode ids to their shows.
+
+    Results of the read methods are kept in `query_cache` until any table is written, the returned
+    records are shared with the cache and must not be mutated.
+
+    Every time an episode is marked as watched a watch event is logged, so rewatches are kept.
+    The `watched` field of an episode holds the time it was last watched.
+
+    Storages shared with other processes expose `refresh` and a `generation` increased every time
+    they take over data written elsewhere, the tables are invalidated when it changes.
+    """
+
+    table_class: Type[Table] = IndexedTable
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._transaction_depth = 0
+        self._rollback_only = False
+        self._generation = getattr(self.storage, 'generation', 0)
+        self._migrate_pending = False
+        self.query_cache = QueryCache()
+        # names of all shows by id, dropped whenever the show table is written
+        self._show_names: Optional[Dict[ShowId, str]] = None
+        if hasattr(self.storage, 'on_merge'):
+            self.storage.on_merge = self._merged
+
+    def table(self, name: str, **kwargs) -> IndexedTable:
+        """Returns table with the indexes defined for it"""
+        self._migrate_if_pending()
+        indexes = TABLE_INDEXES.get(EPISODE if is_episode_table(name) else name, {})
+        table = cast(IndexedTable, super().table(name, **{**indexes, **kwargs}))
+        table.on_write = self._show_written if name == SHOW else self.query_cache.invalidate
+        if self._transaction_depth and not table.in_transaction:
+            table.begin()
+        return table
+
+    def _show_written(self) -> None:
+        """Drops cached query results and show names after the show table was written"""
+        self._show_names = None
+        self.query_cache.invalidate()
 
     def flush(self):
         """Flushes the storage content to disk"""
         if hasattr(self.storage, 'flush'):
             self.storage.flush()
+        self._invalidate_changed_tables()
+
+    def refresh(self) -> None:
+        """Takes over changes written by other processes sharing the storage"""
+        if hasattr(self.storage, 'refresh'):
+            self.storage.refresh()
+        self._invalidate_changed_tables()
+
+    def _invalidate_changed_tables(self) -> None:
+        """Invalidates all tables if the storage took over data written elsewhere"""
+        generation = getattr(self.storage, 'generation', 0)
+        if generation != self._generation:
+            self._generation = generation
+            self._show_names = None
+            self.query_cache.invalidate()
+            for table in self._tables.values():
+                cast(IndexedTable, table).invalidate()
+
+    def _merged(self, conflicts: Dict[str, Set[str]]) -> None:
+        """Recomputes episode aggregates of the shows changed both by us and by another process"""
+        self._invalidate_changed_tables()
+        show_ids = {ShowId(int(name[len(SHARD_PREFIX):])) for name in conflicts if name.startswith(SHARD_PREFIX)}
+        stats_doc_ids = (int(doc_id) for doc_id in conflicts.get(SHOW_STATS, ()))
+        show_ids.update(stats['show_id'] for stats in self.table(SHOW_STATS).get_documents(stats_doc_ids))
+        self._refresh_show_stats(show_ids)
+
+    def begin(self) -> None:
+        """Starts transaction on fresh data, nested transactions become part of the outermost one"""
+        if not self._transaction_depth:
+            self._migrate_if_pending()
+        self._transaction_depth += 1
+        if self._transaction_depth == 1:
+            self.refresh()
+            self._rollback_only = False
+            for table in self._tables.values():
+                cast(IndexedTable, table).begin()
+
+    def commit(self) -> None:
+        """Ends transaction, the outermost one flushes the changes to disk"""
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            return
+        if self._rollback_only:
+            self._rollback_tables()
+            return
+        for table in self._tables.values():
+            cast(IndexedTable, table).commit()
+        self.flush()
+
+    def rollback(self) -> None:
+        """Ends transaction, the outermost one restores the data from before it started"""
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            self._rollback_only = True
+            return
+        self._rollback_tables()
+
+    def _rollback_tables(self) -> None:
+        """Restores all tables from before the transaction"""
+        for table in self._tables.values():
+            cast(IndexedTable, table).rollback()
+        self._rollback_only = False
+
+    def _get_by_id(self, table_name: str, document_id: Any) -> Optional[Dict]:
+        """Returns document from table by its id field"""
+        table = self.table(table_name)
+        documents = table.get_documents(table.get_doc_ids('id', document_id)[:1])
+        return documents[0] if documents else None
+
+    def _get_doc_ids(self, table_name: str, field: str, values: Iterable[Any]) -> List[int]:
+        """Returns sorted ids of documents where field has any of the values"""
+        table = self.table(table_name)
+        return sorted({doc_id for value in values for doc_id in table.get_doc_ids(field, value)})
+
+    def migrate(self) -> int:
+        """Upgrades stored documents to the current schema, returns number of upgraded documents"""
+        meta = self.table(META)
+        stored = meta.all()
+        version = stored[0].get('schema_version', 0) if stored else 0
+        if version >= SCHEMA_VERSION:
+            return 0
+        upgraded = 0
+        if version < 1:
+            upgraded += self._backfill_date_ordinals()
+        if version < 3:
+            upgraded += self._shard_episodes()
+        if version < 2:
+            upgraded += self.rebuild_show_stats()
+        if version < 4:
+            upgraded += self._backfill_watch_events()
+        if stored:
+            meta.update({'schema_version': SCHEMA_VERSION}, doc_ids=[stored[0].doc_id])
+        else:
+            meta.insert({'schema_version': SCHEMA_VERSION})
+        return upgraded
+
+    def migrate_on_first_use(self) -> None:
+        """Defers migrate until a table is first used, so commands not touching data don't load it"""
+        self._migrate_pending = True
+
+    def _migrate_if_pending(self) -> None:
+        """Runs the deferred migrate in a transaction of its own, so it can't be rolled back with another one"""
+        if not self._migrate_pending:
+            return
+        self._migrate_pending = False
+        try:
+            with transaction(self) as transacted_db:
+                transacted_db.migrate()
+        except BaseException:
+            self._migrate_pending = True
+            raise
+
+    def _backfill_date_ordinals(self) -> int:
+        """Stores date ordinals of episodes written before they existed"""
+        updates = [(_with_date_ordinals({field: episode.get(field) for field in DATE_ORDINAL_FIELDS}), episode.doc_id)
+                   for episode in self.table(EPISODE)
+                   if any(field not in episode for field in DATE_ORDINAL_FIELDS.values())]
+        return len(self.table(EPISODE).update_documents(updates)) if updates else 0
+
+    def _shard_episodes(self) -> int:
+        """Moves episodes from the single episode table to the tables of their shows"""
+        episodes = [dict(episode) for episode in self.table(EPISODE)]
+        if episodes:
+            self.table(EPISODE).truncate()
+            self.insert_episodes(episodes)
+        return len(episodes)
+
+    def _backfill_watch_events(self) -> int:
+        """Logs the last watch of episodes watched before the watch events existed"""
+        events = [WatchEvent(episode_id=episode['id'], show_id=episode['show_id'], timestamp=episode['watched'],
+                             runtime=episode['runtime'])
+                  for episode in self.get_all_episodes() if episode['watched'] != NOT_WATCHED_VALUE]
+        return len(self.table(WATCH_EVENT).insert_multiple(events))
+
+    def _shard(self, show_id: ShowId) -> IndexedTable:
+        """Returns table with the episodes of a show"""
+        return self.table(get_shard_name(show_id))
+
+    def _shard_show_ids(self) -> List[ShowId]:
+        """Returns sorted ids of shows having an episode table"""
+        return sorted(ShowId(int(name[len(SHARD_PREFIX):])) for name in self.tables() if name.startswith(SHARD_PREFIX))
+
+    def _locate(self, episode_ids: Iterable[EpisodeId]) -> Dict[ShowId, List[EpisodeId]]:
+        """Groups episode ids by the show they belong to, unknown episodes are left out"""
+        catalog = self.table(EPISODE_CATALOG)
+        located: Dict[ShowId, List[EpisodeId]] = {}
+        for episode_id in episode_ids:
+            for entry in catalog.get_documents(catalog.get_doc_ids('id', episode_id)[:1]):
+                located.setdefault(entry['show_id'], []).append(episode_id)
+        return located
+
+    def _refresh_show_stats(self, show_ids: Iterable[ShowId]) -> None:
+        """Recomputes episode aggregates of the shows from their episodes"""
+        stats_table = self.table(SHOW_STATS)
+        inserts: List[ShowStats] = []
+        updates: List[Tuple[ShowStats, int]] = []
+        for show_id in set(show_ids):
+            stats = _get_show_stats(show_id, cast(List[Episode], self._shard(show_id).all()))
+            doc_ids = stats_table.get_doc_ids('show_id', show_id)
+            if len(doc_ids) > 1:
+                # duplicate left by processes adding the same show at once
+                stats_table.remove(doc_ids=doc_ids[1:])
+            if doc_ids:
+                updates.append((stats, doc_ids[0]))
+            else:
+                inserts.append(stats)
+        if updates:
+            stats_table.update_documents(updates)
+        if inserts:
+            stats_table.insert_multiple(inserts)
+
+    def rebuild_show_stats(self) -> int:
+        """Recomputes episode aggregates of all shows, returns number of shows with episodes"""
+        show_stats = [_get_show_stats(show_id, cast(List[Episode], self._shard(show_id).all()))
+                      for show_id in self._shard_show_ids()]
+        show_stats = [stats for stats in show_stats if stats['total']]
+        stats_table = self.table(SHOW_STATS)
+        stats_table.truncate()
+        stats_table.insert_multiple(show_stats)
+        return len(show_stats)
+
+    def _get_show_stats_by_id(self) -> Dict[ShowId, ShowStats]:
+        """Returns episode aggregates keyed by show id"""
+        return {stats['show_id']: cast(ShowStats, stats) for stats in self.table(SHOW_STATS)}
 
     def add_show(self, tv_maze_show: TVMazeShow) -> ShowId:
         """Adds a show if it is not already added"""
-        if not self.table(SHOW).contains(where('id') == tv_maze_show.id):
+        if not self.table(SHOW).get_doc_ids('id', tv_maze_show.id):
             self.table(SHOW).insert({
                 'id': tv_maze_show.id,
                 'name': tv_maze_show.name,
@@ -51,11 +354,15 @@ class Database(TinyDB):
             'premiered': tv_maze_show.premiered,
             'status': tv_maze_show.status,
             'externals': tv_maze_show.externals,
-        }, where('id') == show_id)
+        }, doc_ids=self.table(SHOW).get_doc_ids('id', show_id))
+
+    def update_show_synced(self, show_id: ShowId, updated: int) -> List[int]:
+        """Stores the upstream update timestamp the show was last synced at"""
+        return self.table(SHOW).update({'synced': updated}, doc_ids=self.table(SHOW).get_doc_ids('id', show_id))
 
     def add_episode(self, show_id: ShowId, episode: TVMazeEpisode) -> EpisodeId:
         """Helper method used in tests"""
-        self.table(EPISODE).insert({
+        self.insert_episodes([{
             'id': episode.id,
             'show_id': show_id,
             'season': episode.season,
@@ -64,121 +371,320 @@ class Database(TinyDB):
             'airdate': episode.airdate,
             'runtime': episode.runtime,
             'watched': NOT_WATCHED_VALUE
-        })
+        }])
         return EpisodeId(episode.id)
 
+    @cached
     def get_shows(self) -> List[Show]:
         """Returns list of all added shows"""
         return cast(List[Show], self.table(SHOW).all())
 
+    def get_show_names(self) -> Mapping[ShowId, str]:
+        """Returns names of all added shows by id, the lookup is kept until a show is added or updated"""
+        if self._show_names is None:
+            self._show_names = {show['id']: show['name'] for show in self.table(SHOW)}
+        return self._show_names
+
+    @cached
     def get_active_shows(self) -> List[Show]:
         """Gets list of shows which have not ended"""
         return cast(List[Show], self.table(SHOW).search(where('status') != ShowStatus.ENDED.value))
 
+    @cached
     def get_show(self, show_id: ShowId) -> Optional[Show]:
         """Returns single show"""
-        return cast(Optional[Show], self.table(SHOW).get(where('id') == show_id))
+        return cast(Optional[Show], self._get_by_id(SHOW, show_id))
 
+    @cached
     def get_episode(self, episode_id: EpisodeId) -> Optional[Episode]:
         """Returns single episode"""
-        return cast(Optional[Episode], self.table(EPISODE).get(where('id') == episode_id))
+        for show_id in self._locate([episode_id]):
+            episode = self._get_by_id(get_shard_name(show_id), episode_id)
+            return _without_ordinals(episode) if episode is not None else None
+        return None
 
     def delete_episode(self, episode_id: EpisodeId) -> List[int]:
         """Deletes an episode from the database"""
-        return self.table(EPISODE).remove(where('id') == episode_id)
+        return self.delete_episodes([episode_id])
+
+    def delete_episodes(self, episode_ids: List[EpisodeId]) -> List[int]:
+        """Deletes list of episodes from the database, unknown episodes are skipped"""
+        located = self._locate(episode_ids)
+        removed: List[int] = []
+        for show_id, show_episode_ids in located.items():
+            doc_ids = self._get_doc_ids(get_shard_name(show_id), 'id', show_episode_ids)
+            removed += self._shard(show_id).remove(doc_ids=doc_ids)
+        self.table(EPISODE_CATALOG).remove(doc_ids=self._get_doc_ids(EPISODE_CATALOG, 'id', episode_ids))
+        self._refresh_show_stats(located)
+        return removed
 
     def insert_episodes(self, episodes: List[Dict]) -> List[int]:
-        """Inserts list of episodes"""
-        return self.table(EPISODE).insert_multiple(episodes)
+        """Inserts list of episodes in the tables of their shows, returns their document ids there"""
+        episodes_by_show: Dict[ShowId, List[Dict]] = {}
+        for episode in episodes:
+            episodes_by_show.setdefault(episode['show_id'], []).append(_with_date_ordinals(episode))
+        inserted: List[int] = []
+        for show_id, show_episodes in episodes_by_show.items():
+            inserted += self._shard(show_id).insert_multiple(show_episodes)
+        self.table(EPISODE_CATALOG).insert_multiple({'id': episode['id'], 'show_id': episode['show_id']}
+                                                    for episode in episodes)
+        self._refresh_show_stats(episodes_by_show)
+        return inserted
 
     def update_episodes(self, episodes: List[Tuple[Dict, int]]) -> List[int]:
-        """Updates list of episodes"""
-        updates = list(map(lambda el: (el[0], where('id') == el[1]), episodes))
-        return self.table(EPISODE).update_multiple(updates)
-
-    def _update_watched(self, watched: bool, when: datetime, query: QueryLike) -> List[int]:
-        watched_value = when.isoformat() if watched else NOT_WATCHED_VALUE
-        return self.table(EPISODE).update({'watched': watched_value}, query)
+        """Updates list of episodes, an episode with a changed show_id moves to the table of that show"""
+        located = self._locate(EpisodeId(episode_id) for _, episode_id in episodes)
+        show_ids = {episode_id: show_id for show_id, episode_ids in located.items() for episode_id in episode_ids}
+        updates: Dict[ShowId, List[Tuple[Dict, int]]] = {}
+        moves: List[Tuple[Dict, EpisodeId, ShowId]] = []
+        affected: Set[ShowId] = set()
+        for fields, episode_id in episodes:
+            show_id = show_ids.get(EpisodeId(episode_id))
+            if show_id is None:
+                continue
+            if fields.get('show_id', show_id) != show_id:
+                moves.append((_with_date_ordinals(fields), EpisodeId(episode_id), show_id))
+                affected.update((show_id, fields['show_id']))
+                continue
+            shard = self._shard(show_id)
+            updates.setdefault(show_id, []).extend((_with_date_ordinals(fields), doc_id)
+                                                   for doc_id in shard.get_doc_ids('id', episode_id))
+            # aggregates only depend on which show an episode belongs to and whether it is watched
+            if 'watched' in fields:
+                affected.add(show_id)
+        updated: List[int] = []
+        for show_id, show_updates in updates.items():
+            updated += self._shard(show_id).update_documents(show_updates)
+        for fields, episode_id, show_id in moves:
+            updated += self._move_episode(episode_id, show_id, fields)
+        self._refresh_show_stats(affected)
+        return updated
+
+    def _move_episode(self, episode_id: EpisodeId, show_id: ShowId, fields: Dict) -> List[int]:
+        """Moves episode to the table of the show in fields, returns its new document ids"""
+        shard = self._shard(show_id)
+        doc_ids = shard.get_doc_ids('id', episode_id)
+        documents = shard.get_documents(doc_ids)
+        shard.remove(doc_ids=doc_ids)
+        moved = self._shard(fields['show_id']).insert_multiple({**document, **fields} for document in documents)
+        catalog = self.table(EPISODE_CATALOG)
+        catalog.update({'show_id': fields['show_id']}, doc_ids=catalog.get_doc_ids('id', episode_id))
+        events = self.table(WATCH_EVENT)
+        events.update({'show_id': fields['show_id']}, doc_ids=events.get_doc_ids('episode_id', episode_id))
+        return moved
+
+    def _get_watch_history(self, episode_ids: Iterable[EpisodeId]) -> Dict[EpisodeId, List[Document]]:
+        """Returns logged watches of episodes by episode id, ordered from the first to the last watch"""
+        history: Dict[EpisodeId, List[Document]] = {}
+        events = self.table(WATCH_EVENT)
+        for event in events.get_documents(self._get_doc_ids(WATCH_EVENT, 'episode_id', episode_ids)):
+            history.setdefault(event['episode_id'], []).append(event)
+        for watches in history.values():
+            watches.sort(key=lambda event: (event['timestamp'], event.doc_id))
+        return history
+
+    def _update_watched(self, watched: bool, when: datetime, show_id: ShowId, doc_ids: List[int],
+                        rewatch: bool = False) -> List[int]:
+        """Logs a watch of episodes in the table of a show or retracts all their watches
+
+        Episodes already watched are skipped unless marking a rewatch.
+        """
+        if not doc_ids:
+            return []
+        shard = self._shard(show_id)
+        events = self.table(WATCH_EVENT)
+        episodes = shard.get_documents(doc_ids)
+        if watched:
+            if not rewatch:
+                episodes = [episode for episode in episodes if episode['watched'] == NOT_WATCHED_VALUE]
+            history = self._get_watch_history(episode['id'] for episode in episodes)
+            timestamp = when.isoformat()
+            events.insert_multiple(WatchEvent(episode_id=episode['id'], show_id=show_id, timestamp=timestamp,
+                                              runtime=episode['runtime']) for episode in episodes)
+            updates = [(_watched_fields(max([event['timestamp'] for event in history.get(episode['id'], [])]
+                                            + [timestamp])), episode.doc_id) for episode in episodes]
+        else:
+            events.remove(doc_ids=self._get_doc_ids(WATCH_EVENT, 'episode_id', (episode['id'] for episode in episodes)))
+            updates = [(_watched_fields(None), episode.doc_id) for episode in episodes]
+        updated = shard.update_documents(updates) if updates else []
+        self._refresh_show_stats([show_id])
+        return updated
 
     def update_watched(self, episode_id: EpisodeId, watched: bool, when: datetime) -> List[int]:
-        """Updates the watched date of an episode"""
-        return self._update_watched(watched, when, where('id') == episode_id)
+        """Updates the watched date of an episode, marking a watched episode as watched logs a rewatch"""
+        updated: List[int] = []
+        for show_id, show_episode_ids in self._locate([episode_id]).items():
+            doc_ids = self._get_doc_ids(get_shard_name(show_id), 'id', show_episode_ids)
+            updated += self._update_watched(watched, when, show_id, doc_ids, rewatch=True)
+        return updated
 
     def update_watched_episodes(self, episode_ids: List[EpisodeId], watched: bool, when: datetime) -> List[int]:
-        """Updates the watched date of an episode"""
-        return self._update_watched(watched, when, where('id').one_of(episode_ids))
+        """Updates the watched date of episodes, episodes already watched are kept"""
+        updated: List[int] = []
+        for show_id, show_episode_ids in self._locate(episode_ids).items():
+            doc_ids = self._get_doc_ids(get_shard_name(show_id), 'id', show_episode_ids)
+            updated += self._update_watched(watched, when, show_id, doc_ids)
+        return updated
+
+    def update_watched_times(self, watches: List[Tuple[EpisodeId, datetime]]) -> List[EpisodeId]:
+        """Sets the time episodes were last watched, returns ids of the episodes found
+
+        The time replaces the last logged watch of an episode, a watch is logged only for episodes
+        not watched yet. An episode listed more than once gets its last time in the list. The
+        episodes of every show are written with a single update.
+        """
+        located = self._locate(dict.fromkeys(episode_id for episode_id, _ in watches))
+        episodes: Dict[EpisodeId, Tuple[ShowId, Document]] = {}
+        for show_id, show_episode_ids in located.items():
+            doc_ids = self._get_doc_ids(get_shard_name(show_id), 'id', show_episode_ids)
+            for episode in self._shard(show_id).get_documents(doc_ids):
+                episodes[episode['id']] = (show_id, episode)
+        found = [episode_id for episode_id, _ in watches if episode_id in episodes]
+        timestamps = {episode_id: when.isoformat() for episode_id, when in watches if episode_id in episodes}
+        history = self._get_watch_history(timestamps)
+        updates: Dict[ShowId, List[Tuple[Dict, int]]] = {}
+        event_updates: List[Tuple[Dict, int]] = []
+        events: List[WatchEvent] = []
+        for episode_id, timestamp in timestamps.items():
+            show_id, episode = episodes[episode_id]
+            earlier = history.get(episode_id, [])
+            if earlier:
+                event_updates.append(({'timestamp': timestamp}, earlier.pop().doc_id))
+            else:
+                events.append(WatchEvent(episode_id=episode_id, show_id=show_id, timestamp=timestamp,
+                                         runtime=episode['runtime']))
+            last_watched = max([event['timestamp'] for event in earlier] + [timestamp])
+            updates.setdefault(show_id, []).append((_watched_fields(last_watched), episode.doc_id))
+        for show_id, show_updates in updates.items():
+            self._shard(show_id).update_documents(show_updates)
+        watch_events = self.table(WATCH_EVENT)
+        watch_events.update_documents(event_updates)
+        watch_events.insert_multiple(events)
+        self._refresh_show_stats(updates)
+        return found
 
     def update_watched_show(self, show_id: ShowId, watched: bool, when: datetime) -> List[int]:
         """Updates all episodes of a show as watched now"""
-        return self._update_watched(watched, when, where('show_id') == show_id)
+        return self._update_watched(watched, when, show_id, [ep.doc_id for ep in self._shard(show_id)])
 
     def update_watched_show_season(self, show_id: ShowId, season: int, watched: bool, when: datetime) -> List[int]:
         """Updates all episodes of a show and season as watched now"""
-        return self._update_watched(watched, when, (where('show_id') == show_id) & (where('season') == season))
-
-    def _search_episodes(self, query: QueryLike) -> List[Episode]:
-        episodes = self.table(EPISODE).search(query)
-        return cast(List[Episode], episodes)
-
+        doc_ids = [ep.doc_id for ep in self._shard(show_id) if ep['season'] == season]
+        return self._update_watched(watched, when, show_id, doc_ids)
+
+    def _select_episodes(self, select: Callable[[IndexedTable], Iterable[int]]) -> List[Episode]:
+        """Returns episodes of all shows selected by document ids, ordered by show and table order"""
+        episodes: List[Episode] = []
+        for show_id in self._shard_show_ids():
+            shard = self._shard(show_id)
+            episodes += map(_without_ordinals, shard.get_documents(sorted(select(shard))))
+        return episodes
+
+    def _get_episodes_between(self, ordinal_field: str, from_date: date, to_date: date) -> List[Episode]:
+        """Returns episodes where the date ordinal is between two dates"""
+        from_ordinal = max(from_date.toordinal(), NO_DATE_ORDINAL + 1)
+        return self._select_episodes(lambda shard: shard.get_doc_ids_between(ordinal_field, from_ordinal,
+                                                                             to_date.toordinal()))
+
+    @cached
     def get_episodes(self, show_id: ShowId) -> List[Episode]:
         """Returns sorted list of episodes for a show"""
-        episodes = self._search_episodes(where('show_id') == show_id)
+        episodes = map(_without_ordinals, self._shard(show_id))
         return sorted(episodes, key=lambda ep: ep['season'] * 1000 + ep['number'])
 
     def get_unwatched(self, when: datetime) -> List[Episode]:
         """Returns all aired episodes which are not watched yet"""
-        return self._search_episodes((where('watched') == NOT_WATCHED_VALUE) & (where('airdate') <= when.isoformat()))
+        return self._get_unwatched_until(when.toordinal())
+
+    @cached
+    def _get_unwatched_until(self, ordinal: int) -> List[Episode]:
+        """Returns episodes aired until the day ordinal which are not watched yet, cached per day"""
+        episodes = self._select_episodes(lambda shard: shard.get_doc_ids_between('airdate_ordinal', high=ordinal))
+        return [ep for ep in episodes if ep['watched'] == NOT_WATCHED_VALUE]
 
+    @cached
     def seen_between(self, from_date: date, to_date: date) -> List[Episode]:
         """Returns list of episodes that were watched between two dates"""
-        def is_between(in_date):
-            return _test_between(in_date, from_date, to_date)
-        return self._search_episodes(where('watched').test(is_between))
+        return self._get_episodes_between('watched_ordinal', from_date, to_date)
 
+    @cached
     def aired_unseen_between(self, from_date: date, to_date: date) -> List[Episode]:
         """Returns list of episodes that were aired but have not been seen between two dates"""
-        def is_between(in_date):
-            return _test_between(in_date, from_date, to_date)
-        return self._search_episodes(where('airdate').test(is_between) & (where('watched') == NOT_WATCHED_VALUE))
+        episodes = self._get_episodes_between('airdate_ordinal', from_date, to_date)
+        return [ep for ep in episodes if ep['watched'] == NOT_WATCHED_VALUE]
 
+    @cached
     def get_watched_episodes(self) -> List[Episode]:
         """Returns all episodes that have not been watched"""
-        return self._search_episodes(where('watched') != NOT_WATCHED_VALUE)
+        return self._select_episodes(lambda shard: shard.get_doc_ids_between('watched', low=NOT_WATCHED_VALUE,
+                                                                             include_low=False))
 
     def get_all_episodes(self) -> Iterator[Episode]:
         """Returns all episodes iterator"""
-        return cast(Iterator[Episode], self.table(EPISODE))
-
+        return map(_without_ordinals, chain.from_iterable(self._shard(show_id) for show_id in self._shard_show_ids()))
+
+    @cached
+    def get_watch_events(self, from_date: Optional[date] = None, to_date: Optional[date] = None) -> List[WatchEvent]:
+        """Returns logged watches between two dates ordered by time, missing date leaves the range open"""
+        events = self.table(WATCH_EVENT)
+        low = from_date.isoformat() if from_date else None
+        high = (to_date + timedelta(days=1)).isoformat() if to_date else None
+        return cast(List[WatchEvent], events.get_documents(events.get_doc_ids_between('timestamp', low, high,
+                                                                                       include_high=False)))
+
+    @cached
     def get_shows_by_ids(self, show_ids: List[ShowId]) -> List[Show]:
         """Returns list of shows given list of show id-s"""
-        shows = self.table(SHOW).search(where('id').one_of(show_ids))
+        shows = self.table(SHOW).get_documents(self._get_doc_ids(SHOW, 'id', show_ids))
         return cast(List[Show], shows)
 
-    def _get_shows_episodes_totals(self) -> List[ShowWithCount]:
-        all_shows = [{**show, 'total': 0, 'seen': 0} for show in self.table(SHOW)]
-        all_shows_keyed = {show['id']: show for show in all_shows}
-        for episode in self.table(EPISODE):
-            show_id = episode['show_id']
-            all_shows_keyed[show_id]['total'] += 1
-            if episode['watched'] != '':
-                all_shows_keyed[show_id]['seen'] += 1
-        return cast(List[ShowWithCount], all_shows_keyed.values())
-
+    @cached
     def get_unfinished_shows(self) -> List[ShowWithCount]:
         """Returns list of unfinished shows"""
-        all_shows_totals = self._get_shows_episodes_totals()
-        unfinished_shows = [show for show in all_shows_totals if show['total'] > show['seen']]
+        stats_by_id = self._get_show_stats_by_id()
+        unfinished_shows = []
+        for show in self.get_shows():
+            stats = stats_by_id.get(show['id'])
+            if stats and stats['total'] > stats['seen']:
+                unfinished_shows.append(cast(ShowWithCount, {**show, 'total': stats['total'], 'seen': stats['seen']}))
         return sorted(unfinished_shows, key=lambda item: item['premiered'] or "")
 
+    @cached
+    def get_completed_shows(self, limit: Optional[int] = None, offset: int = 0) -> List[CompletedShow]:
+        """Returns shows with all episodes watched, ordered by the time the last episode was watched
+
+        Offset skips the most recently completed shows and limit keeps only that many of the most recent
+        remaining ones, without ordering all completed shows.
+        """
+        completed = [stats for stats in self._get_show_stats_by_id().values()
+                     if stats['total'] and stats['total'] == stats['seen']]
+        if limit is None:
+            completed = sorted(completed, key=_completed_order)[:max(len(completed) - offset, 0)]
+        else:
+            completed = heapq.nlargest(offset + limit, completed, key=_completed_order)[offset:][::-1]
+        shows = {show['id']: show for show in self.get_shows_by_ids([stats['show_id'] for stats in completed])}
+        return [cast(CompletedShow, shows[stats['show_id']] | {'last_watched': stats['last_watched']})
+                for stats in completed if stats['show_id'] in shows]
+
 
 def get_direct_write_db(file_name: str) -> Database:
     """Returns database instance with direct interface"""
-    return Database(file_name, sort_keys=True, indent=4)
+    return Database(file_name, storage=AtomicJSONStorage, sort_keys=True, indent=4)
 
 
 def get_cashed_write_db(file_name: str) -> Database:
     """Returns database instance with cached interface"""
-    return Database(file_name, storage=CachingMiddleware(JSONStorage), sort_keys=True, indent=4)
+    return Database(file_name, storage=FlushingMiddleware(AtomicJSONStorage), sort_keys=True, indent=4)
+
+
+def get_compact_db(file_name: str, compress: bool = True) -> Database:
+    """Returns database instance with cached interface stored in the compact format"""
+    return Database(file_name, storage=FlushingMiddleware(CompactStorage), compress=compress)
+
+
+def get_journaled_db(file_name: str, compact_size: int = DEFAULT_COMPACT_SIZE) -> Database:
+    """Returns database instance appending changes to a journal"""
+    return Database(file_name, storage=JournalStorage, compact_size=compact_size, sort_keys=True, indent=4)
 
 
 def get_memory_db() -> Database:
@@ -188,8 +694,11 @@ def get_memory_db() -> Database:
 
 @contextmanager
 def transaction(database: Database) -> Generator[Database, None, None]:
-    """Returns database and flushes the data on exit"""
+    """Returns database, commits the changes on exit and rolls them back on exception"""
+    database.begin()
     try:
         yield database
-    finally:
-        database.flush()
+    except BaseException:
+        database.rollback()
+        raise
+    database.commit()
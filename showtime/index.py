@@ -0,0 +1,334 @@
+"""In-memory table index module"""
+
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import MutableMapping as MutableMappingBase
+import copy
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Mapping, MutableMapping, Optional, Sequence,
+                    Tuple, Union, cast)
+
+from tinydb.queries import QueryLike
+from tinydb.storages import Storage
+from tinydb.table import Document, Table
+
+Fields = Union[Mapping, Callable[[MutableMapping], None]]
+
+
+class HashIndex():
+    """Maps field value to the sorted list of document ids having it"""
+
+    def __init__(self) -> None:
+        self._doc_ids: Dict[Any, List[int]] = {}
+
+    def add(self, value: Any, doc_id: int) -> None:
+        """Adds document to the index"""
+        insort(self._doc_ids.setdefault(value, []), doc_id)
+
+    def remove(self, value: Any, doc_id: int) -> None:
+        """Removes document from the index"""
+        doc_ids = self._doc_ids.get(value)
+        if doc_ids is None:
+            return
+        position = bisect_left(doc_ids, doc_id)
+        if position < len(doc_ids) and doc_ids[position] == doc_id:
+            del doc_ids[position]
+        if not doc_ids:
+            del self._doc_ids[value]
+
+    def get(self, value: Any) -> List[int]:
+        """Returns ids of documents with the value, unhashable values match nothing"""
+        try:
+            return list(self._doc_ids.get(value, []))
+        except TypeError:
+            return []
+
+
+class SortedIndex():
+    """Keeps document ids ordered by field value for range lookups"""
+
+    def __init__(self) -> None:
+        self._keys: List[Any] = []
+        self._doc_ids: List[int] = []
+
+    def add(self, value: Any, doc_id: int) -> None:
+        """Adds document to the index"""
+        position = bisect_right(self._keys, value)
+        self._keys.insert(position, value)
+        self._doc_ids.insert(position, doc_id)
+
+    def remove(self, value: Any, doc_id: int) -> None:
+        """Removes document from the index"""
+        for position in range(bisect_left(self._keys, value), bisect_right(self._keys, value)):
+            if self._doc_ids[position] == doc_id:
+                del self._keys[position]
+                del self._doc_ids[position]
+                return
+
+    def between(self, low: Any = None, high: Any = None,
+                include_low: bool = True, include_high: bool = True) -> List[int]:
+        """Returns ids of documents with value between low and high, None leaves the bound open"""
+        start = 0
+        if low is not None:
+            start = bisect_left(self._keys, low) if include_low else bisect_right(self._keys, low)
+        end = len(self._keys)
+        if high is not None:
+            end = bisect_right(self._keys, high) if include_high else bisect_left(self._keys, high)
+        return self._doc_ids[start:end]
+
+
+class _UndoRecorder(MutableMappingBase):
+    """Table data wrapper saving a copy of every document before it is first touched"""
+
+    def __init__(self, table: Dict[int, Any], undo: Dict[int, Optional[Dict]]) -> None:
+        self._table = table
+        self._undo = undo
+
+    def _save(self, doc_id: int) -> None:
+        """Saves the original document, None marks a document that didn't exist"""
+        if doc_id not in self._undo:
+            self._undo[doc_id] = copy.deepcopy(self._table[doc_id]) if doc_id in self._table else None
+
+    def __getitem__(self, doc_id: int) -> Any:
+        self._save(doc_id)
+        return self._table[doc_id]
+
+    def __setitem__(self, doc_id: int, document: Any) -> None:
+        self._save(doc_id)
+        self._table[doc_id] = document
+
+    def __delitem__(self, doc_id: int) -> None:
+        self._save(doc_id)
+        del self._table[doc_id]
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self._table
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._table)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class IndexedTable(Table):
+    """TinyDB table keeping in-memory indexes of selected fields
+
+    Hash indexes answer equality lookups and sorted indexes answer range lookups without scanning
+    the table. Documents where a sorted field is missing or null are left out of its index.
+    The indexes are built on first use and maintained by every write done through the table,
+    `invalidate` has to be called when the storage data is changed by anyone else.
+
+    Between `begin` and `commit` the original of every written document is kept, so `rollback`
+    can restore the table. Only documents a write touches are copied, but writes selecting
+    documents with a query touch every document they test. Storages with `record_changes` get the
+    ids of the written documents along with their originals.
+    """
+
+    def __init__(self, storage: Storage, name: str, hash_fields: Sequence[str] = (),
+                 sorted_fields: Sequence[str] = (), **kwargs) -> None:
+        super().__init__(storage, name, **kwargs)
+        self.hash_fields = tuple(hash_fields)
+        self.sorted_fields = tuple(sorted_fields)
+        self._hash_indexes: Dict[str, HashIndex] = {}
+        self._sorted_indexes: Dict[str, SortedIndex] = {}
+        # indexed field values of every document, needed to unindex removed documents
+        self._indexed_values: Optional[Dict[int, Tuple[Any, ...]]] = None
+        # original documents changed in the current transaction
+        self._undo: Optional[Dict[int, Optional[Dict]]] = None
+        # original documents changed by the last write
+        self._originals: Dict[int, Optional[Dict]] = {}
+        # called after every write
+        self.on_write: Optional[Callable[[], None]] = None
+
+    @property
+    def in_transaction(self) -> bool:
+        """Returns true if writes are recorded for rollback"""
+        return self._undo is not None
+
+    def begin(self) -> None:
+        """Starts recording the original documents of all writes"""
+        self._undo = {}
+
+    def commit(self) -> None:
+        """Stops recording and forgets the original documents"""
+        self._undo = None
+
+    def rollback(self) -> None:
+        """Restores all documents written since begin"""
+        undo, self._undo = self._undo, None
+        if not undo:
+            return
+
+        def updater(table: dict):
+            for doc_id, document in undo.items():
+                if document is None:
+                    table.pop(doc_id, None)
+                else:
+                    table[doc_id] = copy.deepcopy(document)
+
+        self._update_table(updater)
+        self._next_id = None
+        self._written(list(undo))
+
+    def invalidate(self) -> None:
+        """Drops the indexes and cached state after the storage data was changed by someone else"""
+        self._indexed_values = None
+        self._next_id = None
+        self.clear_cache()
+
+    def _read_table(self) -> Dict[str, Mapping]:
+        """Reads only this table from storages able to load tables separately"""
+        read_table = getattr(self.storage, 'read_table', None)
+        if read_table is None:
+            return super()._read_table()
+        return read_table(self.name)
+
+    def _update_table(self, updater: Callable[[Dict[int, Mapping]], None]) -> None:
+        """Performs table update, recording the original documents if anyone needs them
+
+        Storages with `write_table` get only this table written back, so the other tables don't
+        have to be loaded.
+        """
+        originals = self._originals
+        recording = self._undo is not None or hasattr(self.storage, 'record_changes')
+
+        def update(table: dict):
+            updater(cast(Dict[int, Mapping], _UndoRecorder(table, originals)) if recording else table)
+
+        write_table = getattr(self.storage, 'write_table', None)
+        if write_table is None:
+            super()._update_table(update)
+        else:
+            table = {self.document_id_class(doc_id): document for doc_id, document in self._read_table().items()}
+            update(table)
+            write_table(self.name, {str(doc_id): document for doc_id, document in table.items()})
+            self.clear_cache()
+        if self._undo is not None:
+            for doc_id, document in self._originals.items():
+                self._undo.setdefault(doc_id, document)
+
+    def _build_indexes(self) -> Dict[int, Tuple[Any, ...]]:
+        """Builds indexes from the stored documents if they are not built yet"""
+        if self._indexed_values is None:
+            self._hash_indexes = {field: HashIndex() for field in self.hash_fields}
+            self._sorted_indexes = {field: SortedIndex() for field in self.sorted_fields}
+            self._indexed_values = {}
+            for doc_id, document in self._read_table().items():
+                self._index_document(int(doc_id), document)
+        return self._indexed_values
+
+    def _index_document(self, doc_id: int, document: Mapping) -> None:
+        """Adds document to all indexes"""
+        assert self._indexed_values is not None
+        values = tuple(document.get(field) for field in self.hash_fields + self.sorted_fields)
+        self._indexed_values[doc_id] = values
+        for field, value in zip(self.hash_fields, values):
+            self._hash_indexes[field].add(value, doc_id)
+        for field, value in zip(self.sorted_fields, values[len(self.hash_fields):]):
+            if value is not None:
+                self._sorted_indexes[field].add(value, doc_id)
+
+    def _unindex_document(self, doc_id: int) -> None:
+        """Removes document from all indexes"""
+        assert self._indexed_values is not None
+        values = self._indexed_values.pop(doc_id, None)
+        if values is None:
+            return
+        for field, value in zip(self.hash_fields, values):
+            self._hash_indexes[field].remove(value, doc_id)
+        for field, value in zip(self.sorted_fields, values[len(self.hash_fields):]):
+            if value is not None:
+                self._sorted_indexes[field].remove(value, doc_id)
+
+    def _written(self, doc_ids: List[int]) -> None:
+        """Refreshes indexes after a write and reports the changed documents to the storage"""
+        self._reindex(doc_ids)
+        if self.on_write is not None:
+            self.on_write()
+        originals, self._originals = self._originals, {}
+        record_changes = getattr(self.storage, 'record_changes', None)
+        if record_changes is not None:
+            record_changes(self.name, doc_ids, originals)
+
+    def _reindex(self, doc_ids: Iterable[int]) -> None:
+        """Refreshes index entries of changed documents"""
+        if self._indexed_values is None:
+            return
+        table = self._read_table()
+        for doc_id in doc_ids:
+            self._unindex_document(doc_id)
+            document = table.get(str(doc_id))
+            if document is not None:
+                self._index_document(doc_id, document)
+
+    def insert(self, document: Mapping) -> int:
+        """Inserts document and indexes it"""
+        doc_id = super().insert(document)
+        self._written([doc_id])
+        return doc_id
+
+    def insert_multiple(self, documents: Iterable[Mapping]) -> List[int]:
+        """Inserts documents and indexes them"""
+        doc_ids = super().insert_multiple(documents)
+        self._written(doc_ids)
+        return doc_ids
+
+    def update(self, fields: Fields, cond: Optional[QueryLike] = None,
+               doc_ids: Optional[Iterable[int]] = None) -> List[int]:
+        """Updates documents and reindexes them"""
+        updated_ids = super().update(fields, cond, doc_ids)
+        self._written(updated_ids)
+        return updated_ids
+
+    def update_multiple(self, updates: Iterable[Tuple[Fields, QueryLike]]) -> List[int]:
+        """Updates documents and reindexes them"""
+        updated_ids = super().update_multiple(updates)
+        self._written(updated_ids)
+        return updated_ids
+
+    def update_documents(self, updates: Iterable[Tuple[Mapping, int]]) -> List[int]:
+        """Updates documents by id with a single write, missing ids are skipped"""
+        updated_ids: List[int] = []
+
+        def updater(table: dict):
+            for fields, doc_id in updates:
+                if doc_id in table:
+                    table[doc_id].update(fields)
+                    updated_ids.append(doc_id)
+
+        self._update_table(updater)
+        self._written(updated_ids)
+        return updated_ids
+
+    def remove(self, cond: Optional[QueryLike] = None, doc_ids: Optional[Iterable[int]] = None) -> List[int]:
+        """Removes documents from the table and indexes"""
+        removed_ids = super().remove(cond, doc_ids)
+        self._written(removed_ids)
+        return removed_ids
+
+    def truncate(self) -> None:
+        """Removes all documents and drops the indexes"""
+        doc_ids = [int(doc_id) for doc_id in self._read_table()]
+        super().truncate()
+        self._indexed_values = None
+        self._written(doc_ids)
+
+    def get_doc_ids(self, field: str, value: Any) -> List[int]:
+        """Returns sorted ids of documents where field equals value"""
+        self._build_indexes()
+        return self._hash_indexes[field].get(value)
+
+    def get_doc_ids_between(self, field: str, low: Any = None, high: Any = None,
+                            include_low: bool = True, include_high: bool = True) -> List[int]:
+        """Returns ids of documents where field is between low and high, ordered by the field"""
+        self._build_indexes()
+        return self._sorted_indexes[field].between(low, high, include_low, include_high)
+
+    def get_documents(self, doc_ids: Iterable[int]) -> List[Document]:
+        """Returns documents in the order of doc_ids, missing ids are skipped"""
+        table = self._read_table()
+        documents = []
+        for doc_id in doc_ids:
+            document = table.get(str(doc_id))
+            if document is not None:
+                documents.append(self.document_class(document, self.document_id_class(doc_id)))
+        return documents
@@ -0,0 +1,372 @@
+"""Journaled database storage module"""
+
+from contextlib import contextmanager
+import json
+import os
+from typing import Any, BinaryIO, Callable, Dict, Generator, Iterable, List, Mapping, Optional, Set, Tuple
+
+from tinydb.storages import Storage
+
+from showtime.storage import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+JOURNAL_SUFFIX = '.journal'
+LOCK_SUFFIX = '.lock'
+DEFAULT_COMPACT_SIZE = 1024 * 1024
+
+Data = Dict[str, Dict[str, Any]]
+SnapshotId = Optional[Tuple[int, int, int]]
+
+_MISSING = object()
+_DECODER = json.JSONDecoder()
+
+
+def _apply(data: Data, entry: Mapping[str, Mapping[str, Any]]) -> None:
+    """Applies single journal entry to the data"""
+    for table_name, documents in entry.items():
+        table = data.setdefault(table_name, {})
+        for doc_id, document in documents.items():
+            if document is None:
+                table.pop(doc_id, None)
+            else:
+                table[doc_id] = document
+
+
+def _split_snapshot(content: str) -> Optional[Dict[str, str]]:
+    """Returns unparsed JSON of every table of an indented snapshot, None if the tables can't be told apart
+
+    With indentation every table starts on a line with its name indented by one level, all lines
+    nested deeper belong to the table.
+    """
+    lines = content.splitlines()
+    if len(lines) < 3 or lines[0] != '{' or lines[-1] != '}':
+        return None
+    prefix = lines[1][:len(lines[1]) - len(lines[1].lstrip())]
+    if not prefix:
+        return None
+    tables: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in lines[1:-1]:
+        if line.startswith(prefix + '"'):
+            try:
+                name, end = _DECODER.raw_decode(line, len(prefix))
+            except ValueError:
+                return None
+            if line[end:end + 2] != ': ':
+                return None
+            current = tables[name] = [line[end + 2:]]
+        elif current is None:
+            return None
+        else:
+            current.append(line)
+    return {name: '\n'.join(chunk).removesuffix(',') for name, chunk in tables.items()}
+
+
+def _merge_fields(base: Dict, ours: Dict, theirs: Dict) -> Dict:
+    """Returns theirs with the fields we changed from base, our value wins a conflict"""
+    merged = dict(theirs)
+    for field in set(base) | set(ours):
+        value = ours.get(field, _MISSING)
+        if value != base.get(field, _MISSING):
+            if value is _MISSING:
+                merged.pop(field, None)
+            else:
+                merged[field] = value
+    return merged
+
+
+class JournalStorage(Storage):
+    """TinyDB storage appending changed documents to a journal instead of rewriting the database
+
+    The database file keeps the usual JSON snapshot. Every flush appends one JSON line with the
+    changed documents of all tables to `<path>.journal` and fsyncs it, deleted documents are
+    written as null. When the journal grows over `compact_size` the snapshot is rewritten and the
+    journal truncated. The files are opened on first access, which replays the journal over the
+    snapshot. Tables of an indented snapshot are parsed only when they are read, `read_table`
+    returns a single table without parsing the others.
+
+    Tables report the documents they change with `record_changes`. A write that is not followed by
+    its report (e.g. dropping a table) can't be journaled and makes the next flush compact instead.
+
+    Several processes can share the files. Reading the files and writing them is serialized with an
+    advisory lock on `<path>.lock`, which is held only for the duration of a refresh or a flush.
+    Before writing, the changes appended by other processes are merged into the data: documents we
+    didn't change are taken over, for documents changed by both the fields we changed win.
+    `generation` is increased every time data written by another process is taken over and
+    `on_merge` is called with the documents changed by both, so derived data can be recomputed
+    before it is written.
+    """
+
+    def __init__(self, path: str, compact_size: int = DEFAULT_COMPACT_SIZE, encoding: str = 'UTF-8',
+                 **kwargs) -> None:
+        super().__init__()
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.lock_path = path + LOCK_SUFFIX
+        self.compact_size = compact_size
+        self.encoding = encoding
+        self.kwargs = kwargs
+        self.generation = 0
+        self.on_merge: Optional[Callable[[Dict[str, Set[str]]], None]] = None
+        self._journal: Optional[BinaryIO] = None
+        self._changes: Dict[str, Set[str]] = {}
+        # documents as they were before the changes not flushed yet, None for inserted documents
+        self._originals: Dict[str, Dict[str, Optional[Dict]]] = {}
+        self._unrecorded_writes = 0
+        self._snapshot_id: SnapshotId = None
+        self._journal_size = 0
+        self._data: Data = {}
+        # unparsed snapshot tables and the journal entries for them, None until the files are opened
+        self._unparsed: Optional[Dict[str, str]] = None
+        self._unparsed_entries: Dict[str, List[Mapping[str, Any]]] = {}
+
+    def _open(self) -> None:
+        """Loads the snapshot and replays the journal, must hold the lock"""
+        self._snapshot_id = self._get_snapshot_id()
+        try:
+            with open(self.path, encoding=self.encoding) as snapshot_file:
+                content = snapshot_file.read()
+        except FileNotFoundError:
+            content = ''
+        self._unparsed = _split_snapshot(content)
+        self._unparsed_entries = {}
+        if self._unparsed is None:
+            self._data = json.loads(content) if content else {}
+            self._unparsed = {}
+        else:
+            self._data = {}
+        entries, self._journal_size = self._read_journal(0)
+        for entry in entries:
+            self._apply_entry(entry)
+
+    def _ensure_open(self) -> Dict[str, str]:
+        """Opens the files on first access, returns the unparsed tables"""
+        if self._unparsed is None:
+            with self._locked():
+                self._open()
+        assert self._unparsed is not None
+        return self._unparsed
+
+    def _apply_entry(self, entry: Mapping[str, Mapping[str, Any]]) -> None:
+        """Applies journal entry, changes of unparsed tables are kept until they are parsed"""
+        unparsed = self._unparsed or {}
+        for table_name, documents in entry.items():
+            if table_name in unparsed:
+                self._unparsed_entries.setdefault(table_name, []).append(documents)
+            else:
+                _apply(self._data, {table_name: documents})
+
+    def _get_table(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """Returns table data, parsing it if needed"""
+        unparsed = self._ensure_open()
+        if table_name in unparsed:
+            self._data[table_name] = json.loads(unparsed.pop(table_name))
+            for documents in self._unparsed_entries.pop(table_name, []):
+                _apply(self._data, {table_name: documents})
+        return self._data.get(table_name)
+
+    @contextmanager
+    def _locked(self) -> Generator[None, None, None]:
+        """Holds the exclusive lock shared by all processes using the database"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a', encoding=self.encoding) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_snapshot_id(self) -> SnapshotId:
+        """Returns identity of the snapshot file, it changes every time the snapshot is replaced"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _get_journal_size(self) -> int:
+        """Returns current size of the journal file"""
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_journal(self, offset: int) -> Tuple[List[Data], int]:
+        """Returns journal entries after offset and the offset after the last one, must hold the lock"""
+        try:
+            with open(self.journal_path, 'rb') as journal_file:
+                journal_file.seek(offset)
+                lines = journal_file.readlines()
+        except FileNotFoundError:
+            return [], 0
+        entries = []
+        for line in lines:
+            try:
+                entry = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                entry = None
+            if not isinstance(entry, dict):
+                # torn write of an interrupted flush, everything after it is dropped
+                with open(self.journal_path, 'r+b') as journal_file:
+                    journal_file.truncate(offset)
+                break
+            entries.append(entry)
+            offset += len(line)
+        return entries, offset
+
+    def _merge(self, table_name: str, doc_id: str, ours: Optional[Dict], theirs: Optional[Dict]) -> None:
+        """Stores document changed both by us and by another process"""
+        self._get_table(table_name)
+        table = self._data.setdefault(table_name, {})
+        base = self._originals.get(table_name, {}).get(doc_id)
+        if ours is None or theirs is None:
+            # our delete wins, our update wins over their delete
+            if ours is None:
+                table.pop(doc_id, None)
+            else:
+                table[doc_id] = ours
+        elif base is None:
+            # both inserted a document with the same id, ours moves to a free id
+            new_id = str(max(int(key) for key in table) + 1)
+            table[doc_id] = theirs
+            table[new_id] = ours
+            self._changes[table_name].discard(doc_id)
+            self._changes[table_name].add(new_id)
+            self._originals[table_name][new_id] = None
+        else:
+            table[doc_id] = _merge_fields(base, ours, theirs)
+
+    def _catch_up(self) -> bool:
+        """Takes over changes written by other processes, must hold the lock, returns true if there were any"""
+        if self._unparsed is None:
+            return False
+        snapshot_id = self._get_snapshot_id()
+        if snapshot_id == self._snapshot_id and self._get_journal_size() == self._journal_size:
+            return False
+        changed = [(table_name, doc_id) for table_name, doc_ids in self._changes.items() for doc_id in doc_ids]
+        ours = {key: self._data.get(key[0], {}).get(key[1]) for key in changed}
+        reloaded = snapshot_id != self._snapshot_id or self._get_journal_size() < self._journal_size
+        entries: List[Data] = []
+        if reloaded:
+            # another process compacted the journal, start over from its snapshot
+            self._open()
+        else:
+            entries, self._journal_size = self._read_journal(self._journal_size)
+            for entry in entries:
+                self._apply_entry(entry)
+        conflicts: Dict[str, Set[str]] = {}
+        for (table_name, doc_id), document in ours.items():
+            if reloaded or any(doc_id in entry.get(table_name, {}) for entry in entries):
+                conflicts.setdefault(table_name, set()).add(doc_id)
+                self._merge(table_name, doc_id, document, (self._get_table(table_name) or {}).get(doc_id))
+        self.generation += 1
+        if conflicts and self.on_merge is not None:
+            self.on_merge(conflicts)
+        return True
+
+    def refresh(self) -> bool:
+        """Takes over changes written by other processes, returns true if there were any"""
+        if self._unparsed is None:
+            return False
+        if self._get_snapshot_id() == self._snapshot_id and self._get_journal_size() == self._journal_size:
+            return False
+        with self._locked():
+            return self._catch_up()
+
+    def read(self) -> Optional[Data]:
+        """Returns the in-memory data of all tables"""
+        for table_name in list(self._ensure_open()):
+            self._get_table(table_name)
+        return self._data
+
+    def read_table(self, table_name: str) -> Dict[str, Any]:
+        """Returns the in-memory data of a single table"""
+        return self._get_table(table_name) or {}
+
+    def write(self, data: Data) -> None:
+        """Replaces the in-memory data, changes are persisted on flush"""
+        self._ensure_open()
+        self._data = data
+        self._unparsed = {}
+        self._unparsed_entries = {}
+        self._unrecorded_writes += 1
+
+    def write_table(self, table_name: str, table: Dict[str, Any]) -> None:
+        """Replaces the in-memory data of a single table, changes are persisted on flush"""
+        unparsed = self._ensure_open()
+        unparsed.pop(table_name, None)
+        self._unparsed_entries.pop(table_name, None)
+        self._data[table_name] = table
+        self._unrecorded_writes += 1
+
+    def record_changes(self, table_name: str, doc_ids: Iterable[int],
+                       originals: Optional[Mapping[int, Optional[Dict]]] = None) -> None:
+        """Marks documents changed by the last write to be journaled
+
+        originals are the documents as they were before the write, they are used to merge the
+        documents with changes of other processes.
+        """
+        changes = self._changes.setdefault(table_name, set())
+        table_originals = self._originals.setdefault(table_name, {})
+        for doc_id, document in (originals or {}).items():
+            table_originals.setdefault(str(doc_id), document)
+        changes.update(str(doc_id) for doc_id in doc_ids)
+        self._unrecorded_writes = max(0, self._unrecorded_writes - 1)
+
+    def flush(self) -> None:
+        """Appends the changed documents to the journal"""
+        if not self._unrecorded_writes and not any(self._changes.values()):
+            return
+        with self._locked():
+            self._catch_up()
+            if self._unrecorded_writes:
+                self._compact()
+                return
+            entry = {table_name: {doc_id: self._data.get(table_name, {}).get(doc_id) for doc_id in doc_ids}
+                     for table_name, doc_ids in self._changes.items() if doc_ids}
+            line = json.dumps(entry).encode(self.encoding) + b'\n'
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'ab')  # pylint: disable=consider-using-with
+            self._journal.write(line)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_size += len(line)
+            self._changes.clear()
+            self._originals.clear()
+            if self._journal_size > self.compact_size:
+                self._compact()
+
+    def compact(self) -> None:
+        """Atomically rewrites the snapshot with all data and truncates the journal"""
+        self._ensure_open()
+        with self._locked():
+            self._catch_up()
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rewrites the snapshot, must hold the lock"""
+        serialized = json.dumps(self.read(), **self.kwargs).encode(self.encoding)
+        atomic_write(self.path, lambda snapshot_file: snapshot_file.write(serialized))
+        if self._journal is not None:
+            self._journal.truncate(0)
+            os.fsync(self._journal.fileno())
+        elif os.path.exists(self.journal_path):
+            os.truncate(self.journal_path, 0)
+        self._snapshot_id = self._get_snapshot_id()
+        self._journal_size = 0
+        self._changes.clear()
+        self._originals.clear()
+        self._unrecorded_writes = 0
+
+    def close(self) -> None:
+        """Flushes pending changes and closes the journal"""
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,116 @@
+"""Request metrics module"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_name(url: str) -> str:
+    """Returns the endpoint of url with numeric ids replaced, e.g. /shows/{id}/episodes"""
+    return _ID_SEGMENT.sub('/{id}', urlparse(url).path) or '/'
+
+
+@dataclass
+class EndpointMetrics:
+    """Collected metrics for a single endpoint"""
+    requests: int = 0
+    cache_hits: int = 0
+    bytes: int = 0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+    latency_buckets: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    statuses: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    rate_limit_wait: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns JSON serializable summary"""
+        network_requests = self.requests - self.cache_hits
+        return {
+            'requests': self.requests,
+            'cache_hits': self.cache_hits,
+            'bytes': self.bytes,
+            'latency': {
+                'total': round(self.latency_total, 6),
+                'mean': round(self.latency_total / self.requests, 6) if self.requests else 0.0,
+                'max': round(self.latency_max, 6),
+                'histogram': {('+Inf' if bound == float('inf') else str(bound)): count
+                              for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+            },
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'rate_limit_wait': round(self.rate_limit_wait, 6),
+            'rate_limit_wait_mean': round(self.rate_limit_wait / network_requests, 6) if network_requests else 0.0,
+        }
+
+
+class Metrics():
+    """Thread-safe per-endpoint request metrics"""
+
+    def __init__(self) -> None:
+        self._endpoints: Dict[str, EndpointMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, url: str) -> EndpointMetrics:
+        """Returns metrics for the endpoint of url, must be called holding the lock"""
+        name = endpoint_name(url)
+        if name not in self._endpoints:
+            self._endpoints[name] = EndpointMetrics()
+        return self._endpoints[name]
+
+    def record_request(self, url: str, status: Optional[int], latency: float, size: int = 0,
+                       cached: bool = False) -> None:
+        """Records completed request"""
+        with self._lock:
+            endpoint = self._endpoint(url)
+            endpoint.requests += 1
+            endpoint.bytes += size
+            endpoint.latency_total += latency
+            endpoint.latency_max = max(endpoint.latency_max, latency)
+            endpoint.latency_buckets[next(i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound)] += 1
+            if status is not None:
+                endpoint.statuses[status] += 1
+            if cached:
+                endpoint.cache_hits += 1
+
+    def record_error(self, url: str, error: BaseException) -> None:
+        """Records request that failed without a response"""
+        with self._lock:
+            self._endpoint(url).errors[type(error).__name__] += 1
+
+    def record_rate_limit_wait(self, url: str, seconds: float) -> None:
+        """Records time spent waiting for the rate limiter"""
+        with self._lock:
+            self._endpoint(url).rate_limit_wait += seconds
+
+    def reset(self) -> None:
+        """Clears all collected metrics"""
+        with self._lock:
+            self._endpoints.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns JSON serializable summary of all endpoints"""
+        with self._lock:
+            endpoints = {name: endpoint.summary() for name, endpoint in sorted(self._endpoints.items())}
+        return {
+            'requests': sum(endpoint['requests'] for endpoint in endpoints.values()),
+            'cache_hits': sum(endpoint['cache_hits'] for endpoint in endpoints.values()),
+            'bytes': sum(endpoint['bytes'] for endpoint in endpoints.values()),
+            'rate_limit_wait': round(sum(endpoint['rate_limit_wait'] for endpoint in endpoints.values()), 6),
+            'endpoints': endpoints,
+        }
+
+    def write_report(self, file_name: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """Writes summary as JSON file"""
+        report = {**(extra or {}), **self.summary()}
+        with open(file_name, 'w', encoding='UTF-8') as report_file:
+            json.dump(report, report_file, sort_keys=True, indent=4)
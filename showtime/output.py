@@ -1,11 +1,11 @@
 """Showtime Output  Module"""
 
 import json
-from typing import Callable, Dict, List
+from typing import Callable, Dict, Iterable, List, Sequence
 
 from terminaltables import AsciiTable as Table  # type: ignore
 
-from showtime.types import (DecoratedEpisode, Episode, Show, TVMazeEpisode,
+from showtime.types import (CompletedShow, DecoratedEpisode, Episode, Show, TVMazeEpisode,
                             TVMazeShow, ShowWithCount)
 
 PrintFunction = Callable[[str], None]
@@ -29,9 +29,9 @@ class Output():
         """Outputs a string with pagination"""
         self.paged_function(output)
 
-    def json(self, data: List[Episode]) -> None:
+    def json(self, data: Sequence[Episode]) -> None:
         """Outputs json"""
-        self.print_function(json.dumps(data, sort_keys=True, indent=4))
+        self.print_function(json.dumps(list(data), sort_keys=True, indent=4))
 
     def perror(self, output: str) -> None:
         """Outputs an error message"""
@@ -55,6 +55,19 @@ class Output():
         """Prints status when show is added"""
         self.poutput(f"Added show: ({show.id}) {show.name} - {show.premiered}")
 
+    def status_on_follow_progress(self, done: int, total: int) -> None:
+        """Prints progress of following multiple shows"""
+        self.pfeedback(f"Processed {done}/{total}")
+
+    def status_on_follow_failures(self, failures: Dict[int, Exception]) -> None:
+        """Prints shows which could not be followed"""
+        for show_id, error in failures.items():
+            self.perror(f"Failed to follow show {show_id}: {error}")
+
+    def status_on_show_sync_failed(self, show: Show, error: Exception) -> None:
+        """Prints error when show could not be synced"""
+        self.perror(f"Failed to sync {show['id']}\t{show['name']}: {error}")
+
     def status_on_show_sync(self, show: Show) -> None:
         """Prints status when show is synced"""
         self.poutput(f"{show['id']}\t{show['name']} ({show['premiered']})")
@@ -109,7 +122,7 @@ class Output():
             ])
         return data
 
-    def format_unwatched(self, episodes: List[DecoratedEpisode]) -> str:
+    def format_unwatched(self, episodes: Iterable[DecoratedEpisode]) -> str:
         """Formats unwatched episodes as table"""
         data = []
         data.append([
@@ -178,7 +191,7 @@ class Output():
         title = 'Unfinished shows'
         return str(Table(data, title=title).table)
 
-    def completed_shows_table(self, shows: List[Show]) -> str:
+    def completed_shows_table(self, shows: List[CompletedShow]) -> str:
         """formats list of completed shows as a table"""
         data = []
         data.append([
@@ -186,7 +199,8 @@ class Output():
             'ID',
             'Name',
             'Premiered',
-            'Status'
+            'Status',
+            'Last watched'
         ])
         i = 0
         for show in shows:
@@ -196,6 +210,7 @@ class Output():
                 show['name'],
                 show['premiered'],
                 show['status'],
+                show['last_watched'][0:10],
             ])
             i = i + 1
         title = 'Completed shows'
@@ -224,6 +239,6 @@ class Output():
         table.justify_columns[2] = 'right'
         return str(table.table)
 
-    def episodes_json(self, episodes: List[DecoratedEpisode]) -> str:
+    def episodes_json(self, episodes: Sequence[DecoratedEpisode]) -> str:
         """Formats decorated episodes as json"""
-        return json.dumps(episodes, sort_keys=True, indent=4)
+        return json.dumps(list(episodes), sort_keys=True, indent=4)
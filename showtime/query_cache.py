@@ -0,0 +1,63 @@
+"""Query result cache module"""
+
+from collections import OrderedDict
+import copy
+import functools
+from typing import Any, Callable, Hashable, TypeVar, cast
+
+DEFAULT_QUERY_CACHE_SIZE = 128
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class QueryCache():
+    """LRU cache of query results which are valid until the write generation changes"""
+
+    def __init__(self, max_size: int = DEFAULT_QUERY_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._results: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def invalidate(self) -> None:
+        """Bumps the write generation, dropping all cached results"""
+        self.generation += 1
+        self._results.clear()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Returns cached result for key, computes and caches it on a miss"""
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+        self.misses += 1
+        generation = self.generation
+        result = compute()
+        # a query writing (e.g. migrating on first use) makes its own result stale
+        if generation == self.generation and self.max_size > 0:
+            self._results[key] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return result
+
+
+def cached(method: F) -> F:
+    """Caches results of a read method in the query_cache of its object
+
+    Results are shallow copied, so callers can change the returned lists, but the records in them
+    are shared with the cache and must not be mutated. Calls with unhashable arguments are not cached.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, *(tuple(arg) if isinstance(arg, list) else arg for arg in args),
+               *sorted(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        return copy.copy(self.query_cache.get(key, lambda: method(self, *args, **kwargs)))
+    return cast(F, wrapper)
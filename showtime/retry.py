@@ -0,0 +1,136 @@
+"""Request retry module"""
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+DEFAULT_RETRY_BUDGET = 100
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(Exception):
+    """Raised when requests to a host are suspended after repeated failures"""
+
+    def __init__(self, host: str, retry_in: float) -> None:
+        super().__init__(f"Requests to {host} are suspended for {retry_in:.1f}s after repeated failures")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Returns seconds to wait from Retry-After header given as seconds or HTTP date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    current = datetime.fromtimestamp(time.time() if now is None else now, tz=timezone.utc)
+    return max(0.0, (retry_at - current).total_seconds())
+
+
+class RetryBudget():
+    """Limits the total number of retries, so a failing upstream can't stretch a run indefinitely"""
+
+    def __init__(self, retries: int = DEFAULT_RETRY_BUDGET) -> None:
+        self.limit = retries
+        self.retries = retries
+        self._lock = threading.Lock()
+
+    def refill(self) -> None:
+        """Restores the full budget, called when a new run starts"""
+        with self._lock:
+            self.retries = self.limit
+
+    def spend(self) -> bool:
+        """Takes one retry from the budget, returns false when the budget is exhausted"""
+        with self._lock:
+            if self.retries <= 0:
+                return False
+            self.retries -= 1
+            return True
+
+
+class CircuitBreaker():
+    """Per-host circuit breaker
+
+    After `failure_threshold` consecutive failures the circuit opens and requests fail fast.
+    Once `reset_timeout` passes a single trial request is let through, success closes the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures: Dict[str, int] = {}
+        self._opened: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def before_request(self, host: str) -> None:
+        """Raises CircuitOpenError if requests to host are suspended"""
+        with self._lock:
+            opened = self._opened.get(host)
+            if opened is None:
+                return
+            retry_in = opened + self.reset_timeout - self._clock()
+            if retry_in > 0:
+                raise CircuitOpenError(host, retry_in)
+            # half-open: let this request through and suspend the others until it completes
+            self._opened[host] = self._clock()
+
+    def record_success(self, host: str) -> None:
+        """Closes the circuit for host"""
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        """Counts failure for host and opens the circuit over the threshold"""
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self.failure_threshold:
+                self._opened[host] = self._clock()
+
+
+class RetryPolicy():
+    """Jittered exponential backoff honoring Retry-After"""
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 budget: Optional[RetryBudget] = None, breaker: Optional[CircuitBreaker] = None,
+                 sleep: Callable[[float], None] = time.sleep,
+                 jitter: Callable[[], float] = random.random) -> None:
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self.jitter = jitter
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns seconds to wait before the next attempt (attempts are counted from 1)"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # "full jitter" spreads the retries of concurrent requests
+        return self.jitter() * min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+
+    def should_retry(self, attempt: int) -> bool:
+        """Returns true if another attempt is allowed, spending from the retry budget"""
+        return attempt < self.max_attempts and self.budget.spend()
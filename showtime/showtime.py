@@ -1,22 +1,116 @@
+from collections.abc import Sequence as SequenceBase
 import csv
 from datetime import date, datetime
-from typing import Callable, Dict, List, Optional, Set, Union, cast
+from itertools import islice
+from typing import (Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple,
+                    TypeVar, Union, cast, overload)
 
 import dateutil.parser
-from ratelimit import limits, sleep_and_retry
 
 from showtime.api import Api
 from showtime.config import Config
 from showtime.database import Database, transaction, NOT_WATCHED_VALUE
-from showtime.types import (DecoratedEpisode, Episode, EpisodeId, Show, ShowId, ShowWithCount,
-                            TVMazeEpisode, TVMazeShow)
+from showtime.metrics import Metrics
+from showtime.sync import DEFAULT_CONCURRENCY, ShowWithEpisodes, SyncEngine
+from showtime.types import (CompletedShow, DecoratedEpisode, Episode, EpisodeId, Show, ShowId, ShowWithCount,
+                            TVMazeEpisode, TVMazeShow, WatchEvent)
 
 
-@sleep_and_retry
-@limits(calls=20, period=10)
-def _get_episodes(api: Api, show_id: ShowId) -> List[TVMazeEpisode]:
-    """Downloads show information from API"""
-    return cast(List[TVMazeEpisode], api.episodes_list(show_id))
+EPISODE_BATCH_SIZE = 500
+PATCH_BATCH_SIZE = 1000
+
+T = TypeVar('T')
+
+
+def _batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Splits iterable in lists of up to size items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class EpisodeChanges(NamedTuple):
+    """Changes bringing the stored episodes of shows up to date with upstream"""
+    inserts: List[Dict]
+    updates: List[Tuple[Dict, int]]
+    deletes: List[EpisodeId]
+    # ids of updated episodes which moved to another season or number
+    renumbered: List[EpisodeId]
+
+    def extend(self, changes: 'EpisodeChanges') -> None:
+        """Adds other changes to these"""
+        self.inserts.extend(changes.inserts)
+        self.updates.extend(changes.updates)
+        self.deletes.extend(changes.deletes)
+        self.renumbered.extend(changes.renumbered)
+
+    def apply(self, db: Database) -> None:
+        """Writes the changes with one bulk write per kind of change"""
+        if self.inserts:
+            db.insert_episodes(self.inserts)
+        if self.updates:
+            db.update_episodes(self.updates)
+        if self.deletes:
+            db.delete_episodes(self.deletes)
+
+
+class DecoratedEpisodes(SequenceBase):
+    """List of episodes decorated with their show names on access
+
+    Decorated episodes are created one at a time while the list is read, so long lists don't have
+    to be copied.
+    """
+
+    def __init__(self, episodes: Sequence[Episode], show_names: Mapping[ShowId, str]) -> None:
+        self._episodes = episodes
+        self._show_names = show_names
+
+    def __len__(self) -> int:
+        return len(self._episodes)
+
+    @overload
+    def __getitem__(self, index: int) -> DecoratedEpisode:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> 'DecoratedEpisodes':
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[DecoratedEpisode, 'DecoratedEpisodes']:
+        if isinstance(index, slice):
+            return DecoratedEpisodes(self._episodes[index], self._show_names)
+        episode = self._episodes[index]
+        return cast(DecoratedEpisode, episode | {'show_name': self._show_names[ShowId(episode['show_id'])]})
+
+
+class WatchtimePatch(NamedTuple):
+    """Summary of a watch time import"""
+    imported: int
+    # line number and reason of every row which was not imported
+    rejected: List[Tuple[int, str]]
+
+
+def parse_watch_time(value: str) -> datetime:
+    """Parses watch time, ISO 8601 times skip the slow generic parser"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+def parse_watchtime_row(row: List[str]) -> Tuple[EpisodeId, datetime]:
+    """Parses episode id and watch time of a csv row, raises ValueError describing an invalid row"""
+    if len(row) < 2:
+        raise ValueError('missing watch time')
+    try:
+        episode_id = EpisodeId(row[0])
+    except ValueError as error:
+        raise ValueError(f'invalid episode id {row[0]!r}') from error
+    try:
+        when = parse_watch_time(row[1])
+    except (ValueError, OverflowError) as error:
+        raise ValueError(f'invalid watch time {row[1]!r}') from error
+    return episode_id, when
 
 
 def needs_update(episode: Episode, tv_maze_episode: TVMazeEpisode):
@@ -33,17 +127,13 @@ class ShowtimeApp():
         self.database = database
         self.config = config
 
-    def _decorate_episodes(self, episodes: List[Episode]) -> List[DecoratedEpisode]:
+    def _decorate_episodes(self, episodes: List[Episode]) -> DecoratedEpisodes:
         """Adds show information to list of episodes"""
-        result: List[DecoratedEpisode] = []
-        shows = {show['id']: show for show in self.database.get_shows()}
-        for episode in episodes:
-            show_id = ShowId(episode['show_id'])
-            show = shows[show_id]
-            show_name = show['name']
-            decorated_episode = cast(DecoratedEpisode, episode | {"show_name": show_name})
-            result.append(decorated_episode)
-        return result
+        return DecoratedEpisodes(episodes, self.database.get_show_names())
+
+    def database_refresh(self) -> None:
+        """Takes over database changes written by other processes"""
+        self.database.refresh()
 
     def show_search(self, query: str) -> List[Show]:
         """Searches shows using the database"""
@@ -53,19 +143,26 @@ class ShowtimeApp():
             shows = [s for s in shows if query in s['name'].lower()]
         return sorted(shows, key=lambda k: k['name'])
 
-    def _sync_episodes(self, db: Database, show_id: ShowId, tv_maze_episodes: List[TVMazeEpisode],
+    def _diff_episodes(self, existing_episodes: Mapping[EpisodeId, Episode], show_id: ShowId,
+                       tv_maze_episodes: Iterable[TVMazeEpisode],
                        on_insert: Optional[Callable[[TVMazeEpisode], None]] = None,
-                       on_update: Optional[Callable[[TVMazeEpisode], None]] = None):
-        """Synchronizes followed shows data with the upstream api"""
-        insert_queue = []
-        update_queue = []
-        existing_episodes = db.get_episodes(show_id)
+                       on_update: Optional[Callable[[TVMazeEpisode], None]] = None,
+                       complete: bool = True) -> EpisodeChanges:
+        """Returns the changes bringing the stored episodes of a show up to date
+
+        Episodes are matched by id, so an episode moved to another season or number keeps its watched
+        state. If tv_maze_episodes is complete, stored episodes missing from it are deleted, unless
+        upstream has no episodes at all.
+        """
+        changes = EpisodeChanges([], [], [], [])
+        seen: Set[EpisodeId] = set()
         for episode in tv_maze_episodes:
-            matched = [x for x in existing_episodes if x['id'] == episode.id]
-            if not matched:
+            seen.add(EpisodeId(episode.id))
+            matched_episode = existing_episodes.get(EpisodeId(episode.id))
+            if matched_episode is None:
                 if on_insert:
                     on_insert(episode)
-                insert_queue.append({
+                changes.inserts.append({
                     'id': episode.id,
                     'show_id': show_id,
                     'season': episode.season,
@@ -75,65 +172,109 @@ class ShowtimeApp():
                     'runtime': episode.runtime,
                     'watched': NOT_WATCHED_VALUE
                 })
-            else:
-                matched_episode = matched.pop()
-                if needs_update(matched_episode, episode):
-                    if on_update:
-                        on_update(episode)
-                    update_queue.append(({
-                        'name': episode.name,
-                        'airdate': episode.airdate,
-                        'runtime': episode.runtime,
-                        'season': episode.season,
-                        'number': episode.number,
-                    }, matched_episode['id']))
-        db.insert_episodes(insert_queue)
-        db.update_episodes(update_queue)
+            elif needs_update(matched_episode, episode):
+                if on_update:
+                    on_update(episode)
+                changes.updates.append(({
+                    'name': episode.name,
+                    'airdate': episode.airdate,
+                    'runtime': episode.runtime,
+                    'season': episode.season,
+                    'number': episode.number,
+                }, matched_episode['id']))
+                if (matched_episode['season'], matched_episode['number']) != (episode.season, episode.number):
+                    changes.renumbered.append(matched_episode['id'])
+        if complete and seen:
+            changes.deletes.extend(episode_id for episode_id in existing_episodes if episode_id not in seen)
+        return changes
+
+    def _sync_episodes(self, db: Database, show_id: ShowId, tv_maze_episodes: Iterable[TVMazeEpisode],
+                       on_insert: Optional[Callable[[TVMazeEpisode], None]] = None,
+                       on_update: Optional[Callable[[TVMazeEpisode], None]] = None) -> None:
+        """Synchronizes followed shows data with the upstream api
+
+        Episodes are diffed and written in batches of EPISODE_BATCH_SIZE with one bulk write per kind
+        of change, so a streamed episode list is never fully materialized. Episodes removed upstream
+        are deleted once all batches are written.
+        """
+        existing_episodes = {EpisodeId(episode['id']): episode for episode in db.get_episodes(show_id)}
+        seen: Set[EpisodeId] = set()
+        for batch in _batched(tv_maze_episodes, EPISODE_BATCH_SIZE):
+            seen.update(EpisodeId(episode.id) for episode in batch)
+            self._diff_episodes(existing_episodes, show_id, batch, on_insert=on_insert, on_update=on_update,
+                                complete=False).apply(db)
+        if seen:
+            removed = [episode_id for episode_id in existing_episodes if episode_id not in seen]
+            EpisodeChanges([], [], removed, []).apply(db)
 
     def show_follow(self, show_id: ShowId,
                     on_episode_insert: Union[Callable[[TVMazeEpisode], None], None] = None,
                     on_episode_update: Union[Callable[[TVMazeEpisode], None], None] = None,
                     on_show_added: Union[Callable[[TVMazeShow], None], None] = None) -> Optional[TVMazeShow]:
         """Follows a show (downloads show information and episodes)"""
-        # add show to db
-        show = self.api.show_get(show_id)
+        show, episodes = self.api.show_get_with_episodes(show_id)
         if show:
             with transaction(self.database) as transacted_db:
+                # add show to db
                 _show_id = transacted_db.add_show(show)
                 # add episodes to db
-                episodes = _get_episodes(self.api, _show_id)
                 self._sync_episodes(transacted_db, _show_id, episodes,
                                     on_insert=on_episode_insert, on_update=on_episode_update)
+                transacted_db.update_show_synced(_show_id, show.updated)
                 if on_show_added:
                     on_show_added(show)
         return show
 
+    def shows_follow(self, show_ids: List[ShowId],
+                     on_episode_insert: Union[Callable[[TVMazeEpisode], None], None] = None,
+                     on_episode_update: Union[Callable[[TVMazeEpisode], None], None] = None,
+                     on_show_added: Union[Callable[[TVMazeShow], None], None] = None,
+                     on_progress: Union[Callable[[int, int], None], None] = None,
+                     concurrency=DEFAULT_CONCURRENCY) -> Dict[ShowId, Exception]:
+        """Follows multiple shows at once
+
+        Shows are downloaded concurrently, the episodes of all shows are inserted together and
+        the database is flushed once. Progress counts followed and failed shows. Returns the shows
+        which could not be followed with the error.
+        """
+        unique_show_ids = list(dict.fromkeys(show_ids))
+        changes = EpisodeChanges([], [], [], [])
+        done = 0
+        with transaction(self.database) as transacted_db:
+            def on_result(show_id: ShowId, result: ShowWithEpisodes) -> None:
+                nonlocal done
+                show, episodes = result
+                if show:
+                    _show_id = transacted_db.add_show(show)
+                    existing_episodes = {EpisodeId(episode['id']): episode
+                                         for episode in transacted_db.get_episodes(_show_id)}
+                    changes.extend(self._diff_episodes(existing_episodes, _show_id, episodes,
+                                                       on_insert=on_episode_insert, on_update=on_episode_update))
+                    transacted_db.update_show_synced(_show_id, show.updated)
+                    if on_show_added:
+                        on_show_added(show)
+                done += 1
+                if on_progress:
+                    on_progress(done, len(unique_show_ids))
+
+            failures = SyncEngine(self.api, concurrency).fetch_shows(unique_show_ids, on_result)
+            if failures and on_progress:
+                on_progress(done + len(failures), len(unique_show_ids))
+            changes.apply(transacted_db)
+        return failures
+
     def show_get(self, show_id: ShowId) -> Optional[Show]:
         """Returns single show"""
         return self.database.get_show(show_id)
 
-    def show_get_completed(self) -> List[Show]:
-        """Returns all shows that have been completed"""
-        completed: Set[ShowId] = set()
-        partial: Set[ShowId] = set()
-        last_watched: Dict[ShowId, str] = {}
-        for episode in self.database.get_all_episodes():
-            show_id = ShowId(episode['show_id'])
-            if show_id in partial:
-                continue
-            if episode['watched'] == '':
-                partial.add(show_id)
-                if show_id in completed:
-                    completed.remove(show_id)
-                continue
-            if (show_id not in last_watched) or (last_watched[show_id] < episode['watched']):
-                last_watched[show_id] = episode['watched']
-
-            completed.add(show_id)
-        last_watched_list = sorted(last_watched.items(), key=lambda t: t[1])
-        show_order = [t[0] for t in last_watched_list]
-        shows = self.database.get_shows_by_ids(list(completed))
-        return sorted(shows, key=lambda row: show_order.index(row['id']))
+    def show_get_completed(self, limit: Optional[int] = None, offset: int = 0) -> List[CompletedShow]:
+        """Returns shows that have been completed, limited to the most recent ones if limit is given"""
+        return self.database.get_completed_shows(limit, offset)
+
+    def show_stats_rebuild(self) -> int:
+        """Recomputes episode aggregates of all shows"""
+        with transaction(self.database) as transacted_db:
+            return transacted_db.rebuild_show_stats()
 
     def episodes_update_all_watched(self, show_id: ShowId, when: datetime):
         """Marks all show episodes as watched"""
@@ -145,44 +286,104 @@ class ShowtimeApp():
         with transaction(self.database) as transacted_db:
             return transacted_db.update_watched_show(show_id, False, when)
 
-    def episodes_watched_between(self, from_date, to_date: date) -> List[DecoratedEpisode]:
-        """Returns all watched episodes between two dates"""
-        episodes = self.database.seen_between(from_date, to_date)
+    def episodes_watched_between(self, from_date, to_date: date) -> DecoratedEpisodes:
+        """Returns episodes watched between two dates, once for every time they were watched"""
+        events = self.database.get_watch_events(from_date, to_date)
+        episodes_by_id: Dict[EpisodeId, Episode] = {}
+        for show_id in dict.fromkeys(event['show_id'] for event in events):
+            episodes_by_id.update((episode['id'], episode) for episode in self.database.get_episodes(show_id))
+        episodes: List[Episode] = []
+        for event in events:
+            episode = episodes_by_id.get(event['episode_id'])
+            if episode is None:
+                # the episode moved to another show after it was watched or was deleted
+                episode = self.database.get_episode(event['episode_id'])
+                if episode is None:
+                    continue
+            episodes.append(cast(Episode, episode | {'watched': event['timestamp']}))
         return self._decorate_episodes(episodes)
 
+    def watch_events_get(self) -> List[WatchEvent]:
+        """Returns every logged watch ordered by time"""
+        return self.database.get_watch_events()
+
     def episodes_get(self, show_id: ShowId) -> List[Episode]:
         """Returns all episodes for a show"""
         return self.database.get_episodes(show_id)
 
+    def _get_outdated_shows(self, shows: List[Show]) -> List[Show]:
+        """Filters shows which were updated upstream since they were last synced"""
+        updates = self.api.show_updates()
+        outdated = []
+        for show in shows:
+            updated = updates.get(ShowId(show['id']))
+            if updated is None or updated > show.get('synced', 0):
+                outdated.append(show)
+        return outdated
+
     def sync(self,
              on_show_sync: Union[Callable[[Show], None], None] = None,
              on_episode_insert: Union[Callable[[TVMazeEpisode], None], None] = None,
              on_episode_update: Union[Callable[[TVMazeEpisode], None], None] = None,
-             all=False):
-        """Updates episode information for followed shows from tvmaze"""
+             all=False,
+             incremental=False,
+             concurrency=DEFAULT_CONCURRENCY,
+             on_show_failed: Union[Callable[[Show, Exception], None], None] = None):
+        """Updates episode information for followed shows from tvmaze
+
+        Shows are downloaded concurrently and written to the database one at a time.
+        In incremental mode only shows updated upstream since their last sync are downloaded.
+        Shows which fail to download are retried at the end and then reported with on_show_failed.
+        """
         with transaction(self.database) as transacted_db:
             shows = transacted_db.get_shows() if all else transacted_db.get_active_shows()
+            if incremental:
+                shows = self._get_outdated_shows(shows)
+            shows_by_id = {ShowId(show['id']): show for show in shows}
 
-            for show in shows:
-                show_id = ShowId(show['id'])
+            def on_result(show_id: ShowId, result: ShowWithEpisodes) -> None:
                 if on_show_sync:
-                    on_show_sync(show)
-                tv_maze_show = self.api.show_get(show_id)
+                    on_show_sync(shows_by_id[show_id])
+                tv_maze_show, tv_maze_episodes = result
                 if tv_maze_show:
                     transacted_db.update_show(show_id, tv_maze_show)
-                    tv_maze_episodes = _get_episodes(self.api, show_id)
                     self._sync_episodes(transacted_db, show_id, tv_maze_episodes,
                                         on_insert=on_episode_insert, on_update=on_episode_update)
+                    transacted_db.update_show_synced(show_id, tv_maze_show.updated)
+
+            failures = SyncEngine(self.api, concurrency).fetch_shows(shows_by_id.keys(), on_result)
+            for show_id, error in failures.items():
+                if on_show_failed:
+                    on_show_failed(shows_by_id[show_id], error)
 
-    def episodes_patch_watchtime(self, file_name: str) -> None:
-        """Patches episodes watch time from external file"""
+    def episodes_patch_watchtime(self, file_name: str) -> WatchtimePatch:
+        """Patches episodes watch time from a csv file with episode id and watch time rows
+
+        The file is read and written in batches. Rows with invalid values or unknown episodes are rejected.
+        """
+        imported = 0
+        rejected: List[Tuple[int, str]] = []
         with open(file_name, newline='', encoding='UTF-8') as csv_file:
-            reader = csv.reader(csv_file, delimiter=',')
+            rows = enumerate(csv.reader(csv_file, delimiter=','), start=1)
             with transaction(self.database) as transacted_db:
-                for row in reader:
-                    episode_id = EpisodeId(row[0])
-                    when = dateutil.parser.parse(row[1])
-                    transacted_db.update_watched(episode_id, True, when)
+                for batch in _batched(rows, PATCH_BATCH_SIZE):
+                    lines: List[int] = []
+                    watches: List[Tuple[EpisodeId, datetime]] = []
+                    for line, row in batch:
+                        if not row:
+                            continue
+                        try:
+                            watches.append(parse_watchtime_row(row))
+                            lines.append(line)
+                        except ValueError as error:
+                            rejected.append((line, str(error)))
+                    found = set(transacted_db.update_watched_times(watches)) if watches else set()
+                    for line, (episode_id, _) in zip(lines, watches):
+                        if episode_id in found:
+                            imported += 1
+                        else:
+                            rejected.append((line, f'unknown episode {episode_id}'))
+        return WatchtimePatch(imported, sorted(rejected))
 
     def show_search_api(self, query: str) -> List[TVMazeShow]:
         """Searches tvmaze for show name"""
@@ -192,6 +393,10 @@ class ShowtimeApp():
         """Returns configuration"""
         return self.config
 
+    def metrics_get(self) -> Optional[Metrics]:
+        """Returns API request metrics"""
+        return self.api.metrics()
+
     def episode_update_watched(self, episode_id: EpisodeId, when: datetime) -> List[int]:
         """Marks episode as watched"""
         with transaction(self.database) as transacted_db:
@@ -221,7 +426,7 @@ class ShowtimeApp():
         with transaction(self.database) as transacted_db:
             return transacted_db.update_watched_show_season(show_id, season, False, when)
 
-    def episodes_get_unwatched(self, when: datetime) -> List[DecoratedEpisode]:
+    def episodes_get_unwatched(self, when: datetime) -> DecoratedEpisodes:
         """Returns list of unwatched episodes"""
         episodes = self.database.get_unwatched(when)
         sorted_episodes = sorted(episodes, key=lambda episode: episode['airdate'] or '')
@@ -249,7 +454,7 @@ class ShowtimeApp():
         """Deletes an episode"""
         return self.database.delete_episode(episode_id)
 
-    def episodes_aired_unseen_between(self, from_date, to_date: date) -> List[DecoratedEpisode]:
+    def episodes_aired_unseen_between(self, from_date, to_date: date) -> DecoratedEpisodes:
         """Returns aired but not watched episodes between dates"""
         episodes = self.database.aired_unseen_between(from_date, to_date)
         return self._decorate_episodes(episodes)
@@ -0,0 +1,444 @@
+"""Showtime SQLite Database Module"""
+
+from datetime import date, datetime, timedelta
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, cast
+
+from showtime.database import EPISODE, NOT_WATCHED_VALUE, SHOW, WATCH_EVENT, is_episode_table
+from showtime.journal import JournalStorage
+from showtime.types import (CompletedShow, Episode, EpisodeId, Show, ShowId, ShowStatus, ShowWithCount,
+                            TVMazeEpisode, TVMazeShow, WatchEvent)
+
+SQLITE_BACKEND = 'sqlite'
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {SHOW} (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    premiered TEXT,
+    status TEXT,
+    externals TEXT,
+    synced INTEGER
+);
+CREATE TABLE IF NOT EXISTS {EPISODE} (
+    id INTEGER PRIMARY KEY,
+    show_id INTEGER NOT NULL,
+    season INTEGER,
+    number INTEGER,
+    name TEXT,
+    airdate TEXT,
+    runtime INTEGER,
+    watched TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS episode_show_season_number ON {EPISODE} (show_id, season, number);
+CREATE INDEX IF NOT EXISTS episode_watched ON {EPISODE} (watched);
+CREATE INDEX IF NOT EXISTS episode_airdate ON {EPISODE} (airdate);
+CREATE TABLE IF NOT EXISTS {WATCH_EVENT} (
+    episode_id INTEGER NOT NULL,
+    show_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    runtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS watch_event_timestamp ON {WATCH_EVENT} (timestamp);
+CREATE INDEX IF NOT EXISTS watch_event_episode ON {WATCH_EVENT} (episode_id);
+"""
+
+# selects a column of the last logged watch of the episode in the enclosing query
+_LAST_WATCH = f"""
+    SELECT {{column}} FROM {WATCH_EVENT} WHERE {WATCH_EVENT}.episode_id = {EPISODE}.id
+    ORDER BY {WATCH_EVENT}.timestamp DESC, {WATCH_EVENT}.rowid DESC LIMIT 1
+"""
+
+# stored in user_version, 1 added the watch events
+SCHEMA_VERSION = 1
+
+EPISODE_COLUMNS = ('id', 'show_id', 'season', 'number', 'name', 'airdate', 'runtime', 'watched')
+EPISODE_UPDATE_COLUMNS = ('name', 'airdate', 'runtime', 'season', 'number', 'watched')
+EPISODE_ORDER = 'season * 1000 + number'
+
+# SQLite limits the number of bound parameters per statement
+MAX_PARAMETERS = 500
+
+
+def _show_from_row(row: sqlite3.Row) -> Show:
+    """Converts row to show"""
+    show = dict(row)
+    show['externals'] = json.loads(show['externals']) if show['externals'] else {}
+    if show.get('synced') is None:
+        show.pop('synced', None)
+    return cast(Show, show)
+
+
+def _episode_from_row(row: sqlite3.Row) -> Episode:
+    """Converts row to episode"""
+    return cast(Episode, dict(row))
+
+
+def _chunks(items: Sequence[Any], size: int = MAX_PARAMETERS) -> Iterator[Sequence[Any]]:
+    """Splits items in chunks which fit in a single statement"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteDatabase():
+    """SQLite storage with the same interface as the TinyDB based Database
+
+    Writes are collected in an implicit transaction which is committed on flush.
+    """
+
+    _transaction_depth = 0
+    _rollback_only = False
+
+    def __init__(self, file_name: str = ':memory:') -> None:
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.row_factory = sqlite3.Row
+        if file_name != ':memory:':
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        if self._query('PRAGMA user_version')[0][0] < SCHEMA_VERSION:
+            self._backfill_watch_events()
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.connection.commit()
+
+    def _backfill_watch_events(self) -> None:
+        """Logs the last watch of episodes watched before the watch events existed"""
+        self.connection.execute(f"""
+            INSERT INTO {WATCH_EVENT} (episode_id, show_id, timestamp, runtime)
+            SELECT id, show_id, watched, runtime FROM {EPISODE}
+            WHERE watched != ? AND id NOT IN (SELECT episode_id FROM {WATCH_EVENT})
+        """, (NOT_WATCHED_VALUE,))
+
+    def __enter__(self) -> 'SQLiteDatabase':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Commits pending changes and closes the database"""
+        self.connection.commit()
+        self.connection.close()
+
+    def flush(self):
+        """Commits pending changes"""
+        self.connection.commit()
+
+    def refresh(self) -> None:
+        """Does nothing, SQLite sees changes of other connections by itself"""
+
+    def begin(self) -> None:
+        """Starts transaction, nested transactions become part of the outermost one"""
+        self._transaction_depth += 1
+
+    def commit(self) -> None:
+        """Ends transaction, the outermost one commits the changes"""
+        self._transaction_depth -= 1
+        if not self._transaction_depth:
+            if self._rollback_only:
+                self._rollback_only = False
+                self.connection.rollback()
+            else:
+                self.connection.commit()
+
+    def rollback(self) -> None:
+        """Ends transaction, the outermost one discards the changes"""
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            self._rollback_only = True
+        else:
+            self._rollback_only = False
+            self.connection.rollback()
+
+    def _query(self, sql: str, parameters: Iterable[Any] = ()) -> List[sqlite3.Row]:
+        """Returns all rows of a query"""
+        return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    def _ids(self, table: str, where: str, parameters: Iterable[Any] = ()) -> List[int]:
+        """Returns ids of rows matching the condition"""
+        return [row[0] for row in self._query(f'SELECT id FROM {table} WHERE {where}', parameters)]
+
+    def add_show(self, tv_maze_show: TVMazeShow) -> ShowId:
+        """Adds a show if it is not already added"""
+        self.connection.execute(
+            f'INSERT OR IGNORE INTO {SHOW} (id, name, premiered, status, externals) VALUES (?, ?, ?, ?, ?)',
+            (tv_maze_show.id, tv_maze_show.name, tv_maze_show.premiered, tv_maze_show.status,
+             json.dumps(tv_maze_show.externals)))
+        return ShowId(tv_maze_show.id)
+
+    def update_show(self, show_id, tv_maze_show: TVMazeShow) -> List[int]:
+        """Updates show information"""
+        ids = self._ids(SHOW, 'id = ?', (show_id,))
+        self.connection.execute(
+            f'UPDATE {SHOW} SET name = ?, premiered = ?, status = ?, externals = ? WHERE id = ?',
+            (tv_maze_show.name, tv_maze_show.premiered, tv_maze_show.status,
+             json.dumps(tv_maze_show.externals), show_id))
+        return ids
+
+    def update_show_synced(self, show_id: ShowId, updated: int) -> List[int]:
+        """Stores the upstream update timestamp the show was last synced at"""
+        ids = self._ids(SHOW, 'id = ?', (show_id,))
+        self.connection.execute(f'UPDATE {SHOW} SET synced = ? WHERE id = ?', (updated, show_id))
+        return ids
+
+    def add_episode(self, show_id: ShowId, episode: TVMazeEpisode) -> EpisodeId:
+        """Helper method used in tests"""
+        self.insert_episodes([{
+            'id': episode.id,
+            'show_id': show_id,
+            'season': episode.season,
+            'number': episode.number,
+            'name': episode.name,
+            'airdate': episode.airdate,
+            'runtime': episode.runtime,
+            'watched': NOT_WATCHED_VALUE
+        }])
+        return EpisodeId(episode.id)
+
+    def get_shows(self) -> List[Show]:
+        """Returns list of all added shows"""
+        return [_show_from_row(row) for row in self._query(f'SELECT * FROM {SHOW} ORDER BY rowid')]
+
+    def get_show_names(self) -> Mapping[ShowId, str]:
+        """Returns names of all added shows by id"""
+        return {row['id']: row['name'] for row in self._query(f'SELECT id, name FROM {SHOW}')}
+
+    def get_active_shows(self) -> List[Show]:
+        """Gets list of shows which have not ended"""
+        rows = self._query(f'SELECT * FROM {SHOW} WHERE status IS NOT ? ORDER BY rowid', (ShowStatus.ENDED.value,))
+        return [_show_from_row(row) for row in rows]
+
+    def get_show(self, show_id: ShowId) -> Optional[Show]:
+        """Returns single show"""
+        rows = self._query(f'SELECT * FROM {SHOW} WHERE id = ?', (show_id,))
+        return _show_from_row(rows[0]) if rows else None
+
+    def get_episode(self, episode_id: EpisodeId) -> Optional[Episode]:
+        """Returns single episode"""
+        rows = self._query(f'SELECT * FROM {EPISODE} WHERE id = ?', (episode_id,))
+        return _episode_from_row(rows[0]) if rows else None
+
+    def delete_episode(self, episode_id: EpisodeId) -> List[int]:
+        """Deletes an episode from the database"""
+        ids = self._ids(EPISODE, 'id = ?', (episode_id,))
+        self.connection.execute(f'DELETE FROM {EPISODE} WHERE id = ?', (episode_id,))
+        return ids
+
+    def delete_episodes(self, episode_ids: List[EpisodeId]) -> List[int]:
+        """Deletes list of episodes from the database, unknown episodes are skipped"""
+        deleted: List[int] = []
+        for chunk in _chunks(episode_ids):
+            where = f'id IN ({", ".join("?" * len(chunk))})'
+            deleted += self._ids(EPISODE, where, chunk)
+            self.connection.execute(f'DELETE FROM {EPISODE} WHERE {where}', chunk)
+        return deleted
+
+    def insert_episodes(self, episodes: List[Dict]) -> List[int]:
+        """Inserts list of episodes"""
+        placeholders = ', '.join('?' * len(EPISODE_COLUMNS))
+        self.connection.executemany(
+            f'INSERT OR REPLACE INTO {EPISODE} ({", ".join(EPISODE_COLUMNS)}) VALUES ({placeholders})',
+            [tuple(episode.get(column, NOT_WATCHED_VALUE if column == 'watched' else None)
+                   for column in EPISODE_COLUMNS) for episode in episodes])
+        return [episode['id'] for episode in episodes]
+
+    def update_episodes(self, episodes: List[Tuple[Dict, int]]) -> List[int]:
+        """Updates list of episodes"""
+        updated: List[int] = []
+        for fields, episode_id in episodes:
+            columns = [column for column in EPISODE_UPDATE_COLUMNS if column in fields]
+            if not columns:
+                continue
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            cursor = self.connection.execute(f'UPDATE {EPISODE} SET {assignments} WHERE id = ?',
+                                             [fields[column] for column in columns] + [episode_id])
+            if cursor.rowcount:
+                updated.append(episode_id)
+        return updated
+
+    def _update_watched(self, watched: bool, when: datetime, where: str, parameters: Sequence[Any],
+                        rewatch: bool = False) -> List[int]:
+        """Logs a watch of the episodes matching the condition or retracts all their watches
+
+        Episodes already watched are skipped unless marking a rewatch.
+        """
+        if watched and not rewatch:
+            where = f'({where}) AND watched = ?'
+            parameters = (*parameters, NOT_WATCHED_VALUE)
+        ids = self._ids(EPISODE, where, parameters)
+        if watched:
+            self.connection.execute(f"""
+                INSERT INTO {WATCH_EVENT} (episode_id, show_id, timestamp, runtime)
+                SELECT id, show_id, ?, runtime FROM {EPISODE} WHERE {where} ORDER BY rowid
+            """, (when.isoformat(), *parameters))
+        else:
+            self.connection.execute(f"""
+                DELETE FROM {WATCH_EVENT} WHERE episode_id IN (SELECT id FROM {EPISODE} WHERE {where})
+            """, parameters)
+        self._update_last_watched(where, parameters)
+        return ids
+
+    def _update_last_watched(self, where: str, parameters: Sequence[Any]) -> None:
+        """Sets the watched date of episodes to their last logged watch"""
+        self.connection.execute(f"""
+            UPDATE {EPISODE} SET watched = COALESCE(({_LAST_WATCH.format(column='timestamp')}), ?) WHERE {where}
+        """, (NOT_WATCHED_VALUE, *parameters))
+
+    def update_watched(self, episode_id: EpisodeId, watched: bool, when: datetime) -> List[int]:
+        """Updates the watched date of an episode, marking a watched episode as watched logs a rewatch"""
+        return self._update_watched(watched, when, 'id = ?', (episode_id,), rewatch=True)
+
+    def update_watched_episodes(self, episode_ids: List[EpisodeId], watched: bool, when: datetime) -> List[int]:
+        """Updates the watched date of episodes, episodes already watched are kept"""
+        updated: List[int] = []
+        for chunk in _chunks(episode_ids):
+            updated += self._update_watched(watched, when, f'id IN ({", ".join("?" * len(chunk))})', chunk)
+        return updated
+
+    def update_watched_times(self, watches: List[Tuple[EpisodeId, datetime]]) -> List[EpisodeId]:
+        """Sets the time episodes were last watched, returns ids of the episodes found
+
+        The time replaces the last logged watch of an episode, a watch is logged only for episodes
+        not watched yet. An episode listed more than once gets its last time in the list.
+        """
+        known: Set[EpisodeId] = set()
+        for chunk in _chunks(list(dict.fromkeys(episode_id for episode_id, _ in watches))):
+            known.update(self._ids(EPISODE, f'id IN ({", ".join("?" * len(chunk))})', chunk))
+        timestamps = {episode_id: when.isoformat() for episode_id, when in watches if episode_id in known}
+        self.connection.executemany(f"""
+            UPDATE {WATCH_EVENT} SET timestamp = ? WHERE rowid = (
+                SELECT rowid FROM {WATCH_EVENT} WHERE episode_id = ? ORDER BY timestamp DESC, rowid DESC LIMIT 1
+            )
+        """, [(timestamp, episode_id) for episode_id, timestamp in timestamps.items()])
+        self.connection.executemany(f"""
+            INSERT INTO {WATCH_EVENT} (episode_id, show_id, timestamp, runtime)
+            SELECT id, show_id, ?, runtime FROM {EPISODE}
+            WHERE id = ? AND NOT EXISTS (SELECT 1 FROM {WATCH_EVENT} WHERE episode_id = {EPISODE}.id)
+        """, [(timestamp, episode_id) for episode_id, timestamp in timestamps.items()])
+        for chunk in _chunks(list(timestamps)):
+            self._update_last_watched(f'id IN ({", ".join("?" * len(chunk))})', chunk)
+        return [episode_id for episode_id, _ in watches if episode_id in known]
+
+    def update_watched_show(self, show_id: ShowId, watched: bool, when: datetime) -> List[int]:
+        """Updates all episodes of a show as watched now"""
+        return self._update_watched(watched, when, 'show_id = ?', (show_id,))
+
+    def update_watched_show_season(self, show_id: ShowId, season: int, watched: bool, when: datetime) -> List[int]:
+        """Updates all episodes of a show and season as watched now"""
+        return self._update_watched(watched, when, 'show_id = ? AND season = ?', (show_id, season))
+
+    def _search_episodes(self, where: str, parameters: Iterable[Any] = (), order: str = 'rowid') -> List[Episode]:
+        rows = self._query(f'SELECT * FROM {EPISODE} WHERE {where} ORDER BY {order}', parameters)
+        return [_episode_from_row(row) for row in rows]
+
+    def get_episodes(self, show_id: ShowId) -> List[Episode]:
+        """Returns sorted list of episodes for a show"""
+        return self._search_episodes('show_id = ?', (show_id,), order=EPISODE_ORDER)
+
+    def get_unwatched(self, when: datetime) -> List[Episode]:
+        """Returns all aired episodes which are not watched yet"""
+        return self._search_episodes('watched = ? AND airdate <= ?', (NOT_WATCHED_VALUE, when.isoformat()))
+
+    def seen_between(self, from_date: date, to_date: date) -> List[Episode]:
+        """Returns list of episodes that were watched between two dates"""
+        return self._search_episodes('watched >= ? AND watched < ?',
+                                     (from_date.isoformat(), (to_date + timedelta(days=1)).isoformat()))
+
+    def aired_unseen_between(self, from_date: date, to_date: date) -> List[Episode]:
+        """Returns list of episodes that were aired but have not been seen between two dates"""
+        return self._search_episodes('airdate >= ? AND airdate < ? AND watched = ?',
+                                     (from_date.isoformat(), (to_date + timedelta(days=1)).isoformat(),
+                                      NOT_WATCHED_VALUE))
+
+    def get_watched_episodes(self) -> List[Episode]:
+        """Returns all episodes that have not been watched"""
+        return self._search_episodes('watched != ?', (NOT_WATCHED_VALUE,))
+
+    def get_all_episodes(self) -> Iterator[Episode]:
+        """Returns all episodes iterator"""
+        return map(_episode_from_row, self.connection.execute(f'SELECT * FROM {EPISODE} ORDER BY rowid'))
+
+    def get_watch_events(self, from_date: Optional[date] = None, to_date: Optional[date] = None) -> List[WatchEvent]:
+        """Returns logged watches between two dates ordered by time, missing date leaves the range open"""
+        conditions = ['1']
+        parameters = []
+        if from_date:
+            conditions.append('timestamp >= ?')
+            parameters.append(from_date.isoformat())
+        if to_date:
+            conditions.append('timestamp < ?')
+            parameters.append((to_date + timedelta(days=1)).isoformat())
+        rows = self._query(f"""
+            SELECT episode_id, show_id, timestamp, runtime FROM {WATCH_EVENT}
+            WHERE {' AND '.join(conditions)} ORDER BY timestamp, rowid
+        """, parameters)
+        return [cast(WatchEvent, dict(row)) for row in rows]
+
+    def get_shows_by_ids(self, show_ids: List[ShowId]) -> List[Show]:
+        """Returns list of shows given list of show id-s"""
+        shows: List[Show] = []
+        for chunk in _chunks(show_ids):
+            rows = self._query(f'SELECT * FROM {SHOW} WHERE id IN ({", ".join("?" * len(chunk))}) ORDER BY rowid',
+                               chunk)
+            shows += [_show_from_row(row) for row in rows]
+        return shows
+
+    def get_unfinished_shows(self) -> List[ShowWithCount]:
+        """Returns list of unfinished shows"""
+        rows = self._query(f"""
+            SELECT {SHOW}.*, COUNT({EPISODE}.id) AS total, COALESCE(SUM({EPISODE}.watched != ''), 0) AS seen
+            FROM {SHOW} LEFT JOIN {EPISODE} ON {EPISODE}.show_id = {SHOW}.id
+            GROUP BY {SHOW}.id
+            HAVING total > seen
+            ORDER BY COALESCE({SHOW}.premiered, '')
+        """)
+        return cast(List[ShowWithCount], [_show_from_row(row) for row in rows])
+
+    def get_completed_shows(self, limit: Optional[int] = None, offset: int = 0) -> List[CompletedShow]:
+        """Returns shows with all episodes watched, ordered by the time the last episode was watched
+
+        Offset skips the most recently completed shows and limit keeps only that many of the most recent
+        remaining ones.
+        """
+        rows = self._query(f"""
+            SELECT {SHOW}.*, MAX({EPISODE}.watched) AS last_watched FROM {SHOW}
+            JOIN {EPISODE} ON {EPISODE}.show_id = {SHOW}.id
+            GROUP BY {SHOW}.id
+            HAVING SUM({EPISODE}.watched = '') = 0
+            ORDER BY last_watched DESC, {SHOW}.id DESC
+            LIMIT ? OFFSET ?
+        """, (-1 if limit is None else limit, offset))
+        return [cast(CompletedShow, _show_from_row(row)) for row in reversed(rows)]
+
+    def rebuild_show_stats(self) -> int:
+        """Returns number of shows with episodes, the aggregates are computed by indexed queries"""
+        return self._query(f'SELECT COUNT(DISTINCT show_id) FROM {EPISODE}')[0][0]
+
+
+def migrate_json_to_sqlite(json_file_name: str, sqlite_file_name: str) -> Tuple[int, int]:
+    """Copies shows and episodes from a JSON database file, returns the number of copied shows and episodes"""
+    # read through the journal so changes not yet compacted into the snapshot are included
+    data = JournalStorage(json_file_name).read() or {}
+    shows = list(data.get(SHOW, {}).values())
+    episodes = [episode for table_name, table in data.items() if is_episode_table(table_name)
+                for episode in table.values()]
+    with SQLiteDatabase(sqlite_file_name) as database:
+        database.connection.executemany(
+            f'INSERT OR REPLACE INTO {SHOW} (id, name, premiered, status, externals, synced) VALUES (?, ?, ?, ?, ?, ?)',
+            [(show['id'], show.get('name'), show.get('premiered'), show.get('status'),
+              json.dumps(show.get('externals') or {}), show.get('synced')) for show in shows])
+        database.insert_episodes(episodes)
+        events = list(data.get(WATCH_EVENT, {}).values())
+        database.connection.executemany(
+            f'INSERT INTO {WATCH_EVENT} (episode_id, show_id, timestamp, runtime) VALUES (?, ?, ?, ?)',
+            [(event['episode_id'], event['show_id'], event['timestamp'], event.get('runtime')) for event in events])
+        # databases written before the watch events have only the last watch of every episode
+        database._backfill_watch_events()  # pylint: disable=protected-access
+    return len(shows), len(episodes)
+
+
+def get_sqlite_db(file_name: str) -> SQLiteDatabase:
+    """Returns SQLite database instance"""
+    return SQLiteDatabase(file_name)
@@ -0,0 +1,62 @@
+"""Durable file storage module"""
+
+import json
+import os
+from typing import Any, BinaryIO, Callable, Dict
+
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+
+def atomic_write(path: str, write: Callable[[BinaryIO], object]) -> None:
+    """Replaces file with the content written by write, readers see either the old or the new file
+
+    The content is written to a temporary file and fsynced before it is renamed over the file,
+    the directory is fsynced after the rename so the rename itself survives a crash.
+    """
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as temp_file:
+            write(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class AtomicJSONStorage(JSONStorage):
+    """JSON storage replacing the file atomically instead of rewriting it in place"""
+
+    def __init__(self, path: str, encoding: str = 'UTF-8', **kwargs) -> None:
+        super().__init__(path, encoding=encoding, **kwargs)
+        self.path = path
+        self.encoding = encoding
+
+    def write(self, data: Dict[str, Dict[str, Any]]) -> None:
+        """Atomically replaces the file with data"""
+        serialized = json.dumps(data, **self.kwargs).encode(self.encoding)
+        atomic_write(self.path, lambda file: file.write(serialized))
+        # the handle still refers to the replaced file, reopen it so reads see the new content
+        self._handle.close()
+        self._handle = open(self.path, mode=self._mode, encoding=self.encoding)  # pylint: disable=consider-using-with
+
+
+class FlushingMiddleware(CachingMiddleware):
+    """Caching middleware writing to the storage only when flushed
+
+    CachingMiddleware also writes on its own every WRITE_CACHE_SIZE writes, which would put
+    changes of an unfinished transaction on disk. The database flushes when a transaction commits.
+    """
+
+    def write(self, data: Dict[str, Dict[str, Any]]) -> None:
+        """Keeps data in the cache until the next flush"""
+        self.cache = data
+        self._cache_modified_count += 1
@@ -0,0 +1,83 @@
+"""Concurrent synchronization module"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from showtime.api import Api, StreamError
+from showtime.retry import CircuitOpenError
+from showtime.types import ShowId, TVMazeEpisode, TVMazeShow
+
+DEFAULT_CONCURRENCY = 4
+
+ShowWithEpisodes = Tuple[Optional[TVMazeShow], Iterator[TVMazeEpisode]]
+
+
+class SyncEngine():
+    """Downloads shows concurrently
+
+    The blocking API calls run in a thread pool while the event loop keeps at most
+    `concurrency` requests in flight, a show requested more than once is downloaded once.
+    Results are handed to `on_result` on the event loop thread one at a time, so database
+    writes done there stay serialized. Episodes are streamed, so on_result reads them from the
+    response; a show whose episodes fail to stream is counted as failed. Rate limiting is done by
+    the HTTP client for every request.
+    """
+
+    def __init__(self, api: Api, concurrency: int = DEFAULT_CONCURRENCY,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self.sleep = sleep
+
+    async def _fetch_show(self, show_id: ShowId, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor,
+                          on_result: Callable[[ShowId, ShowWithEpisodes], None],
+                          failures: Dict[ShowId, Exception]) -> None:
+        """Downloads show with episodes and feeds it to on_result, failures are collected instead of raised
+
+        The slot is kept until on_result has read the streamed episodes, so at most `concurrency`
+        responses are open at once.
+        """
+        async with semaphore:
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(executor, self.api.show_get_with_episodes,
+                                                                          show_id)
+            except Exception as error:  # pylint: disable=broad-except
+                failures[show_id] = error
+                return
+            try:
+                on_result(show_id, result)
+            except StreamError as error:
+                failures[show_id] = error
+
+    async def _run(self, show_ids: Iterable[ShowId],
+                   on_result: Callable[[ShowId, ShowWithEpisodes], None]) -> Dict[ShowId, Exception]:
+        """Downloads all shows and feeds results as they complete"""
+        failures: Dict[ShowId, Exception] = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            await asyncio.gather(*(self._fetch_show(show_id, semaphore, executor, on_result, failures)
+                                   for show_id in dict.fromkeys(show_ids)))
+        return failures
+
+    def fetch_shows(self, show_ids: Iterable[ShowId],
+                    on_result: Callable[[ShowId, ShowWithEpisodes], None],
+                    retry_failures: bool = True) -> Dict[ShowId, Exception]:
+        """Downloads shows with their episodes concurrently
+
+        Calls on_result for every downloaded show and returns the failed downloads keyed by show id.
+        Failed shows are collected and downloaded once more after all other shows,
+        once the circuit breaker lets requests through again. Every call starts with a full retry budget.
+        """
+        retry = self.api.retry()
+        if retry:
+            retry.budget.refill()
+        failures = asyncio.run(self._run(show_ids, on_result))
+        if failures and retry_failures:
+            retry_in = max((error.retry_in for error in failures.values() if isinstance(error, CircuitOpenError)),
+                           default=0.0)
+            if retry_in > 0:
+                self.sleep(retry_in)
+            failures = asyncio.run(self._run(list(failures), on_result))
+        return failures
@@ -0,0 +1,52 @@
+"""Request throttling module"""
+
+import threading
+import time
+from typing import Callable
+
+# TVMaze allows at least 20 calls every 10 seconds per IP
+DEFAULT_CALLS = 20
+DEFAULT_PERIOD = 10.0
+
+
+class TokenBucket():
+    """Thread-safe token bucket rate limiter
+
+    The bucket holds up to `calls` tokens and refills at `calls / period` tokens per second,
+    so bursts of up to `calls` requests are allowed and the long-running rate stays within the limit.
+    """
+
+    def __init__(self, calls: int = DEFAULT_CALLS, period: float = DEFAULT_PERIOD,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.capacity = float(calls)
+        self.rate = calls / period
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        """Adds the tokens accumulated since the last refill"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Takes a token if available, otherwise returns seconds until one is available"""
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Blocks until a token is available, returns the total time waited in seconds"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if delay <= 0:
+                return waited
+            self._sleep(delay)
+            waited += delay
@@ -2,7 +2,7 @@
 
 from enum import Enum
 from typing import NamedTuple, Dict
-from typing_extensions import TypedDict
+from typing_extensions import NotRequired, TypedDict
 
 ShowId = int
 EpisodeId = int
@@ -17,6 +17,7 @@ class TVMazeShow(NamedTuple):
     status: str
     url: str
     externals: Dict
+    updated: int = 0
 
 
 class TVMazeEpisode(NamedTuple):
@@ -44,6 +45,7 @@ class Show(TypedDict):
     premiered: Date
     status: str
     externals: Dict
+    synced: NotRequired[int]
 
 
 class ShowWithCount(Show):
@@ -52,6 +54,19 @@ class ShowWithCount(Show):
     seen: int
 
 
+class CompletedShow(Show):
+    """DB Show with the time its last episode was watched"""
+    last_watched: Date
+
+
+class ShowStats(TypedDict):
+    """DB Show episode aggregates"""
+    show_id: ShowId
+    total: int
+    seen: int
+    last_watched: Date
+
+
 class Episode(TypedDict):
     """DB Episode"""
     id: EpisodeId
@@ -64,6 +79,14 @@ class Episode(TypedDict):
     watched: Date
 
 
+class WatchEvent(TypedDict):
+    """DB Single time an episode was watched"""
+    episode_id: EpisodeId
+    show_id: ShowId
+    timestamp: Date
+    runtime: int
+
+
 class DecoratedEpisode(Episode):
     """Decorated Episode"""
     show_name: str
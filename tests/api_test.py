@@ -1,9 +1,14 @@
 from types import SimpleNamespace
-from unittest.mock import MagicMock, Mock
+from unittest.mock import MagicMock, Mock, patch
+import gzip
 import pytest
 from helpers import tv_maze_show, tv_maze_episode
 
-from showtime.api import Api
+from showtime.api import (Api, CacheMissError, HTTPClient, HTTPError, StreamError, decode_show_with_episodes,
+                          iter_json_array)
+from showtime.cache import ResponseCache
+from showtime.metrics import Metrics
+from showtime.retry import CircuitBreaker, RetryPolicy
 
 
 def get_response(data: str):
@@ -40,6 +45,39 @@ def test_episodes_list(test_api):
     assert result == [tv_maze_episode]
 
 
+def test_episodes_stream(test_api):
+    test_api.http.stream = MagicMock(return_value=iter([b'[{"id": 1, "season": 1, "number": 1, "na',
+                                                        b'me": "The first episode", "airdate": "2020-01-01", ',
+                                                        b'"runtime": 60}]']))
+
+    result = test_api.episodes_stream(1)
+
+    assert list(result) == [tv_maze_episode]
+    test_api.http.stream.assert_called_once_with('GET', 'https://api.tvmaze.com/shows/1/episodes')
+
+
+@pytest.mark.parametrize('chunks,expected', [
+    ([b'[]'], []),
+    ([b' [ 1, 2', b'3 ,{"a": "\xc3', b'\xa9"}, [4] ] '], [1, 23, {'a': 'é'}, [4]]),
+    ([b'[1.', b'5]'], [1.5]),
+    ([b'[2e', b'3, -', b'1]'], [2000.0, -1]),
+    ([b'[true', b', 4', b']'], [True, 4]),
+])
+def test_iter_json_array(chunks, expected):
+    assert list(iter_json_array(chunks)) == expected
+
+
+def test_iter_json_array_truncated():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[{"id": 1}, {"id"']))
+
+
+@pytest.mark.parametrize('chunks', [[b'[1 2]'], [b'[1.]'], [b'{}']])
+def test_iter_json_array_invalid(chunks):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunks))
+
+
 def test_show_get(test_api):
     response = get_response("""
 {
@@ -59,6 +97,50 @@ def test_show_get(test_api):
     assert result == tv_maze_show
 
 
+def test_show_get_with_episodes(test_api):
+    test_api.http.stream = MagicMock(return_value=iter([
+        b'{"id":1, "name": "test-show", "premiered": "2020-01-01", "status": "Ended", "url": "https:/www.exa',
+        b'mple.com/1", "externals":{"tmdb": "111"}, "_embedded": {"cast": [{"id": 2}], "episodes": [{"id": 1, ',
+        b'"season": 1, "number": 1, "name": "The first episode", "airdate": "2020-01-01", "runtime": 6',
+        b'0}]}, "updated": 0}',
+    ]))
+
+    show, episodes = test_api.show_get_with_episodes(1)
+
+    test_api.http.stream.assert_called_once_with('GET', 'https://api.tvmaze.com/shows/1', fields={'embed': 'episodes'})
+    assert show == tv_maze_show
+    assert list(episodes) == [tv_maze_episode]
+
+
+def test_decode_show_with_episodes_streams_episodes():
+    chunks = iter([
+        b'{"id":1, "name": "test-show", "premiered": "2020-01-01", "status": "Ended",',
+        b' "url": "https:/www.example.com/1", "externals":{"tmdb": "111"}, "updated": 0, "_embedded": {"episodes": [{"id": 1, "season": 1, "number": 1,',
+        b' "name": "The first episode", "airdate": "2020-01-01", "runtime": 60}, {"id": 2',
+        b', "season": 1, "number": 2, "name": "The second episode", "airdate": "2020-01-02", "runtime": 60}]}}',
+    ])
+
+    raw_show, episodes = decode_show_with_episodes(chunks)
+
+    assert raw_show['name'] == 'test-show'
+    assert next(episodes) == tv_maze_episode
+    # the second episode is not read before it is asked for
+    assert next(chunks)
+    with pytest.raises(StreamError):
+        next(episodes)
+
+
+def test_decode_show_with_episodes_keeps_episodes_until_show_is_complete():
+    raw_show, episodes = decode_show_with_episodes([
+        b'{"_embedded": {"episodes": [{"id": 1, "season": 1, "number": 1, "name": "The first episode", ',
+        b'"airdate": "2020-01-01", "runtime": 60}]}, "id":1, "name": "test-show", "premiered": "2020-01-01", ',
+        b'"status": "Ended", "url": "https:/www.example.com/1", "externals":{"tmdb": "111"}}',
+    ])
+
+    assert raw_show['id'] == 1
+    assert list(episodes) == [tv_maze_episode]
+
+
 def test_show_search(test_api):
     response = get_response("""
 [
@@ -81,3 +163,155 @@ def test_show_search(test_api):
 
     test_api.http.request.assert_called_once_with('GET', 'https://api.tvmaze.com/search/shows', fields={'q': 'name'})
     assert result == [tv_maze_show]
+
+
+def test_show_updates(test_api):
+    response = get_response("""{"1": 1700000000, "2": 1700000100}""")
+    test_api.http.request = MagicMock(return_value=response)
+
+    result = test_api.show_updates()
+
+    test_api.http.request.assert_called_once_with('GET', 'https://api.tvmaze.com/updates/shows', fields={})
+    assert result == {1: 1700000000, 2: 1700000100}
+
+
+def get_connection(status=200, data=b'[]', headers=None, will_close=False):
+    response = Mock(status=status, will_close=will_close)
+    response.read.return_value = data
+    response.getheaders.return_value = list((headers or {}).items())
+    connection = Mock()
+    connection.getresponse.return_value = response
+    return connection
+
+
+def test_http_client_reuses_connection():
+    connection = get_connection()
+    client = HTTPClient()
+    with patch('http.client.HTTPSConnection', return_value=connection) as connection_class:
+        client.request('GET', 'https://api.tvmaze.com/shows/1')
+        client.request('GET', 'https://api.tvmaze.com/shows/2')
+
+    connection_class.assert_called_once_with('api.tvmaze.com', None, timeout=client.timeout)
+    assert connection.request.call_count == 2
+    connection.request.assert_called_with('GET', '/shows/2', headers={
+        'User-Agent': 'showtime-cli',
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+    })
+
+
+def test_http_client_decodes_gzip():
+    connection = get_connection(data=gzip.compress(b'{"id": 1}'), headers={'Content-Encoding': 'gzip'})
+    client = HTTPClient()
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        response = client.request('GET', 'https://api.tvmaze.com/search/shows', fields={'q': 'name'})
+
+    connection.request.assert_called_once()
+    assert connection.request.call_args.args[1] == '/search/shows?q=name'
+    assert response.data == b'{"id": 1}'
+
+
+def test_http_client_raises_on_error_status():
+    connection = get_connection(status=404, will_close=True)
+    client = HTTPClient()
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        with pytest.raises(HTTPError) as error:
+            client.request('GET', 'https://api.tvmaze.com/shows/0')
+
+    assert error.value.status == 404
+    connection.close.assert_called_once()
+
+
+def test_http_client_revalidates_cached_response(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('https://api.tvmaze.com/shows/1', b'{"id": 1}', {'ETag': '"v1"'})
+    connection = get_connection(status=304, data=b'')
+    client = HTTPClient(cache=cache)
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        response = client.request('GET', 'https://api.tvmaze.com/shows/1')
+
+    assert connection.request.call_args.kwargs['headers']['If-None-Match'] == '"v1"'
+    assert response.cached
+    assert response.data == b'{"id": 1}'
+
+
+def test_http_client_offline(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('https://api.tvmaze.com/shows/1', b'{"id": 1}', {})
+    client = HTTPClient(cache=cache, offline=True)
+    with patch('http.client.HTTPSConnection') as connection_class:
+        response = client.request('GET', 'https://api.tvmaze.com/shows/1')
+        with pytest.raises(CacheMissError):
+            client.request('GET', 'https://api.tvmaze.com/shows/2')
+
+    connection_class.assert_not_called()
+    assert response.data == b'{"id": 1}'
+
+
+def test_http_client_stream_gzip(tmp_path):
+    body = b'[' + b','.join(b'{"id": %d}' % i for i in range(1000)) + b']'
+    compressed = gzip.compress(body)
+    response = Mock(status=200, will_close=False)
+    response.getheaders.return_value = [('Content-Encoding', 'gzip')]
+    response.read = Mock(side_effect=[compressed[i:i + 100] for i in range(0, len(compressed), 100)] + [b''])
+    connection = Mock()
+    connection.getresponse.return_value = response
+    cache = ResponseCache(str(tmp_path))
+    client = HTTPClient(cache=cache)
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        items = list(iter_json_array(client.stream('GET', 'https://api.tvmaze.com/shows/1/episodes', chunk_size=100)))
+
+    assert len(items) == 1000
+    assert cache.get('https://api.tvmaze.com/shows/1/episodes').data == body
+
+
+def test_http_client_retries_with_retry_after():
+    unavailable = get_connection(status=503, headers={'Retry-After': '2'})
+    ok = get_connection(data=b'{"id": 1}')
+    delays = []
+    client = HTTPClient(retry=RetryPolicy(sleep=delays.append))
+    with patch('http.client.HTTPSConnection', side_effect=[unavailable, ok]):
+        unavailable.getresponse.return_value.will_close = True
+        response = client.request('GET', 'https://api.tvmaze.com/shows/1')
+
+    assert response.data == b'{"id": 1}'
+    assert delays == [2]
+
+
+def test_http_client_rate_limit_does_not_open_circuit():
+    limited = get_connection(status=429, headers={'Retry-After': '1'})
+    breaker = CircuitBreaker(failure_threshold=1)
+    client = HTTPClient(retry=RetryPolicy(max_attempts=2, breaker=breaker, sleep=lambda _: None))
+    with patch('http.client.HTTPSConnection', return_value=limited):
+        with pytest.raises(HTTPError):
+            client.request('GET', 'https://api.tvmaze.com/shows/1')
+
+    breaker.before_request('api.tvmaze.com')
+
+
+def test_http_client_gives_up_after_max_attempts():
+    connection = get_connection(status=500)
+    delays = []
+    client = HTTPClient(retry=RetryPolicy(max_attempts=3, sleep=delays.append, jitter=lambda: 1))
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        with pytest.raises(HTTPError) as error:
+            client.request('GET', 'https://api.tvmaze.com/shows/1')
+
+    assert error.value.status == 500
+    assert connection.request.call_count == 3
+    assert delays == [0.5, 1]
+
+
+def test_http_client_records_metrics(tmp_path):
+    connection = get_connection(data=b'{"id": 1}', headers={'Cache-Control': 'max-age=60'})
+    metrics = Metrics()
+    client = HTTPClient(cache=ResponseCache(str(tmp_path)), metrics=metrics)
+    with patch('http.client.HTTPSConnection', return_value=connection):
+        client.request('GET', 'https://api.tvmaze.com/shows/1')
+        client.request('GET', 'https://api.tvmaze.com/shows/1')
+
+    shows = metrics.summary()['endpoints']['/shows/{id}']
+    assert shows['requests'] == 2
+    assert shows['cache_hits'] == 1
+    assert shows['bytes'] == 9
+    assert shows['statuses'] == {'200': 2}
@@ -0,0 +1,64 @@
+"""Showtime Cache Module Tests"""
+
+import os
+
+import pytest
+
+from showtime.cache import ResponseCache, get_max_age
+
+
+@pytest.fixture
+def test_cache(tmp_path) -> ResponseCache:
+    return ResponseCache(str(tmp_path), max_size=1000)
+
+
+def test_put_get(test_cache):
+    test_cache.put('https://example.com/1', b'[]', {'ETag': '"abc"', 'Cache-Control': 'max-age=60'}, now=1000)
+
+    entry = test_cache.get('https://example.com/1')
+
+    assert entry.data == b'[]'
+    assert entry.is_fresh(1059)
+    assert not entry.is_fresh(1060)
+    assert entry.conditional_headers() == {'If-None-Match': '"abc"'}
+
+
+def test_get_missing(test_cache):
+    assert test_cache.get('https://example.com/1') is None
+
+
+def test_no_store(test_cache):
+    test_cache.put('https://example.com/1', b'[]', {'Cache-Control': 'no-store'})
+
+    assert test_cache.get('https://example.com/1') is None
+
+
+def test_refresh(test_cache):
+    entry = test_cache.put('https://example.com/1', b'[]', {'Last-Modified': 'yesterday'}, now=1000)
+
+    test_cache.refresh(entry, {'Cache-Control': 'max-age=10'}, now=2000)
+
+    refreshed = test_cache.get('https://example.com/1')
+    assert refreshed.is_fresh(2005)
+    assert refreshed.conditional_headers() == {'If-Modified-Since': 'yesterday'}
+
+
+def test_evict_least_recently_used(test_cache):
+    test_cache.put('https://example.com/1', b'x' * 300, {})
+    test_cache.put('https://example.com/2', b'x' * 300, {})
+    os.utime(test_cache._entry_path('https://example.com/1'), (1, 1))
+    test_cache.put('https://example.com/3', b'x' * 300, {})
+
+    assert test_cache.get('https://example.com/1') is None
+    assert test_cache.get('https://example.com/2') is not None
+    assert test_cache.get('https://example.com/3') is not None
+
+
+@pytest.mark.parametrize('headers,expected', [
+    ({}, 0),
+    ({'cache-control': 'public, max-age=3600'}, 3600),
+    ({'Cache-Control': 'no-cache, max-age=3600'}, 0),
+    ({'Cache-Control': 'max-age=bad'}, 0),
+])
+def test_get_max_age(headers, expected):
+    assert get_max_age(headers) == expected
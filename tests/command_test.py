@@ -8,7 +8,7 @@ from cmd2 import CommandResult
 from helpers import decorated_episode, episode, show, tv_maze_show
 
 from showtime.command import Showtime
-from showtime.showtime import ShowtimeApp
+from showtime.showtime import ShowtimeApp, WatchtimePatch
 
 
 class ShowtimeTester(cmd2_ext_test.ExternalTestMixin, Showtime):
@@ -48,6 +48,15 @@ def test_config(test_app):
     assert out.data is None
 
 
+def test_precmd_refreshes_database(test_app):
+    test_app.app.database_refresh = MagicMock()
+
+    statement = test_app.precmd('config')
+
+    test_app.app.database_refresh.assert_called_once_with()
+    assert statement == 'config'
+
+
 def test_search(test_app):
     """tests search command"""
     test_app.app.show_search_api = MagicMock(return_value=[tv_maze_show])
@@ -66,6 +75,15 @@ def test_search(test_app):
     assert out.data is None
 
 
+def test_follow_bulk(test_app):
+    test_app.app.shows_follow = MagicMock(return_value={3: ValueError('not found')})
+
+    out = test_app.app_cmd("follow 1,2,3")
+
+    assert test_app.app.shows_follow.call_args.args[0] == [1, 2, 3]
+    assert str(out.stderr).strip() == 'Failed to follow show 3: not found'
+
+
 def test_episodes(test_app):
     """tests episodes command"""
     test_app.app.show_get = MagicMock(return_value=show)
@@ -106,22 +124,30 @@ def test_unset_show(test_app):
 
 
 def test_completed(test_app):
-    test_app.app.show_get_completed = MagicMock(return_value=[show])
+    test_app.app.show_get_completed = MagicMock(return_value=[show | {'last_watched': '2021-01-01T10:00:00'}])
 
     out = test_app.app_cmd("completed")
 
-    test_app.app.show_get_completed.assert_called_with()
+    test_app.app.show_get_completed.assert_called_with(None)
     assert isinstance(out, CommandResult)
     assert str(out.stdout).strip() == """
-+Completed shows-----+------------+--------+
-| # | ID | Name      | Premiered  | Status |
-+---+----+-----------+------------+--------+
-| 1 |  1 | test-show | 2020-01-01 | Ended  |
-+---+----+-----------+------------+--------+
++Completed shows-----+------------+--------+--------------+
+| # | ID | Name      | Premiered  | Status | Last watched |
++---+----+-----------+------------+--------+--------------+
+| 1 |  1 | test-show | 2020-01-01 | Ended  | 2021-01-01   |
++---+----+-----------+------------+--------+--------------+
 """.strip()
     assert out.data is None
 
 
+def test_completed_limit(test_app):
+    test_app.app.show_get_completed = MagicMock(return_value=[])
+
+    test_app.app_cmd("completed 5")
+
+    test_app.app.show_get_completed.assert_called_with(5)
+
+
 def test_sync(test_app):
     test_app.app.sync = MagicMock()
     out = test_app.app_cmd("sync")
@@ -132,6 +158,28 @@ def test_sync(test_app):
     assert out.data is None
 
 
+def test_sync_incremental(test_app):
+    test_app.app.sync = MagicMock()
+    test_app.app_cmd("sync --incremental")
+
+    assert test_app.app.sync.call_args.kwargs['incremental'] is True
+    assert test_app.app.sync.call_args.kwargs['all'] is False
+
+
+def test_sync_report(test_app, tmp_path):
+    report_file = tmp_path / 'report.json'
+    metrics = Mock()
+    test_app.app.sync = MagicMock()
+    test_app.app.metrics_get = MagicMock(return_value=metrics)
+
+    out = test_app.app_cmd(f"sync --report {report_file}")
+
+    metrics.reset.assert_called_once()
+    assert metrics.write_report.call_args.args[0] == str(report_file)
+    assert metrics.write_report.call_args.args[1]['failed_shows'] == []
+    assert f'Report written to {report_file}' in str(out.stderr)
+
+
 def test_watch(test_app):
     test_app.app.episode_update_watched = MagicMock()
     out = test_app.app_cmd("watch 1,2")
@@ -324,12 +372,23 @@ def test_new_unwatched(test_app):
     assert out.data is None
 
 
+def test_patch_watchtime(test_app):
+    test_app.app.episodes_patch_watchtime = MagicMock(return_value=WatchtimePatch(2, [(3, 'unknown episode 4')]))
+
+    out = test_app.app_cmd("patch_watchtime watchtime.csv")
+
+    test_app.app.episodes_patch_watchtime.assert_called_once_with('watchtime.csv')
+    assert str(out.stdout).strip() == 'Imported 2 watch times'
+    assert str(out.stderr).strip() == 'Rejected 1 rows\n\tLine 3: unknown episode 4'
+
+
 def test_watching_stats(test_app):
-    test_app.app.episodes_get_watched = MagicMock(return_value=[episode | {'watched': '2020-01-01'}])
+    test_app.app.watch_events_get = MagicMock(return_value=[
+        {'episode_id': 1, 'show_id': 1, 'timestamp': '2020-01-01T10:00:00', 'runtime': 60}])
 
     out = test_app.app_cmd("watching_stats")
 
-    test_app.app.episodes_get_watched.assert_called_once()
+    test_app.app.watch_events_get.assert_called_once()
     assert isinstance(out, CommandResult)
     assert str(out.stdout).strip() == """
 Total watched episodes: 1
@@ -0,0 +1,88 @@
+"""Showtime Compact Storage Module Tests"""
+
+import io
+import json
+
+import pytest
+from showtime.compact import (CompactFormatError, CompactStorage, compact_to_json, decode_table, encode_table,
+                              json_to_compact, read_compact, write_compact)
+from showtime.database import get_compact_db, transaction
+
+from helpers import episode, tv_maze_show
+
+data = {
+    'show': {
+        '1': {'id': 1, 'name': 'show', 'premiered': '2020-01-01', 'status': 'Ended', 'externals': {}, 'synced': 5},
+        '2': {'id': 2, 'name': 'other', 'premiered': None, 'status': 'Running', 'externals': {'tmdb': '1'}},
+    },
+    'episode': {'3': episode},
+}
+
+
+def test_encode_table():
+    block = encode_table('show', data['show'])
+
+    assert json.loads(block) == {
+        'columns': ['id', 'name', 'premiered', 'status', 'externals'],
+        'rows': [[1, 1, 'show', '2020-01-01', 'Ended', {}, {'synced': 5}],
+                 [2, 2, 'other', None, 'Running', {'tmdb': '1'}]],
+    }
+    assert decode_table(block) == data['show']
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_write_read_compact(compress):
+    file = io.BytesIO()
+    write_compact(file, data, compress)
+    file.seek(0)
+
+    assert read_compact(file) == data
+
+
+def test_read_compact_errors():
+    with pytest.raises(CompactFormatError):
+        read_compact(io.BytesIO(b'{"show": {}}'))
+    file = io.BytesIO()
+    write_compact(file, data)
+    with pytest.raises(CompactFormatError):
+        read_compact(io.BytesIO(file.getvalue()[:-3]))
+
+
+def test_get_compact_db(tmp_path):
+    file_name = str(tmp_path / 'showtime.db')
+    with get_compact_db(file_name) as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_show(tv_maze_show)
+            transacted_db.insert_episodes([episode])
+
+    with get_compact_db(file_name) as database:
+        assert database.get_show(1)['name'] == 'test-show'
+        assert database.get_episode(1) == episode
+
+
+def test_get_compact_db_rollback(tmp_path):
+    file_name = str(tmp_path / 'showtime.db')
+    with get_compact_db(file_name) as database:
+        database.add_show(tv_maze_show)
+        database.flush()
+        with pytest.raises(ValueError):
+            with transaction(database) as transacted_db:
+                # more writes than the caching middleware would keep before writing on its own
+                for show_id in range(2, 1200):
+                    transacted_db.add_show(tv_maze_show._replace(id=show_id))
+                raise ValueError('failed')
+
+        assert list(CompactStorage(file_name).read()['show']) == ['1']
+    with get_compact_db(file_name) as database:
+        assert [show['id'] for show in database.get_shows()] == [1]
+
+
+def test_converters(tmp_path):
+    json_file_name = str(tmp_path / 'showtime.json')
+    with open(json_file_name, 'w', encoding='UTF-8') as json_file:
+        json.dump(data, json_file)
+
+    assert json_to_compact(json_file_name, str(tmp_path / 'showtime.db')) == 3
+    assert compact_to_json(str(tmp_path / 'showtime.db'), str(tmp_path / 'export.json')) == 3
+    with open(tmp_path / 'export.json', encoding='UTF-8') as export_file:
+        assert json.load(export_file) == data
@@ -1,9 +1,11 @@
 """Showtime Database Module Tests"""
 
-from datetime import datetime
+from datetime import date, datetime
+
+from unittest.mock import Mock
 
 import pytest
-from showtime.database import Database, get_memory_db, transaction
+from showtime.database import Database, date_ordinal, get_memory_db, transaction
 from showtime.types import ShowStatus, TVMazeShow, TVMazeEpisode
 
 from helpers import decorated_episode, episode, show, tv_maze_show, tv_maze_episode
@@ -49,6 +51,16 @@ def test_get_active_shows():
     assert active[0]['name'] == "show 1"
 
 
+def test_update_show_synced():
+    with get_memory_db() as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_show(get_tv_maze_show())
+            transacted_db.update_show_synced(1, 1700000000)
+        stored = database.get_show(1)
+
+    assert stored['synced'] == 1700000000
+
+
 def test_watch():
     show1 = get_tv_maze_show(name="show 1")
     episode1 = get_tv_maze_episode(id=1, name="episode1", number=1)
@@ -67,6 +79,65 @@ def test_watch():
     assert episode1db['watched'] != episode2db['watched']
 
 
+def test_watch_events():
+    with get_memory_db() as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_episode(1, get_tv_maze_episode(id=1))
+            transacted_db.add_episode(1, get_tv_maze_episode(id=2, number=2))
+            transacted_db.update_watched(1, True, datetime(2021, 5, 5, 23, 0))
+            transacted_db.update_watched(2, True, datetime(2021, 5, 6, 10, 0))
+            transacted_db.update_watched(1, True, datetime(2021, 6, 1, 20, 0))
+
+        assert [(event['episode_id'], event['timestamp']) for event in database.get_watch_events()] == [
+            (1, '2021-05-05T23:00:00'), (2, '2021-05-06T10:00:00'), (1, '2021-06-01T20:00:00')]
+        between = database.get_watch_events(date(2021, 5, 6), date(2021, 6, 1))
+        assert [event['episode_id'] for event in between] == [2, 1]
+        assert [event['episode_id'] for event in database.get_watch_events(to_date=date(2021, 5, 5))] == [1]
+        assert database.get_episode(1)['watched'] == '2021-06-01T20:00:00'
+
+        # marking as not watched retracts all watches
+        database.update_watched(1, False, datetime(2021, 7, 1))
+        assert [event['episode_id'] for event in database.get_watch_events()] == [2]
+        assert database.get_episode(1)['watched'] == ''
+        assert [ep['id'] for ep in database.get_unwatched(datetime(2022, 1, 1))] == [1]
+
+
+def test_bulk_watch_skips_watched_episodes():
+    with get_memory_db() as database:
+        with transaction(database) as transacted_db:
+            for number in range(1, 4):
+                transacted_db.add_episode(1, get_tv_maze_episode(id=number, number=number))
+            transacted_db.update_watched_episodes([1, 2], True, datetime(2021, 5, 5))
+            assert transacted_db.update_watched_show(1, True, datetime(2021, 6, 1)) == [3]
+
+        assert [event['episode_id'] for event in database.get_watch_events()] == [1, 2, 3]
+        assert database.get_episode(1)['watched'] == '2021-05-05T00:00:00'
+
+        database.update_watched_show(1, False, datetime(2021, 7, 1))
+        assert database.get_watch_events() == []
+        assert database.get_watched_episodes() == []
+
+
+def test_indexed_queries():
+    with get_memory_db() as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_episode(1, get_tv_maze_episode(id=1, season=2, airdate='2020-01-01'))
+            transacted_db.add_episode(1, get_tv_maze_episode(id=2, season=1, airdate='2020-02-01'))
+            transacted_db.add_episode(2, get_tv_maze_episode(id=3, airdate='2030-01-01'))
+            transacted_db.update_watched(1, True, datetime(2021, 5, 5, 23, 0))
+            transacted_db.update_episodes([({'show_id': 2}, 2)])
+
+        assert sorted(ep['id'] for ep in database.get_episodes(2)) == [2, 3]
+        assert [ep['id'] for ep in database.get_unwatched(datetime(2021, 1, 1))] == [2]
+        assert [ep['id'] for ep in database.seen_between(date(2021, 5, 1), date(2021, 5, 5))] == [1]
+        assert database.seen_between(date(2021, 5, 6), date(2021, 6, 1)) == []
+        assert [ep['id'] for ep in database.aired_unseen_between(date(2020, 1, 1), date(2020, 2, 1))] == [2]
+        assert [ep['id'] for ep in database.get_watched_episodes()] == [1]
+
+        database.delete_episode(1)
+        assert database.get_watched_episodes() == []
+
+
 @pytest.fixture
 def test_database() -> Database:
     return get_memory_db()
@@ -117,6 +188,56 @@ def test_delete_episode(test_database):
     assert result == []
 
 
+def test_update_watched_times(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(2, get_tv_maze_episode(id=2))
+
+    found = test_database.update_watched_times([(1, datetime(2021, 1, 1)), (3, datetime(2021, 1, 2)),
+                                                (2, datetime(2021, 1, 3)), (1, datetime(2021, 1, 4))])
+
+    assert found == [1, 2, 1]
+    assert test_database.get_episode(1)['watched'] == '2021-01-04T00:00:00'
+    assert test_database.get_episode(2)['watched'] == '2021-01-03T00:00:00'
+    assert [(event['episode_id'], event['timestamp']) for event in test_database.get_watch_events()] == [
+        (2, '2021-01-03T00:00:00'), (1, '2021-01-04T00:00:00')]
+    assert test_database.get_unwatched(datetime(2022, 1, 1)) == []
+
+
+def test_update_watched_times_replaces_last_watch(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=10))
+    test_database.update_watched(10, True, datetime(2020, 1, 1))
+    test_database.update_watched(10, True, datetime(2021, 1, 1))
+
+    assert test_database.update_watched_times([(10, datetime(2020, 6, 1))]) == [10]
+
+    assert [event['timestamp'] for event in test_database.get_watch_events()] == [
+        '2020-01-01T00:00:00', '2020-06-01T00:00:00']
+    assert test_database.get_episode(10)['watched'] == '2020-06-01T00:00:00'
+    assert test_database.table('episode:1').all()[0]['watched_ordinal'] == date(2020, 6, 1).toordinal()
+
+
+def test_get_show_names(test_database):
+    test_database.add_show(get_tv_maze_show(id=1, name='show 1'))
+    names = test_database.get_show_names()
+
+    assert names == {1: 'show 1'}
+    assert test_database.get_show_names() is names
+
+    test_database.add_show(get_tv_maze_show(id=2, name='show 2'))
+    test_database.update_show(1, get_tv_maze_show(id=1, name='renamed'))
+    assert test_database.get_show_names() == {1: 'renamed', 2: 'show 2'}
+
+
+def test_delete_episodes(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2, number=2))
+    test_database.add_episode(2, get_tv_maze_episode(id=3))
+
+    assert len(test_database.delete_episodes([1, 3, 4])) == 2
+    assert [ep['id'] for ep in test_database.get_all_episodes()] == [2]
+    assert test_database.get_episode(3) is None
+
+
 def test_insert_episodes(test_database):
     result = test_database.insert_episodes([episode])
     assert result == [1]
@@ -157,6 +278,14 @@ def test_get_unwatched(test_database):
     assert result == []
 
 
+def test_get_unwatched_cached_per_day(test_database):
+    test_database.get_unwatched(datetime(2021, 1, 1, 1))
+    test_database.get_unwatched(datetime(2021, 1, 1, 23, 59))
+
+    assert test_database.query_cache.hits == 1
+    assert len(test_database.query_cache) == 1
+
+
 def test_seen_between(test_database):
     result = test_database.seen_between(datetime(2021, 1, 1, 1), datetime(2022, 1, 1, 1))
     assert result == []
@@ -180,3 +309,143 @@ def test_get_all_episodes(test_database):
 def test_get_shows_by_ids(test_database):
     result = test_database.get_shows_by_ids([1])
     assert result == []
+
+
+def test_date_ordinal():
+    assert date_ordinal('2020-01-02') == date(2020, 1, 2).toordinal()
+    assert date_ordinal('2021-05-05T23:00:00+02:00') == date(2021, 5, 5).toordinal()
+    assert date_ordinal('May 5 2021') == date(2021, 5, 5).toordinal()
+    assert date_ordinal('') == 0
+    assert date_ordinal(None) == 0
+    assert date_ordinal('not a date') == 0
+
+
+def test_migrate(test_database):
+    test_database.table('episode').insert(episode | {'watched': '2021-01-01T10:00:00'})
+
+    assert test_database.migrate() == 4
+    assert test_database.migrate() == 0
+    assert test_database.table('episode').all() == []
+    assert test_database.table('episode:1').all() == [test_database.get_episode(1) | {
+        'airdate_ordinal': date(2020, 1, 1).toordinal(), 'watched_ordinal': date(2021, 1, 1).toordinal()}]
+    assert [ep['id'] for ep in test_database.seen_between(date(2021, 1, 1), date(2021, 1, 1))] == [1]
+
+
+def test_episodes_exclude_date_ordinals(test_database):
+    test_database.insert_episodes([episode])
+    test_database.update_watched(1, True, datetime(2021, 1, 1))
+
+    assert set(test_database.get_episodes(1)[0]) == set(episode)
+    assert [set(ep) for ep in test_database.get_all_episodes()] == [set(episode)]
+    assert [set(ep) for ep in test_database.seen_between(date(2021, 1, 1), date(2021, 1, 1))] == [set(episode)]
+
+
+def test_show_stats_maintained():
+    with get_memory_db() as database:
+        database.add_show(get_tv_maze_show(id=1, premiered='2020'))
+        database.add_show(get_tv_maze_show(id=2, premiered='2019'))
+        database.insert_episodes([episode | {'id': 1, 'show_id': 1}, episode | {'id': 2, 'show_id': 1},
+                                  episode | {'id': 3, 'show_id': 2}])
+        assert [(s['id'], s['total'], s['seen']) for s in database.get_unfinished_shows()] == [(2, 1, 0), (1, 2, 0)]
+
+        database.update_watched_episodes([1, 3], True, datetime(2021, 1, 2))
+        database.update_watched(2, True, datetime(2021, 1, 1))
+        assert database.get_unfinished_shows() == []
+        assert [s['id'] for s in database.get_completed_shows()] == [1, 2]
+
+        database.update_watched(1, False, datetime(2021, 1, 3))
+        assert [(s['id'], s['seen']) for s in database.get_unfinished_shows()] == [(1, 1)]
+
+        database.delete_episode(1)
+        assert database.get_unfinished_shows() == []
+        assert [s['id'] for s in database.get_completed_shows()] == [1, 2]
+
+
+def test_get_completed_shows_limit(test_database):
+    for show_id in range(1, 5):
+        test_database.add_show(get_tv_maze_show(id=show_id))
+        test_database.insert_episodes([episode | {'id': show_id, 'show_id': show_id}])
+        test_database.update_watched(show_id, True, datetime(2021, 1, 5 - show_id))
+
+    assert [(s['id'], s['last_watched']) for s in test_database.get_completed_shows(limit=1)] == [
+        (1, '2021-01-04T00:00:00')]
+    assert [s['id'] for s in test_database.get_completed_shows()] == [4, 3, 2, 1]
+    assert [s['id'] for s in test_database.get_completed_shows(2, offset=1)] == [3, 2]
+    assert [s['id'] for s in test_database.get_completed_shows(offset=3)] == [4]
+
+
+def test_rebuild_show_stats(test_database):
+    test_database.add_show(tv_maze_show)
+    test_database.table('episode:1').insert(episode | {'show_id': 1})
+
+    assert test_database.get_unfinished_shows() == []
+    assert test_database.rebuild_show_stats() == 1
+    assert [s['id'] for s in test_database.get_unfinished_shows()] == [1]
+
+
+def test_transaction_rollback():
+    with get_memory_db() as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_show(tv_maze_show)
+            transacted_db.insert_episodes([episode | {'show_id': 1}])
+
+        with pytest.raises(RuntimeError):
+            with transaction(database) as transacted_db:
+                transacted_db.update_watched(1, True, datetime(2021, 1, 1))
+                transacted_db.insert_episodes([episode | {'id': 2, 'show_id': 1}])
+                transacted_db.delete_episode(1)
+                raise RuntimeError('sync failed')
+
+        assert database.get_episode(1)['watched'] == ''
+        assert database.get_episode(2) is None
+        assert [s['total'] for s in database.get_unfinished_shows()] == [1]
+        assert database.insert_episodes([episode | {'id': 3, 'show_id': 1}]) == [2]
+
+
+def test_nested_transaction_rollback():
+    database = get_memory_db()
+    database.flush = Mock()
+    with pytest.raises(RuntimeError):
+        with transaction(database) as outer_db:
+            outer_db.add_show(tv_maze_show)
+            with transaction(outer_db) as inner_db:
+                inner_db.add_episode(1, tv_maze_episode)
+            database.flush.assert_not_called()
+            raise RuntimeError('sync failed')
+
+    assert database.get_show(1) is None
+    assert database.get_episode(1) is None
+
+
+def test_migrate_on_first_use(test_database):
+    test_database.table('episode').insert(episode)
+    test_database.migrate_on_first_use()
+
+    assert test_database.get_episode(1) == episode
+    assert test_database.table('episode:1').all()[0]['airdate_ordinal'] == date(2020, 1, 1).toordinal()
+    assert test_database.migrate() == 0
+
+
+def test_migrate_on_first_use_survives_rollback(test_database):
+    test_database.table('episode').insert(episode)
+    test_database.migrate_on_first_use()
+
+    with pytest.raises(RuntimeError):
+        with transaction(test_database) as transacted_db:
+            transacted_db.add_show(tv_maze_show)
+            raise RuntimeError('sync failed')
+
+    assert [ep['id'] for ep in test_database.get_episodes(1)] == [1]
+    assert test_database.get_show(1) is None
+    assert test_database.migrate() == 0
+
+
+def test_reads_are_cached_until_write(test_database):
+    test_database.add_show(tv_maze_show)
+    test_database.get_shows()
+    test_database.get_shows()
+
+    assert test_database.query_cache.hits == 1
+    test_database.update_show_synced(1, 100)
+    assert test_database.get_shows()[0]['synced'] == 100
+    assert test_database.query_cache.misses == 2
@@ -0,0 +1,82 @@
+"""Showtime Index Module Tests"""
+
+import pytest
+from tinydb import TinyDB, where
+from tinydb.storages import MemoryStorage
+
+from showtime.index import HashIndex, IndexedTable, SortedIndex
+
+
+@pytest.fixture
+def table() -> IndexedTable:
+    database = TinyDB(storage=MemoryStorage)
+    return IndexedTable(database.storage, 'episode', hash_fields=('id', 'show_id'),
+                        sorted_fields=('airdate', 'watched'))
+
+
+def test_hash_index():
+    index = HashIndex()
+    index.add('a', 3)
+    index.add('a', 1)
+    index.add('b', 2)
+    index.remove('b', 2)
+    index.remove('c', 4)
+
+    assert index.get('a') == [1, 3]
+    assert index.get('b') == []
+    assert index.get(['a']) == []
+
+
+def test_sorted_index_between():
+    index = SortedIndex()
+    for doc_id, value in enumerate(['2020-03', '2020-01', '2020-02', '2020-02']):
+        index.add(value, doc_id)
+    index.remove('2020-02', 3)
+
+    assert index.between() == [1, 2, 0]
+    assert index.between('2020-02') == [2, 0]
+    assert index.between('2020-01', '2020-02', include_low=False) == [2]
+    assert index.between(high='2020-02', include_high=False) == [1]
+
+
+def test_indexed_table_insert(table):
+    table.insert_multiple([
+        {'id': 10, 'show_id': 1, 'airdate': '2020-01-02', 'watched': ''},
+        {'id': 11, 'show_id': 2, 'airdate': '2020-01-01', 'watched': ''},
+    ])
+    table.insert({'id': 12, 'show_id': 1, 'airdate': None, 'watched': ''})
+
+    assert table.get_doc_ids('show_id', 1) == [1, 3]
+    assert table.get_doc_ids_between('airdate', high='2020-01-01') == [2]
+    assert [doc['id'] for doc in table.get_documents([2, 5, 1])] == [11, 10]
+
+
+def test_indexed_table_update(table):
+    table.insert_multiple([
+        {'id': 10, 'show_id': 1, 'airdate': '2020-01-02', 'watched': ''},
+        {'id': 11, 'show_id': 1, 'airdate': '2020-01-01', 'watched': ''},
+    ])
+    assert table.get_doc_ids('id', 10) == [1]
+
+    table.update({'watched': '2021-01-01T10:00:00'}, where('id') == 10)
+    table.update_documents([({'show_id': 2}, 2), ({'show_id': 3}, 7)])
+
+    assert table.get_doc_ids_between('watched', low='', include_low=False) == [1]
+    assert table.get_doc_ids('show_id', 1) == [1]
+    assert table.get_doc_ids('show_id', 2) == [2]
+
+
+def test_indexed_table_remove(table):
+    table.insert_multiple([
+        {'id': 10, 'show_id': 1, 'airdate': '2020-01-02', 'watched': ''},
+        {'id': 11, 'show_id': 1, 'airdate': '2020-01-01', 'watched': ''},
+    ])
+    table.get_doc_ids('id', 10)
+
+    table.remove(doc_ids=[1])
+    assert table.get_doc_ids('id', 10) == []
+    assert table.get_doc_ids_between('airdate') == [2]
+
+    table.truncate()
+    table.insert({'id': 12, 'show_id': 1, 'airdate': '2020-01-01', 'watched': ''})
+    assert table.get_doc_ids('show_id', 1) == [1]
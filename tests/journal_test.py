@@ -0,0 +1,202 @@
+"""Showtime Journal Module Tests"""
+
+from datetime import datetime
+import json
+import os
+
+from showtime.database import get_journaled_db, transaction
+from showtime.journal import JournalStorage
+
+from helpers import tv_maze_show
+
+
+def add_episodes(database, count):
+    with transaction(database) as transacted_db:
+        transacted_db.add_show(tv_maze_show)
+        transacted_db.insert_episodes([{'id': episode_id, 'show_id': 1, 'season': 1, 'number': episode_id,
+                                        'name': f'episode {episode_id}', 'airdate': '2020-01-01',
+                                        'runtime': 30, 'watched': ''} for episode_id in range(1, count + 1)])
+
+
+def test_flush_appends_changed_documents(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 100)
+    journal_size = os.path.getsize(file_name + '.journal')
+
+    with transaction(database) as transacted_db:
+        transacted_db.update_watched(5, True, datetime(2021, 1, 1))
+
+    assert not os.path.exists(file_name)
+    assert 0 < os.path.getsize(file_name + '.journal') - journal_size < 500
+    database.close()
+
+
+def test_open_replays_journal(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 3)
+    with transaction(database) as transacted_db:
+        transacted_db.update_watched(2, True, datetime(2021, 1, 1))
+        transacted_db.delete_episode(3)
+    database.close()
+
+    reopened = get_journaled_db(file_name)
+
+    assert reopened.get_show(1)['name'] == 'test-show'
+    assert reopened.get_episode(2)['watched'] == '2021-01-01T00:00:00'
+    assert reopened.get_episode(3) is None
+    reopened.close()
+
+
+def test_torn_journal_entry_is_dropped(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 1)
+    database.close()
+    valid_size = os.path.getsize(file_name + '.journal')
+    with open(file_name + '.journal', 'ab') as journal_file:
+        journal_file.write(b'{"episode": {"1": {"id"')
+
+    storage = JournalStorage(file_name)
+
+    assert storage.read()['episode:1']['1']['id'] == 1
+    assert os.path.getsize(file_name + '.journal') == valid_size
+
+
+def test_compaction(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name, compact_size=500)
+    add_episodes(database, 10)
+
+    assert os.path.getsize(file_name + '.journal') == 0
+    with open(file_name, encoding='UTF-8') as snapshot_file:
+        assert len(json.load(snapshot_file)['episode:1']) == 10
+    database.close()
+
+
+def test_unrecorded_write_compacts(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 2)
+
+    database.drop_table('episode:1')
+    database.flush()
+
+    with open(file_name, encoding='UTF-8') as snapshot_file:
+        assert 'episode:1' not in json.load(snapshot_file)
+    assert os.path.getsize(file_name + '.journal') == 0
+
+
+def test_refresh_takes_over_changes_of_other_process(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    shell = get_journaled_db(file_name)
+    add_episodes(shell, 2)
+    cron = get_journaled_db(file_name)
+
+    assert shell.storage.refresh() is False
+    with transaction(cron) as transacted_db:
+        transacted_db.update_watched(2, True, datetime(2021, 1, 1))
+
+    assert shell.get_episode(2)['watched'] == ''
+    shell.refresh()
+    assert shell.get_episode(2)['watched'] == '2021-01-01T00:00:00'
+    assert [episode['id'] for episode in shell.get_watched_episodes()] == [2]
+    cron.close()
+    shell.close()
+
+
+def test_concurrent_writes_are_merged(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    shell = get_journaled_db(file_name)
+    add_episodes(shell, 2)
+    cron = get_journaled_db(file_name)
+
+    cron.begin()
+    cron.update_episodes([({'name': 'renamed'}, 1)])
+    cron.insert_episodes([{'id': 3, 'show_id': 1, 'season': 1, 'number': 3, 'name': 'episode 3',
+                           'airdate': '2020-01-01', 'runtime': 30, 'watched': ''}])
+    with transaction(shell) as transacted_db:
+        transacted_db.update_watched(1, True, datetime(2021, 1, 1))
+        transacted_db.insert_episodes([{'id': 4, 'show_id': 1, 'season': 1, 'number': 4, 'name': 'episode 4',
+                                        'airdate': '2020-01-01', 'runtime': 30, 'watched': ''}])
+    cron.commit()
+    cron.close()
+    shell.close()
+
+    reopened = get_journaled_db(file_name)
+    assert reopened.get_episode(1)['name'] == 'renamed'
+    assert reopened.get_episode(1)['watched'] == '2021-01-01T00:00:00'
+    assert sorted(episode['id'] for episode in reopened.get_episodes(1)) == [1, 2, 3, 4]
+    assert [(show['total'], show['seen']) for show in reopened.get_unfinished_shows()] == [(4, 1)]
+    reopened.close()
+
+
+def test_refresh_after_compaction_by_other_process(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    shell = get_journaled_db(file_name)
+    add_episodes(shell, 2)
+    cron = get_journaled_db(file_name)
+
+    with transaction(cron) as transacted_db:
+        transacted_db.delete_episode(2)
+    cron.storage.compact()
+
+    shell.refresh()
+    assert shell.get_episode(2) is None
+    assert os.path.getsize(file_name + '.journal') == 0
+    cron.close()
+    shell.close()
+
+
+def test_files_are_opened_on_first_access(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 1)
+    database.close()
+    os.remove(file_name + '.lock')
+
+    reopened = get_journaled_db(file_name)
+    reopened.refresh()
+    assert not os.path.exists(file_name + '.lock')
+
+    assert reopened.get_show(1)['name'] == 'test-show'
+    assert os.path.exists(file_name + '.lock')
+    reopened.close()
+
+
+def test_read_table_parses_single_table(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 3)
+    database.storage.compact()
+    with transaction(database) as transacted_db:
+        transacted_db.update_watched(2, True, datetime(2021, 1, 1))
+    database.close()
+
+    storage = JournalStorage(file_name, sort_keys=True, indent=4)
+
+    assert list(storage.read_table('show')) == ['1']
+    assert 'episode:1' not in storage._data
+    assert storage.read_table('episode:1')['2']['watched'] == '2021-01-01T00:00:00'
+    assert storage.read() == JournalStorage(file_name).read()
+
+
+def test_show_operations_load_only_their_episodes(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    database = get_journaled_db(file_name)
+    add_episodes(database, 2)
+    with transaction(database) as transacted_db:
+        transacted_db.insert_episodes([{'id': 10, 'show_id': 2, 'season': 1, 'number': 1, 'name': 'other',
+                                        'airdate': '2020-01-01', 'runtime': 30, 'watched': ''}])
+    database.storage.compact()
+    database.close()
+
+    reopened = get_journaled_db(file_name)
+    with transaction(reopened) as transacted_db:
+        transacted_db.update_watched_show(1, True, datetime(2021, 1, 1))
+    assert [episode['id'] for episode in reopened.get_episodes(1)] == [1, 2]
+
+    assert 'episode:2' in reopened.storage._unparsed
+    reopened.close()
+    assert get_journaled_db(file_name).get_episode(2)['watched'] == '2021-01-01T00:00:00'
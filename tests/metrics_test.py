@@ -0,0 +1,43 @@
+"""Showtime Metrics Module Tests"""
+
+import json
+
+from showtime.metrics import Metrics, endpoint_name
+
+
+def test_endpoint_name():
+    assert endpoint_name('https://api.tvmaze.com/shows/12?embed=episodes') == '/shows/{id}'
+    assert endpoint_name('https://api.tvmaze.com/shows/12/episodes') == '/shows/{id}/episodes'
+    assert endpoint_name('https://api.tvmaze.com/search/shows?q=1') == '/search/shows'
+
+
+def test_summary():
+    metrics = Metrics()
+    metrics.record_request('https://api.tvmaze.com/shows/1', 200, 0.2, 100)
+    metrics.record_request('https://api.tvmaze.com/shows/2', 200, 0.0, 0, cached=True)
+    metrics.record_rate_limit_wait('https://api.tvmaze.com/shows/1', 1.5)
+    metrics.record_error('https://api.tvmaze.com/shows/3', TimeoutError())
+
+    summary = metrics.summary()
+
+    assert summary['requests'] == 2
+    assert summary['cache_hits'] == 1
+    assert summary['bytes'] == 100
+    shows = summary['endpoints']['/shows/{id}']
+    assert shows['statuses'] == {'200': 2}
+    assert shows['errors'] == {'TimeoutError': 1}
+    assert shows['latency']['histogram']['0.05'] == 1
+    assert shows['latency']['histogram']['0.25'] == 1
+    assert shows['rate_limit_wait'] == 1.5
+
+
+def test_write_report(tmp_path):
+    metrics = Metrics()
+    metrics.record_request('https://api.tvmaze.com/search/shows', 404, 0.1)
+    report_file = tmp_path / 'report.json'
+
+    metrics.write_report(str(report_file), {'duration': 1})
+
+    report = json.loads(report_file.read_text())
+    assert report['duration'] == 1
+    assert report['endpoints']['/search/shows']['statuses'] == {'404': 1}
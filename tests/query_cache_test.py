@@ -0,0 +1,74 @@
+"""Showtime Query Cache Module Tests"""
+
+from unittest.mock import MagicMock
+
+from showtime.query_cache import QueryCache, cached
+
+
+def test_get_caches_result():
+    cache = QueryCache()
+    compute = MagicMock(return_value=[1])
+
+    assert cache.get('key', compute) == [1]
+    assert cache.get('key', compute) == [1]
+
+    compute.assert_called_once()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_invalidate_drops_results():
+    cache = QueryCache()
+    cache.get('key', lambda: 1)
+
+    cache.invalidate()
+
+    assert cache.generation == 1
+    assert cache.get('key', lambda: 2) == 2
+
+
+def test_least_recently_used_result_is_evicted():
+    cache = QueryCache(max_size=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 1)
+
+    cache.get('c', lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get('a', lambda: 0) == 1
+    assert cache.get('b', lambda: 0) == 0
+
+
+def test_result_of_writing_query_is_not_cached():
+    cache = QueryCache()
+
+    def compute():
+        cache.invalidate()
+        return 1
+
+    cache.get('key', compute)
+
+    assert len(cache) == 0
+
+
+class Queries():
+    def __init__(self):
+        self.query_cache = QueryCache()
+        self.calls = 0
+
+    @cached
+    def get(self, ids, *, reverse=False):
+        self.calls += 1
+        return sorted(ids, reverse=reverse)
+
+
+def test_cached_method():
+    queries = Queries()
+
+    result = queries.get([2, 1])
+    result.append(3)
+
+    assert queries.get([2, 1]) == [1, 2]
+    assert queries.get([2, 1], reverse=True) == [2, 1]
+    assert queries.get({1: 1}) == [1]
+    assert queries.calls == 3
@@ -0,0 +1,60 @@
+"""Showtime Retry Module Tests"""
+
+import pytest
+
+from showtime.retry import CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('7') == 7
+    assert parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT', now=4) == 6
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_get_delay():
+    policy = RetryPolicy(backoff_base=1, backoff_max=10, jitter=lambda: 0.5)
+
+    assert policy.get_delay(1) == 0.5
+    assert policy.get_delay(3) == 2
+    assert policy.get_delay(10) == 5
+    assert policy.get_delay(1, retry_after=3) == 3
+    assert policy.get_delay(1, retry_after=60) == 10
+
+
+def test_should_retry_spends_budget():
+    policy = RetryPolicy(max_attempts=3, budget=RetryBudget(2))
+
+    assert policy.should_retry(1)
+    assert not policy.should_retry(3)
+    assert policy.should_retry(2)
+    assert not policy.should_retry(1)
+
+
+def test_retry_budget_refill():
+    budget = RetryBudget(1)
+    assert budget.spend()
+    assert not budget.spend()
+
+    budget.refill()
+
+    assert budget.spend()
+
+
+def test_circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.record_failure('example.com')
+    breaker.before_request('example.com')
+    breaker.record_failure('example.com')
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('example.com')
+    breaker.before_request('other.com')
+
+    now[0] = 10
+    breaker.before_request('example.com')
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('example.com')
+    breaker.record_success('example.com')
+    breaker.before_request('example.com')
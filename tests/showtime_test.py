@@ -4,7 +4,7 @@ from unittest.mock import MagicMock, Mock
 import pytest
 from helpers import decorated_episode, episode, show, show2, tv_maze_show, tv_maze_episode, get_tv_maze_episode
 
-from showtime.showtime import ShowtimeApp
+from showtime.showtime import DecoratedEpisodes, ShowtimeApp
 
 
 @pytest.fixture
@@ -41,18 +41,23 @@ def test_show_get_not_found(test_app):
 
 
 def test_show_get_completed(test_app):
-    test_app.database.get_shows_by_ids = MagicMock(return_value=[show])
-    test_app.database.get_all_episodes = MagicMock(return_value=iter([
-        episode | {'watched': '2020-01-01'}
-    ]))
+    test_app.database.get_completed_shows = MagicMock(return_value=[show])
 
     result = test_app.show_get_completed()
 
-    test_app.database.get_all_episodes.assert_called_once()
-    test_app.database.get_shows_by_ids.assert_called_once_with([1])
+    test_app.database.get_completed_shows.assert_called_once_with(None, 0)
     assert result == [show]
 
 
+def test_show_stats_rebuild(test_app):
+    test_app.database.rebuild_show_stats = MagicMock(return_value=2)
+
+    result = test_app.show_stats_rebuild()
+
+    test_app.database.rebuild_show_stats.assert_called_once_with()
+    assert result == 2
+
+
 def test_episodes_update_all_watched(test_app):
     test_app.database.update_watched_show = MagicMock(return_value=None)
 
@@ -72,14 +77,35 @@ def test_episodes_update_all_not_watched(test_app):
 
 
 def test_episodes_watched_between(test_app):
-    test_app.database.seen_between = MagicMock(return_value=[episode])
-    test_app.database.get_shows = MagicMock(return_value=[show, show2])
+    test_app.database.get_watch_events = MagicMock(return_value=[
+        {'episode_id': 1, 'show_id': 1, 'timestamp': '2020-01-01', 'runtime': 60},
+        {'episode_id': 1, 'show_id': 1, 'timestamp': '2020-02-01', 'runtime': 60},
+    ])
+    test_app.database.get_episodes = MagicMock(return_value=[episode])
+    test_app.database.get_show_names = MagicMock(return_value={1: show['name'], 2: show2['name']})
 
     result = test_app.episodes_watched_between(date(2020, 1, 1), date(2021, 1, 1))
 
-    test_app.database.seen_between.assert_called_once_with(date(2020, 1, 1), date(2021, 1, 1))
-    test_app.database.get_shows.assert_called_once()
-    assert result == [decorated_episode]
+    test_app.database.get_watch_events.assert_called_once_with(date(2020, 1, 1), date(2021, 1, 1))
+    test_app.database.get_episodes.assert_called_once_with(1)
+    assert list(result) == [decorated_episode | {'watched': '2020-01-01'},
+                            decorated_episode | {'watched': '2020-02-01'}]
+
+
+def test_watch_events_get(test_app):
+    test_app.database.get_watch_events = MagicMock(return_value=[])
+
+    assert test_app.watch_events_get() == []
+    test_app.database.get_watch_events.assert_called_once_with()
+
+
+def test_decorated_episodes():
+    episodes = DecoratedEpisodes([episode, episode | {'id': 2, 'show_id': 2}], {1: show['name'], 2: show2['name']})
+
+    assert len(episodes) == 2
+    assert episodes[0] == decorated_episode
+    assert [ep['show_name'] for ep in episodes[1:]] == [show2['name']]
+    assert 'show_name' not in episode
 
 
 def test_episodes_get(test_app):
@@ -154,13 +180,13 @@ def test_episodes_update_season_not_watched(test_app):
 
 def test_episodes_get_unwatched(test_app):
     test_app.database.get_unwatched = MagicMock(return_value=[episode])
-    test_app.database.get_shows = MagicMock(return_value=[show, show2])
+    test_app.database.get_show_names = MagicMock(return_value={1: show['name'], 2: show2['name']})
 
     result = test_app.episodes_get_unwatched(datetime(2020, 1, 1, 1, 0))
 
     test_app.database.get_unwatched.assert_called_once_with(datetime(2020, 1, 1, 1, 0))
-    test_app.database.get_shows.assert_called_once()
-    assert result == [decorated_episode]
+    test_app.database.get_show_names.assert_called_once()
+    assert list(result) == [decorated_episode]
 
 
 def test_episodes_watched_to_last_seen(test_app):
@@ -200,13 +226,13 @@ def test_episode_delete(test_app):
 
 def test_episodes_aired_unseen_between(test_app):
     test_app.database.aired_unseen_between = MagicMock(return_value=[episode])
-    test_app.database.get_shows = MagicMock(return_value=[show, show2])
+    test_app.database.get_show_names = MagicMock(return_value={1: show['name'], 2: show2['name']})
 
     result = test_app.episodes_aired_unseen_between(date(2020, 1, 1), date(2021, 1, 1))
 
-    test_app.database.get_shows.assert_called_once()
+    test_app.database.get_show_names.assert_called_once()
     test_app.database.aired_unseen_between.assert_called_once_with(date(2020, 1, 1), date(2021, 1, 1))
-    assert result == [decorated_episode]
+    assert list(result) == [decorated_episode]
 
 
 def test_episodes_get_watched(test_app):
@@ -220,16 +246,15 @@ def test_episodes_get_watched(test_app):
 
 def test_show_follow(test_app):
     test_app.database.get_active_shows = MagicMock(return_value=[show])
-    test_app.api.show_get = MagicMock(return_value=tv_maze_show)
-    test_app.api.episodes_list = MagicMock(return_value=[tv_maze_episode, get_tv_maze_episode(id=2)])
+    test_app.api.show_get_with_episodes = MagicMock(
+        return_value=(tv_maze_show, [tv_maze_episode, get_tv_maze_episode(id=2)]))
     test_app.database.get_episodes = MagicMock(return_value=[episode | {'name': 'old episode name name'}])
 
     result = test_app.sync()
 
     test_app.database.get_active_shows.assert_called_once()
-    test_app.api.show_get.assert_called_once_with(1)
+    test_app.api.show_get_with_episodes.assert_called_once_with(1)
     test_app.database.update_show.assert_called_once_with(1, tv_maze_show)
-    test_app.api.episodes_list.assert_called_once_with(1)
     test_app.database.get_episodes.assert_called_once_with(1)
     test_app.database.insert_episodes.assert_called_once_with([{
         'id': 2,
@@ -251,9 +276,149 @@ def test_show_follow(test_app):
     assert result == None
 
 
+def test_show_follow_single_request(test_app):
+    test_app.api.show_get_with_episodes = MagicMock(return_value=(tv_maze_show, [tv_maze_episode]))
+    test_app.database.add_show = MagicMock(return_value=1)
+    test_app.database.get_episodes = MagicMock(return_value=[])
+
+    result = test_app.show_follow(1)
+
+    test_app.api.show_get_with_episodes.assert_called_once_with(1)
+    test_app.api.show_get.assert_not_called()
+    test_app.api.episodes_list.assert_not_called()
+    test_app.database.add_show.assert_called_once_with(tv_maze_show)
+    assert result == tv_maze_show
+
+
+def test_shows_follow(test_app):
+    error = ValueError('not found')
+
+    def show_get_with_episodes(show_id):
+        if show_id == 3:
+            raise error
+        return tv_maze_show._replace(id=show_id), [get_tv_maze_episode(id=show_id * 10)]
+
+    test_app.api.show_get_with_episodes = MagicMock(side_effect=show_get_with_episodes)
+    test_app.database.add_show = MagicMock(side_effect=lambda tv_maze_show: tv_maze_show.id)
+    test_app.database.get_episodes = MagicMock(return_value=[])
+    progress = []
+
+    failures = test_app.shows_follow([1, 2, 3, 2], on_progress=lambda done, total: progress.append((done, total)))
+
+    assert failures == {3: error}
+    # the failed show is retried once at the end
+    assert test_app.api.show_get_with_episodes.call_count == 4
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    test_app.database.insert_episodes.assert_called_once()
+    inserted = test_app.database.insert_episodes.call_args.args[0]
+    assert sorted(episode['id'] for episode in inserted) == [10, 20]
+    test_app.database.commit.assert_called_once()
+
+
+def test_sync_episodes_from_iterator(test_app, monkeypatch):
+    monkeypatch.setattr('showtime.showtime.EPISODE_BATCH_SIZE', 2)
+    test_app.database.get_episodes = MagicMock(return_value=[])
+
+    test_app._sync_episodes(test_app.database, 1, (get_tv_maze_episode(id=i) for i in range(1, 6)))
+
+    test_app.database.get_episodes.assert_called_once_with(1)
+    assert [len(call.args[0]) for call in test_app.database.insert_episodes.call_args_list] == [2, 2, 1]
+
+
+def test_sync_episodes_changes(test_app):
+    watched = episode | {'watched': '2020-02-01T10:00:00'}
+    test_app.database.get_episodes = MagicMock(return_value=[
+        watched,
+        episode | {'id': 2, 'number': 2},
+        episode | {'id': 3, 'number': 3},
+    ])
+
+    test_app._sync_episodes(test_app.database, 1, [
+        get_tv_maze_episode(id=1, season=2, number=1),
+        get_tv_maze_episode(id=2, number=2),
+        get_tv_maze_episode(id=4, number=3),
+    ])
+
+    inserted = test_app.database.insert_episodes.call_args.args[0]
+    assert [episode['id'] for episode in inserted] == [4]
+    test_app.database.update_episodes.assert_called_once_with([({'name': 'The first episode', 'airdate': '2020-01-01',
+                                                                 'runtime': 60, 'season': 2, 'number': 1}, 1)])
+    test_app.database.delete_episodes.assert_called_once_with([3])
+
+
+def test_diff_episodes_renumbered(test_app):
+    changes = test_app._diff_episodes({1: episode}, 1, [get_tv_maze_episode(id=1, season=2, number=1)])
+
+    assert changes.inserts == []
+    assert [episode_id for _, episode_id in changes.updates] == [1]
+    assert changes.renumbered == [1]
+
+
+def test_sync_episodes_keeps_episodes_missing_upstream_list(test_app):
+    test_app.database.get_episodes = MagicMock(return_value=[episode])
+
+    test_app._sync_episodes(test_app.database, 1, [])
+
+    test_app.database.delete_episodes.assert_not_called()
+
+
+def test_sync_incremental(test_app):
+    test_app.database.get_active_shows = MagicMock(return_value=[
+        show | {'synced': 100},
+        show2 | {'synced': 100},
+    ])
+    test_app.api.show_updates = MagicMock(return_value={1: 100, 2: 200})
+    test_app.api.show_get_with_episodes = MagicMock(return_value=(tv_maze_show._replace(id=2, updated=200), []))
+    test_app.database.get_episodes = MagicMock(return_value=[])
+
+    test_app.sync(incremental=True)
+
+    test_app.api.show_updates.assert_called_once()
+    test_app.api.show_get_with_episodes.assert_called_once_with(2)
+    test_app.database.update_show_synced.assert_called_once_with(2, 200)
+
+
+def test_sync_reports_failed_shows(test_app):
+    error = ValueError('unavailable')
+    test_app.database.get_active_shows = MagicMock(return_value=[show])
+    test_app.api.show_get_with_episodes = MagicMock(side_effect=[error, (tv_maze_show, [])])
+    test_app.database.get_episodes = MagicMock(return_value=[])
+    on_show_failed = MagicMock()
+
+    test_app.sync(on_show_failed=on_show_failed)
+
+    assert test_app.api.show_get_with_episodes.call_count == 2
+    test_app.database.update_show.assert_called_once_with(1, tv_maze_show)
+    on_show_failed.assert_not_called()
+
+
 def test_sync(test_app):
     result = test_app.episodes_get_watched()
 
 
-def test_episodes_patch_watchtime(test_app):
-    pass
+def test_episodes_patch_watchtime(test_app, tmp_path, monkeypatch):
+    monkeypatch.setattr('showtime.showtime.PATCH_BATCH_SIZE', 2)
+    csv_file = tmp_path / 'watchtime.csv'
+    csv_file.write_text('1,2021-01-01T10:00:00\n2,1 Jan 2021 11:00\n\n3,not a date\nx,2021-01-01\n4,2021-01-02\n5\n')
+    test_app.database.update_watched_times = MagicMock(side_effect=lambda watches: [1, 2])
+
+    result = test_app.episodes_patch_watchtime(str(csv_file))
+
+    assert [call.args[0] for call in test_app.database.update_watched_times.call_args_list] == [
+        [(1, datetime(2021, 1, 1, 10, 0)), (2, datetime(2021, 1, 1, 11, 0))],
+        [(4, datetime(2021, 1, 2))],
+    ]
+    assert result.imported == 2
+    assert result.rejected == [
+        (4, "invalid watch time 'not a date'"),
+        (5, "invalid episode id 'x'"),
+        (6, 'unknown episode 4'),
+        (7, 'missing watch time'),
+    ]
+    test_app.database.commit.assert_called_once()
+
+
+def test_database_refresh(test_app):
+    test_app.database_refresh()
+
+    test_app.database.refresh.assert_called_once_with()
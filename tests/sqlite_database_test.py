@@ -0,0 +1,219 @@
+"""Showtime SQLite Database Module Tests"""
+
+from datetime import date, datetime
+import json
+
+import pytest
+from showtime.database import transaction
+from showtime.sqlite_database import SQLiteDatabase, migrate_json_to_sqlite
+from showtime.types import ShowStatus, TVMazeShow, TVMazeEpisode
+
+from helpers import episode, tv_maze_show, tv_maze_episode
+
+
+def get_tv_maze_show(id=1, name="show", premiered="2020", status="great", url="http://example.com", externals={"tmdb": "111"}) -> TVMazeShow:
+    return TVMazeShow(id=id, name=name, premiered=premiered, status=status, url=url, externals=externals)
+
+
+def get_tv_maze_episode(id=1, season=1, number=1, name="episode1", airdate="2020-10-10", runtime=30) -> TVMazeEpisode:
+    return TVMazeEpisode(id=id, season=season, number=number, name=name, airdate=airdate, runtime=runtime)
+
+
+@pytest.fixture
+def test_database() -> SQLiteDatabase:
+    return SQLiteDatabase()
+
+
+def test_add_show(test_database):
+    result = test_database.add_show(tv_maze_show)
+    assert result == 1
+    assert test_database.get_show(1) == {
+        'id': 1,
+        'name': 'test-show',
+        'premiered': '2020-01-01',
+        'status': 'Ended',
+        'externals': {'tmdb': '111'},
+    }
+
+
+def test_get_active_shows(test_database):
+    with transaction(test_database) as transacted_db:
+        transacted_db.add_show(get_tv_maze_show(name="show 1"))
+        transacted_db.add_show(get_tv_maze_show(id=2, name="show 2", status=ShowStatus.ENDED.value))
+    active = test_database.get_active_shows()
+
+    assert len(active) == 1
+    assert active[0]['name'] == "show 1"
+
+
+def test_update_show_synced(test_database):
+    test_database.add_show(tv_maze_show)
+
+    assert test_database.update_show_synced(1, 100) == [1]
+    assert test_database.get_show(1)['synced'] == 100
+
+
+def test_get_episodes_sorted(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=3, season=2, number=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2, season=1, number=2))
+    test_database.add_episode(2, get_tv_maze_episode(id=1, season=1, number=1))
+
+    assert [e['id'] for e in test_database.get_episodes(1)] == [2, 3]
+
+
+def test_update_episodes(test_database):
+    test_database.insert_episodes([episode])
+
+    assert test_database.update_episodes([({'name': 'renamed'}, 1), ({'name': 'missing'}, 2)]) == [1]
+    assert test_database.get_episode(1)['name'] == 'renamed'
+
+
+def test_watch_queries(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1, airdate='2020-01-01'))
+    test_database.add_episode(1, get_tv_maze_episode(id=2, airdate='2020-02-01'))
+    test_database.add_episode(1, get_tv_maze_episode(id=3, airdate='2030-01-01'))
+
+    assert test_database.update_watched(1, True, datetime(2021, 5, 5, 10)) == [1]
+
+    assert [e['id'] for e in test_database.get_unwatched(datetime(2021, 1, 1))] == [2]
+    assert [e['id'] for e in test_database.seen_between(date(2021, 5, 1), date(2021, 5, 5))] == [1]
+    assert test_database.seen_between(date(2021, 5, 6), date(2021, 6, 1)) == []
+    assert [e['id'] for e in test_database.aired_unseen_between(date(2020, 1, 1), date(2020, 2, 1))] == [2]
+    assert [e['id'] for e in test_database.get_watched_episodes()] == [1]
+
+
+def test_watch_events(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2, number=2))
+    test_database.update_watched(1, True, datetime(2021, 5, 5, 23))
+    test_database.update_watched(2, True, datetime(2021, 5, 6, 10))
+    test_database.update_watched(1, True, datetime(2021, 6, 1, 20))
+
+    assert [e['episode_id'] for e in test_database.get_watch_events()] == [1, 2, 1]
+    assert [e['episode_id'] for e in test_database.get_watch_events(date(2021, 5, 6), date(2021, 6, 1))] == [2, 1]
+    assert test_database.get_watch_events(to_date=date(2021, 5, 5)) == [
+        {'episode_id': 1, 'show_id': 1, 'timestamp': '2021-05-05T23:00:00', 'runtime': 30}]
+
+    test_database.update_watched(1, False, datetime(2021, 7, 1))
+    assert [e['episode_id'] for e in test_database.get_watch_events()] == [2]
+    assert test_database.get_episode(1)['watched'] == ''
+
+
+def test_bulk_watch_skips_watched_episodes(test_database):
+    for number in range(1, 4):
+        test_database.add_episode(1, get_tv_maze_episode(id=number, number=number))
+    test_database.update_watched_episodes([1, 2], True, datetime(2021, 5, 5))
+
+    assert test_database.update_watched_show(1, True, datetime(2021, 6, 1)) == [3]
+    assert [e['episode_id'] for e in test_database.get_watch_events()] == [1, 2, 3]
+    assert test_database.get_episode(1)['watched'] == '2021-05-05T00:00:00'
+
+    test_database.update_watched_show(1, False, datetime(2021, 7, 1))
+    assert test_database.get_watch_events() == []
+    assert test_database.get_watched_episodes() == []
+
+
+def test_update_watched_show_season(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1, season=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2, season=2))
+
+    assert test_database.update_watched_show_season(1, 2, True, datetime(2021, 1, 1)) == [2]
+    assert test_database.update_watched_episodes([1, 2], False, datetime(2021, 1, 1)) == [1, 2]
+    assert test_database.get_watched_episodes() == []
+
+
+def test_delete_episode(test_database):
+    test_database.add_episode(1, tv_maze_episode)
+
+    assert test_database.delete_episode(1) == [1]
+    assert test_database.get_episode(1) is None
+
+
+def test_update_watched_times(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2))
+
+    found = test_database.update_watched_times([(1, datetime(2021, 1, 1)), (3, datetime(2021, 1, 2)),
+                                                (2, datetime(2021, 1, 3)), (1, datetime(2021, 1, 4))])
+
+    assert found == [1, 2, 1]
+    assert test_database.get_episode(1)['watched'] == '2021-01-04T00:00:00'
+    assert [(e['episode_id'], e['timestamp']) for e in test_database.get_watch_events()] == [
+        (2, '2021-01-03T00:00:00'), (1, '2021-01-04T00:00:00')]
+
+
+def test_update_watched_times_replaces_last_watch(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=10))
+    test_database.update_watched(10, True, datetime(2020, 1, 1))
+    test_database.update_watched(10, True, datetime(2021, 1, 1))
+
+    assert test_database.update_watched_times([(10, datetime(2020, 6, 1))]) == [10]
+
+    assert [e['timestamp'] for e in test_database.get_watch_events()] == ['2020-01-01T00:00:00', '2020-06-01T00:00:00']
+    assert test_database.get_episode(10)['watched'] == '2020-06-01T00:00:00'
+
+
+def test_get_show_names(test_database):
+    test_database.add_show(get_tv_maze_show(id=1, name='show 1'))
+    test_database.add_show(get_tv_maze_show(id=2, name='show 2'))
+
+    assert test_database.get_show_names() == {1: 'show 1', 2: 'show 2'}
+
+
+def test_delete_episodes(test_database):
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2))
+    test_database.add_episode(2, get_tv_maze_episode(id=3))
+
+    assert test_database.delete_episodes([1, 3, 4]) == [1, 3]
+    assert [e['id'] for e in test_database.get_episodes(1)] == [2]
+
+
+def test_get_unfinished_shows(test_database):
+    test_database.add_show(get_tv_maze_show(id=1))
+    test_database.add_show(get_tv_maze_show(id=2))
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(1, get_tv_maze_episode(id=2))
+    test_database.add_episode(2, get_tv_maze_episode(id=3))
+    test_database.update_watched_episodes([1, 3], True, datetime(2021, 1, 1))
+
+    unfinished = test_database.get_unfinished_shows()
+
+    assert [(show['id'], show['total'], show['seen']) for show in unfinished] == [(1, 2, 1)]
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    json_file = tmp_path / 'showtime.json'
+    json_file.write_text(json.dumps({
+        'show': {'1': {'id': 1, 'name': 'test-show', 'premiered': '2020-01-01', 'status': 'Ended',
+                       'externals': {}, 'synced': 5}},
+        'episode': {'1': episode},
+        'episode:1': {'1': episode | {'id': 2, 'watched': '2021-01-01T10:00:00'}},
+    }))
+    sqlite_file = tmp_path / 'showtime.sqlite'
+
+    result = migrate_json_to_sqlite(str(json_file), str(sqlite_file))
+
+    assert result == (1, 2)
+    with SQLiteDatabase(str(sqlite_file)) as database:
+        assert database.get_show(1)['synced'] == 5
+        assert database.get_episode(1) == episode | {'show_id': 1}
+        assert database.get_episode(2) == episode | {'id': 2, 'show_id': 1, 'watched': '2021-01-01T10:00:00'}
+        # watches from before the watch events are logged once
+        assert [e['episode_id'] for e in database.get_watch_events()] == [2]
+
+
+def test_get_completed_shows(test_database):
+    test_database.add_show(get_tv_maze_show(id=1))
+    test_database.add_show(get_tv_maze_show(id=2))
+    test_database.add_episode(1, get_tv_maze_episode(id=1))
+    test_database.add_episode(2, get_tv_maze_episode(id=2))
+    test_database.add_episode(2, get_tv_maze_episode(id=3))
+    test_database.update_watched(1, True, datetime(2021, 1, 2))
+    test_database.update_watched_episodes([2, 3], True, datetime(2021, 1, 1))
+
+    assert [show['id'] for show in test_database.get_completed_shows()] == [2, 1]
+    assert [(show['id'], show['last_watched']) for show in test_database.get_completed_shows(1)] == [
+        (1, '2021-01-02T00:00:00')]
+    assert [show['id'] for show in test_database.get_completed_shows(1, 1)] == [2]
+    assert test_database.rebuild_show_stats() == 2
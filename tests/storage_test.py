@@ -0,0 +1,53 @@
+"""Showtime Storage Module Tests"""
+
+import os
+
+import pytest
+from showtime.database import get_cashed_write_db, transaction
+from showtime.storage import AtomicJSONStorage, atomic_write
+
+from helpers import tv_maze_show
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / 'data')
+    atomic_write(path, lambda file: file.write(b'old'))
+    atomic_write(path, lambda file: file.write(b'new'))
+
+    with open(path, 'rb') as data_file:
+        assert data_file.read() == b'new'
+    assert os.listdir(tmp_path) == ['data']
+
+
+def test_atomic_write_keeps_file_on_error(tmp_path):
+    path = str(tmp_path / 'data')
+    atomic_write(path, lambda file: file.write(b'old'))
+
+    def fail(file):
+        file.write(b'partial')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        atomic_write(path, fail)
+    with open(path, 'rb') as data_file:
+        assert data_file.read() == b'old'
+    assert os.listdir(tmp_path) == ['data']
+
+
+def test_atomic_json_storage(tmp_path):
+    storage = AtomicJSONStorage(str(tmp_path / 'showtime.json'))
+    storage.write({'show': {'1': {'id': 1}}})
+    storage.write({'show': {}})
+
+    assert storage.read() == {'show': {}}
+    storage.close()
+
+
+def test_cashed_write_db(tmp_path):
+    file_name = str(tmp_path / 'showtime.json')
+    with get_cashed_write_db(file_name) as database:
+        with transaction(database) as transacted_db:
+            transacted_db.add_show(tv_maze_show)
+
+    with get_cashed_write_db(file_name) as database:
+        assert database.get_show(1)['name'] == 'test-show'
@@ -0,0 +1,118 @@
+"""Showtime Sync Module Tests"""
+
+import threading
+import time
+from unittest.mock import Mock
+
+from helpers import tv_maze_episode, tv_maze_show
+
+from showtime.api import StreamError
+from showtime.retry import CircuitOpenError, RetryBudget, RetryPolicy
+from showtime.sync import SyncEngine
+
+
+def test_fetch_shows():
+    api = Mock()
+    api.show_get_with_episodes = Mock(
+        side_effect=lambda show_id: (tv_maze_show._replace(id=show_id), [tv_maze_episode]))
+    results = {}
+
+    failures = SyncEngine(api, concurrency=2).fetch_shows(
+        [1, 2, 3], lambda show_id, result: results.update({show_id: result}))
+
+    assert failures == {}
+    assert sorted(results) == [1, 2, 3]
+    assert results[2] == (tv_maze_show._replace(id=2), [tv_maze_episode])
+
+
+def test_fetch_shows_bounded_and_coalesced():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def show_get_with_episodes(show_id):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return tv_maze_show, []
+
+    api = Mock()
+    api.show_get_with_episodes = Mock(side_effect=show_get_with_episodes)
+    results = []
+
+    SyncEngine(api, concurrency=2).fetch_shows([1, 2, 3, 4, 1], lambda show_id, _: results.append(show_id))
+
+    assert in_flight[1] <= 2
+    assert api.show_get_with_episodes.call_count == 4
+    assert sorted(results) == [1, 2, 3, 4]
+
+
+def test_fetch_shows_collects_failures():
+    error = ValueError('boom')
+
+    def show_get_with_episodes(show_id):
+        if show_id == 2:
+            raise error
+        return tv_maze_show, []
+
+    api = Mock()
+    api.show_get_with_episodes = Mock(side_effect=show_get_with_episodes)
+    results = []
+
+    failures = SyncEngine(api).fetch_shows([1, 2], lambda show_id, _: results.append(show_id))
+
+    assert failures == {2: error}
+    assert results == [1]
+
+
+def test_fetch_shows_waits_for_open_circuit_before_retrying():
+    attempts = []
+
+    def show_get_with_episodes(show_id):
+        attempts.append(show_id)
+        if len(attempts) <= 2:
+            raise CircuitOpenError('api.tvmaze.com', 5.0 * len(attempts))
+        return tv_maze_show, []
+
+    api = Mock()
+    api.show_get_with_episodes = Mock(side_effect=show_get_with_episodes)
+    delays = []
+    results = []
+
+    failures = SyncEngine(api, concurrency=1, sleep=delays.append).fetch_shows(
+        [1, 2], lambda show_id, _: results.append(show_id))
+
+    assert failures == {}
+    assert delays == [10.0]
+    assert sorted(results) == [1, 2]
+
+
+def test_fetch_shows_counts_failed_episode_streams():
+    def episodes(show_id):
+        yield tv_maze_episode
+        if show_id == 2:
+            raise StreamError('connection reset')
+
+    api = Mock()
+    api.show_get_with_episodes = Mock(side_effect=lambda show_id: (tv_maze_show, episodes(show_id)))
+    results = []
+
+    failures = SyncEngine(api).fetch_shows([1, 2], lambda show_id, result: results.append((show_id, list(result[1]))),
+                                           retry_failures=False)
+
+    assert list(failures) == [2]
+    assert results == [(1, [tv_maze_episode])]
+
+
+def test_fetch_shows_refills_retry_budget():
+    budget = RetryBudget(2)
+    budget.retries = 0
+    api = Mock()
+    api.retry = Mock(return_value=RetryPolicy(budget=budget))
+    api.show_get_with_episodes = Mock(return_value=(tv_maze_show, []))
+
+    SyncEngine(api).fetch_shows([1], lambda show_id, _: None)
+
+    assert budget.retries == 2
@@ -0,0 +1,34 @@
+"""Showtime Throttle Module Tests"""
+
+from showtime.throttle import TokenBucket
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_burst_then_wait():
+    clock = FakeClock()
+    bucket = TokenBucket(calls=2, period=10, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 5
+    assert clock.now == 5
+
+
+def test_try_acquire_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(calls=1, period=1, clock=clock, sleep=clock.sleep)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 1
+    clock.now = 1
+    assert bucket.try_acquire() == 0